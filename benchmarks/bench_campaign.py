@@ -0,0 +1,193 @@
+"""
+End-to-end campaign benchmark: drives EmailBot through a scripted conversation
+(/start -> sheet -> columns -> prompt -> subject -> draft -> refine -> approve, then the
+queued campaign runs to completion) against the
+fakes in benchmarks/fakes.py and reports per-stage latency, send throughput, memory peak
+and the slowest instrumented operations for each sheet size.
+
+    python benchmarks/bench_campaign.py [--sizes 100,10000,100000] [--gmail-latency 0.002]
+                                        [--gmail-errors 0.01] [--batch-size 0] [--concurrency 8]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "execution"))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="100,10000,100000", help="comma-separated prospect counts")
+    parser.add_argument("--sheets-latency", type=float, default=0.05)
+    parser.add_argument("--gmail-latency", type=float, default=0.002)
+    parser.add_argument("--gmail-errors", type=float, default=0.0, help="fraction of sends failing with 429")
+    parser.add_argument("--openai-latency", type=float, default=0.5)
+    parser.add_argument("--openai-errors", type=float, default=0.0)
+    parser.add_argument("--telegram-latency", type=float, default=0.01)
+    parser.add_argument("--telegram-interval", type=float, default=0.1,
+                        help="seconds between campaign messages to one chat (Telegram allows ~1)")
+    parser.add_argument("--draft-kb", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=0, help="Gmail sends/s (0 = unthrottled)")
+    parser.add_argument("--batch-size", type=int, default=0)
+    parser.add_argument("--shards", type=int, default=0, help="send through N worker processes (sharding.py)")
+    parser.add_argument("--page-errors", type=int, default=0,
+                        help="503s in a row on the second sheet page (more than SHEET_READ_RETRIES fails the campaign)")
+    parser.add_argument("--header-errors", type=int, default=0,
+                        help="503s in a row on the header row and row count reads once the campaign starts")
+    parser.add_argument("--invalid-every", type=int, default=50, help="every n-th row has no email")
+    parser.add_argument("--no-tracemalloc", action="store_true", help="skip memory tracking (it slows Python down)")
+    return parser.parse_args()
+
+
+def configure(args, workdir):
+    # config reads the environment once at import, so this has to happen first
+    os.environ.update({
+        "SEND_CONCURRENCY": str(args.concurrency),
+        "GMAIL_SENDS_PER_SECOND": str(args.rate),
+        "GMAIL_BATCH_SIZE": str(args.batch_size),
+        "GMAIL_BATCH_RETRIES": "2",
+        "SHEET_READ_RETRIES": "2",
+        "GENERATION_CACHE": "0",
+        "SESSION_DB_PATH": "",
+        "METRICS_SLOW_SECONDS": "0",
+        "GOOGLE_DOC_ID": "fake-doc",
+        "GOOGLE_SHEET_ID": "fake-sheet",
+        "OPENAI_API_KEY": "fake",
+        "JOURNAL_PATH": os.path.join(workdir, "journal.db"),
+        "JOBS_DB_PATH": "",
+        "NOTIFY_CHAT_INTERVAL": str(args.telegram_interval),
+        "NOTIFY_PROGRESS_SECONDS": "1",
+        # Sharded runs: worker processes build fake Gmail backends from these
+        "SEND_SHARDS": str(args.shards),
+        "SHARD_MIN_ROWS": "0",
+        "SHARD_DB_PATH": os.path.join(workdir, "shards.db"),
+        "SHARD_SERVICE_FACTORY": "fakes:shard_service",
+        "FAKE_GMAIL_LATENCY": str(args.gmail_latency),
+        "FAKE_GMAIL_ERRORS": str(args.gmail_errors),
+    })
+
+
+async def run_campaign(args, size, workdir):
+    import config
+    import metrics
+    from fakes import Chat, FakeDocs, FakeGmail, FakeGoogleService, FakeOpenAIClient, FakeSheets, Latency
+    from services import AsyncGoogleService, AsyncOpenAIService
+    from telegram_bot import EmailBot, WAITING_FOR_FEEDBACK, draft_button
+
+    metrics.REGISTRY.reset()
+    config.JOURNAL_PATH = os.path.join(workdir, f"journal-{size}.db")
+    sheets = FakeSheets(size, latency=Latency(args.sheets_latency, args.sheets_latency / 4), invalid_every=args.invalid_every,
+                        page_errors={2 + config.SHEET_PAGE_SIZE: args.page_errors})
+    gmail = FakeGmail(latency=Latency(args.gmail_latency, args.gmail_latency / 4, args.gmail_errors))
+    google = FakeGoogleService(FakeDocs(latency=Latency(args.sheets_latency)), sheets, gmail)
+    client = FakeOpenAIClient(Latency(args.openai_latency, args.openai_latency / 4, args.openai_errors),
+                              first_token=args.openai_latency / 5, draft_kb=args.draft_kb)
+    bot = EmailBot(AsyncGoogleService(google), AsyncOpenAIService(client=client))
+    chat = Chat(1000 + size)
+    chat.bot.latency = Latency(args.telegram_latency)
+
+    def approve():
+        # Built when pressed: the buttons carry the id of the latest drafting round. Header errors
+        # start here, so the conversation's own header read (when picking the sheet) goes through.
+        if args.header_errors:
+            sheets.page_errors.update({0: args.header_errors, 1: args.header_errors})
+        return chat.press(draft_button("approve", bot.sessions.get(chat.chat_id), 0))
+
+    script = [
+        ("start", bot.start, chat.text("/start")),
+        ("select sheet", bot.handle_sheet_selection, chat.press("sheet|Prospects")),
+        ("select columns", None, [chat.press(f"col|{name}") for name in FakeSheets.HEADERS] + [chat.press("done_cols")]),
+        ("prompt", bot.handle_prompt, chat.text("Introduce our solar offer, short and friendly")),
+        ("subject", bot.handle_subject, chat.text("Lower energy bills for [Company]")),
+        ("logo", bot.handle_logo, chat.text("no")),
+        ("draft", bot.handle_image, chat.text("no")),
+        ("refine", bot.handle_feedback, chat.text("Make it shorter and mention [City]")),
+        ("approve + send", bot.button_handler, approve),
+    ]
+
+    if args.page_errors or args.header_errors:
+        # A campaign stopped by a sheet read error is retried with /resume; the journal skips who got it.
+        # Header errors can fail it twice: once on the header row, once on the row count.
+        for _ in range(2 if args.header_errors else 1):
+            script.append(("resume", bot.resume_campaign, chat.text("/resume")))
+
+    stages = []
+    for name, handler, update in script:
+        started = time.perf_counter()
+        if handler is None:
+            for press in update:
+                state = await bot.handle_column_selection(press, chat.context)
+        else:
+            state = await handler(update() if callable(update) else update, chat.context)
+            if name in ("approve + send", "resume"):
+                # Approval only queues the campaign; the send stage lasts until it finishes
+                await bot.campaigns.join()
+        stages.append((name, time.perf_counter() - started))
+        if name == "refine" and state != WAITING_FOR_FEEDBACK:
+            raise RuntimeError(f"conversation left the feedback state after refine: {state}")
+
+    if bot.journal:
+        bot.journal.close()
+    bot.campaigns.store.close()
+    bot.google_service.executor.shutdown()
+    return stages, gmail, chat, metrics
+
+
+def report(size, stages, gmail, chat, metrics, peak, elapsed):
+    send_seconds = sum(seconds for name, seconds in stages if name in ("approve + send", "resume"))
+    print(f"\n=== {size:,} prospects: {elapsed:.2f}s total"
+          + (f", peak traced memory {peak / 1024 / 1024:.1f} MB" if peak is not None else "") + " ===")
+    for name, seconds in stages:
+        print(f"  {name:16} {seconds * 1000:10.1f} ms")
+    counters = metrics.REGISTRY.counter_values()
+    failures = int(counters.get(("emails_failed_total", ()), 0))
+    # Sharded runs send from worker processes, so the in-process fake Gmail only sees unsharded sends
+    sent = int(counters.get(("emails_sent_total", ()), 0))
+    raw = f" ({gmail.bytes / 1024 / 1024:.1f} MB raw)" if gmail.sent else ""
+    print(f"  sent {sent:,} emails{raw}, {failures:,} failed -> {sent / send_seconds:,.0f} emails/s during the send stage")
+    edits = sum(value for (name, labels), value in counters.items() if name == "telegram_messages_total" and dict(labels).get("kind") == "edit")
+    print(f"  telegram: {len(chat.bot.sent):,} messages and {edits:g} progress edits for the whole conversation "
+          f"({failures:,} failures coalesced)")
+    if counters:
+        print("  counters: " + ", ".join(f"{name}{dict(labels) or ''}={value:g}" for (name, labels), value in sorted(counters.items())))
+    print(f"  last bot message: {chat.bot.sent[-1][1].splitlines()[0] if chat.bot.sent else '-'}")
+    print("  slowest operations (total time):")
+    for operation, calls, errors, histogram in metrics.REGISTRY.operations()[:8]:
+        avg = histogram.sum / histogram.count if histogram.count else 0.0
+        print(f"    {operation:34} {calls:8.0f} calls {errors:5.0f} err  avg {avg * 1000:8.2f} ms"
+              f"  p95 {histogram.quantile(0.95) * 1000:8.2f} ms  total {histogram.sum:7.2f}s")
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    with tempfile.TemporaryDirectory() as workdir:
+        configure(args, workdir)
+        # The bot logs every draft at INFO; keep the report readable
+        logging.getLogger().setLevel(logging.WARNING)
+        for size in (int(s) for s in args.sizes.split(",")):
+            if not args.no_tracemalloc:
+                tracemalloc.start()
+            started = time.perf_counter()
+            # services print() every swallowed API error; injected failures would bury the report
+            with contextlib.redirect_stdout(io.StringIO()):
+                stages, gmail, chat, metrics = asyncio.run(run_campaign(args, size, workdir))
+            elapsed = time.perf_counter() - started
+            peak = None
+            if not args.no_tracemalloc:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            report(size, stages, gmail, chat, metrics, peak, elapsed)
+
+
+if __name__ == "__main__":
+    main()
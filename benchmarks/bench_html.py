@@ -0,0 +1,259 @@
+"""
+Outbound payload size before and after html_optimizer, plus the rendering checks that
+guard it. For every draft (a generated-style 20-60 KB draft and a set of edge cases):
+
+  - minify_html is idempotent, byte for byte
+  - the minified draft renders the same: identical tag/attribute sequence (styles
+    compared as their full declaration lists, so CSS fallbacks must survive), identical <pre>/<textarea> content, identical
+    visible text
+  - filling placeholders then minifying equals minifying then filling, byte for byte
+    (the campaign fills the minified template)
+  - the text part MessageBuilder puts in the message decodes to html_to_text's output
+
+Any failure exits non-zero.
+
+    python benchmarks/bench_html.py [--size-kb 20,40,60] [--recipients 1000]
+"""
+import argparse
+import base64
+import email
+import os
+import sys
+import time
+from html.parser import HTMLParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "execution"))
+
+from html_optimizer import (  # noqa: E402
+    TAG_RE, WHITESPACE_RE, OptimizedDraft, _split_declarations, html_to_text, minify_html, optimize_style,
+)
+from mime_builder import MessageBuilder  # noqa: E402
+from template import CompiledTemplate  # noqa: E402
+
+COLUMNS = ["Name", "Company", "City"]
+
+SECTION = """
+        <!-- Section {i} -->
+        <tr>
+          <td style="padding: 20px 30px;  font-family: Arial, Helvetica, sans-serif;  font-size: 15px; line-height: 1.6;  color: #333333; color: #333333;">
+            <p style="margin: 0 0 12px 0; font-family: Arial, Helvetica, sans-serif;  font-size: 15px;">
+              Hi [Name], teams like [Company] in [City] usually spend far too long on
+              manual reporting. &nbsp;Our platform cuts that   by half &mdash; point {i}.
+            </p>
+            <table role="presentation" cellpadding="0" cellspacing="0" border="0" style="border-collapse: collapse;">
+              <tr>
+                <td style="background-color: #0066cc; border-radius: 4px;  padding: 10px 18px;">
+                  <a href="https://example.com/offer?utm_source=email&amp;utm_campaign=q{i}" style="color: #ffffff; text-decoration: none;  font-weight: bold;">See how it works</a>
+                </td>
+              </tr>
+            </table>
+          </td>
+        </tr>
+"""
+
+DRAFT = """<!DOCTYPE html>
+<html lang="en">
+  <head>
+    <meta charset="utf-8">
+    <title>Offer for [Company]</title>
+    <style type="text/css">
+      /* Client resets */
+      body {{ margin: 0;  padding: 0; }}
+      @media screen and (max-width: 600px) {{
+        .container {{ width: 100% !important; }}
+      }}
+    </style>
+  </head>
+  <body style="margin: 0; padding: 0; background-color: #f4f4f4;">
+    <!--[if mso]>
+    <table role="presentation" width="600"><tr><td>
+    <![endif]-->
+    <table class="container" width="600" align="center" style="width: 600px; margin: 0 auto; background-color: #ffffff;">
+{sections}
+      <tr>
+        <td style="padding: 20px 30px; font-family: Arial, Helvetica, sans-serif; font-size: 13px; color: #777777;">
+          Best regards,<br>
+          The Acme team<br/>
+          <img src="https://example.com/logo.png" alt="Acme  logo" width="120" style="display: block; border: 0;">
+        </td>
+      </tr>
+    </table>
+    <!--[if mso]>
+    </td></tr></table>
+    <![endif]-->
+  </body>
+</html>
+"""
+
+EDGE_CASES = [
+    "<p>Hello   <b>[Name]</b> ,  <i>welcome</i></p>",
+    "<div>a</div>  <span>b</span>   <span>c</span>",
+    "<pre>  indented\n\n    code   </pre><textarea>  x\n  y </textarea>",
+    "<p style='white-space: pre'>keep   these\n   spaces</p><p>but   not   these</p>",
+    "<div style=\"display:inline\">one</div> <div style=\"display:inline\">two</div>",
+    "<p>a&nbsp;&nbsp; b &amp; c &lt;d&gt;</p>",
+    "<a href=\"https://x.test/?a=1&copy=2&amp;b=3\">link</a> <a href='mailto:[Email]'>mail</a>",
+    "<p style=\"color: red !important; color: blue; font: 12px 'Segoe  UI'; margin:0; margin-top: 4px\">s</p>",
+    "<p style=\"background: url('a;b.png') no-repeat; color:#000\">u</p>",
+    "<p>x<!-- dropped --> y</p><!--[if !mso]><!--><p>not outlook</p><!--<![endif]-->",
+    "<script>var a = 1;  // keep\n</script><style>p  {  color : red }</style><p>z</p>",
+    "<ul>\n  <li>One</li>\n  <li>Two</li>\n</ul>\n<br>\n<br>\n<p>after</p>",
+    "plain text only   with  spaces",
+    "<table><tr><td>A</td>\n<td>B</td></tr>\n<tr><td colspan=2>C</td></tr></table>",
+    # Bare ampersands are text, not references: nothing may add a ';' to them
+    "<p>AT&T rocks and R&D team</p>\n<p>Q&A: Tom&Jerry, 5&6, &copy 2024 &#169 &#x41</p>",
+    "<p>line one R&D\n  line two &amp; AT&T</p>",
+    "<p>ends the document with R&D",
+    # Fallbacks for clients that ignore the later value (Outlook: gradients, calc(), flex)
+    "<td style=\"background: #0066cc; background: linear-gradient(#0066cc, #003366); width:600px;"
+    " width: calc(100% - 20px); display:block; display:flex; color:red; color: red\">f</td>",
+]
+
+
+def make_draft(size_kb):
+    sections, i = [], 0
+    while sum(map(len, sections)) < size_kb * 1024:
+        sections.append(SECTION.format(i=i))
+        i += 1
+    return DRAFT.format(sections="".join(sections))
+
+
+class RenderModel(HTMLParser):
+    """What a renderer consumes, minus insignificant whitespace and comments."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.tags = []
+        self.preserved = []
+        self.depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        attributes = []
+        for name, value in attrs:
+            if name == "style" and value is not None:
+                value = declared_style(value)
+            attributes.append((name, value))
+        self.tags.append((tag, tuple(attributes)))
+        if tag in ("pre", "textarea"):
+            self.depth += 1
+
+    def handle_endtag(self, tag):
+        self.tags.append(("/" + tag, ()))
+        if tag in ("pre", "textarea"):
+            self.depth -= 1
+
+    def handle_data(self, data):
+        if self.depth:
+            self.preserved.append(data)
+
+    def handle_comment(self, data):
+        if data.lstrip().startswith("[if") or data.rstrip().endswith("[endif]"):
+            self.tags.append(("!--", data))
+
+
+def declared_style(style):
+    """
+    Every declaration in order, normalized. Only an earlier exact repeat is left out: it
+    changes nothing in any client, while a repeated property with another value is a fallback.
+    """
+    declarations = []
+    for declaration in _split_declarations(style):
+        name, colon, value = declaration.partition(":")
+        if not colon:
+            continue
+        value = " ".join(WHITESPACE_RE.split(value.strip()))
+        declarations.append((name.strip().lower(), value.replace(" !", "!").replace("! ", "!").replace(", ", ",")))
+    return tuple(d for i, d in enumerate(declarations) if d not in declarations[i + 1:])
+
+
+def render_model(html):
+    parser = RenderModel()
+    parser.feed(html)
+    parser.close()
+    return parser.tags, parser.preserved, html_to_text(html)
+
+
+def decoded_text_part(raw):
+    message = email.message_from_bytes(base64.urlsafe_b64decode(raw))
+    for part in message.walk():
+        if part.get_content_type() == "text/plain":
+            return part.get_payload(decode=True).decode("utf-8")
+    return None
+
+
+def check(draft, label, prospects):
+    failures = []
+    minified = minify_html(draft)
+    if minify_html(minified) != minified:
+        failures.append("not idempotent")
+    original_model, minified_model = render_model(draft), render_model(minified)
+    for name, a, b in zip(("tags", "preserved text", "visible text"), original_model, minified_model):
+        if a != b:
+            failures.append(f"{name} differ")
+    names = ["email"] + COLUMNS
+    template, compiled = CompiledTemplate(draft, names), CompiledTemplate(minified, names)
+    optimized = OptimizedDraft(draft)
+    builder = MessageBuilder("Subject", compiled, text=optimized.text)
+    for prospect in prospects:
+        if compiled.render(prospect) != minify_html(template.render(prospect)):
+            failures.append(f"fill/minify do not commute for {prospect['email']}")
+            break
+        expected = html_to_text(compiled.render(prospect)).replace("\n", "\r\n")
+        actual = decoded_text_part(builder.build_raw(prospect["email"], prospect))
+        if actual.replace("\r\n", "\n") != expected.replace("\r\n", "\n"):
+            failures.append(f"text part differs for {prospect['email']}")
+            break
+    for failure in failures:
+        print(f"  FAIL {label}: {failure}")
+    return not failures
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-kb", default="20,40,60")
+    parser.add_argument("--recipients", type=int, default=1000)
+    args = parser.parse_args()
+
+    prospects = [{"email": f"user{p}@example.com", "Name": f"Ana {p}", "Company": f"Acme {p % 97}",
+                  "City": "Montréal"} for p in range(args.recipients)]
+    ok = True
+
+    print("edge cases:")
+    for i, case in enumerate(EDGE_CASES):
+        ok &= check(case, f"edge case {i}", prospects[:5])
+    minified = minify_html("<p>AT&T rocks and R&D team</p>")
+    if minified != "<p>AT&T rocks and R&D team</p>":
+        print(f"  FAIL bare ampersands changed: {minified!r}")
+        ok = False
+    fallbacks = optimize_style("background:#0066cc; background:linear-gradient(#0066cc,#003366); color:red; color:red")
+    if fallbacks != "background:#0066cc;background:linear-gradient(#0066cc,#003366);color:red":
+        print(f"  FAIL CSS fallbacks changed: {fallbacks!r}")
+        ok = False
+    print(f"  {len(EDGE_CASES)} checked")
+
+    for size_kb in (int(s) for s in args.size_kb.split(",")):
+        draft = make_draft(size_kb)
+        started = time.perf_counter()
+        optimized = OptimizedDraft(draft)
+        seconds = time.perf_counter() - started
+        ok &= check(draft, f"{size_kb} KB draft", prospects[:50])
+
+        names = ["email"] + COLUMNS
+        before = MessageBuilder("Subject", CompiledTemplate(draft, names), text=TAG_RE.sub("", draft))
+        after = MessageBuilder("Subject", CompiledTemplate(optimized.html, names), text=optimized.text)
+        raw_before = sum(len(before.build_raw(p["email"], p)) for p in prospects)
+        raw_after = sum(len(after.build_raw(p["email"], p)) for p in prospects)
+        print(f"\ndraft {len(draft) / 1024:.1f} KB (optimized in {seconds * 1000:.1f} ms)")
+        print(f"  html   {len(draft) / 1024:7.1f} KB -> {len(optimized.html) / 1024:7.1f} KB")
+        print(f"  text   {len(TAG_RE.sub('', draft)) / 1024:7.1f} KB -> {len(optimized.text) / 1024:7.1f} KB")
+        print(f"  {optimized.summary()}")
+        print(f"  Gmail raw payload for {args.recipients:,} recipients: {raw_before / 1024 / 1024:.1f} MB -> "
+              f"{raw_after / 1024 / 1024:.1f} MB ({1 - raw_after / raw_before:.0%} less)")
+
+    if not ok:
+        raise SystemExit("rendering checks failed")
+    print("\nall rendering checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Prospect ingestion on a large sheet: the old per-cell loop against ProspectIngestor, fed
+the same pages of rows (blank, malformed, mixed-case/padded, punycode-TLD and duplicate
+emails mixed in). "loop + checks" is an independent row-by-row reference doing the same
+work (normalize, syntax check, dedup); the ingestor's output must match it. pandas is
+timed too when installed. Known good and bad addresses are checked first.
+
+    python benchmarks/bench_ingest.py [--rows 100000] [--page-size 1000] [--repeat 5]
+"""
+import argparse
+import gc
+import importlib.util
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "execution"))
+
+from ingest import ProspectIngestor, SkipReport, find_email_column, is_valid_email  # noqa: E402
+
+HEADERS = ["Name", "Company", "Email", "City", "Notes"]
+
+
+def make_rows(count):
+    rows = []
+    for n in range(1, count + 1):
+        email = f"prospect{n}@example.com"
+        if n % 50 == 0:
+            email = ""
+        elif n % 97 == 0:
+            email = f"prospect{n}(at)example.com"
+        elif n % 89 == 0:
+            email = f"prospect{n - 1}@example.com"
+        elif n % 113 == 0:
+            email = f"prospect{n}@example.xn--p1ai"
+        elif n % 7 == 0:
+            email = f"  Prospect{n}@Example.COM "
+        row = [f"Person {n}", f"Company {n % 997}", email, f"City {n % 50}", "first contact"]
+        if n % 31 == 0:
+            row = row[:3]  # trailing cells missing, as the Sheets API returns them
+        if n % 211 == 0:
+            row = []
+        rows.append(row)
+    return rows
+
+
+def legacy_loop(pages, header_map, email_col_index, selected_columns):
+    """The loop the bot used before (only checks for '@', no dedup)."""
+    columns = [(col_name, header_map.get(col_name)) for col_name in selected_columns]
+    prospects = []
+    for rows in pages:
+        for row in rows:
+            if not row:
+                continue
+            if len(row) <= email_col_index:
+                continue
+            email = row[email_col_index].strip()
+            if "@" not in email:
+                continue
+            prospect_data = {"email": email}
+            for col_name, idx in columns:
+                if idx is not None and len(row) > idx:
+                    prospect_data[col_name] = row[idx].strip()
+                else:
+                    prospect_data[col_name] = ""
+            prospects.append(prospect_data)
+    return prospects
+
+
+def loop_with_checks(pages, header_map, email_col_index, selected_columns):
+    """The same loop doing the ingestor's work row by row."""
+    columns = [(col_name, header_map.get(col_name)) for col_name in selected_columns]
+    seen = set()
+    prospects = []
+    for rows in pages:
+        for row in rows:
+            if not row:
+                continue
+            email = row[email_col_index].strip().casefold() if len(row) > email_col_index else ""
+            if not email or email in seen or not is_valid_email(email):
+                continue
+            seen.add(email)
+            prospect_data = {"email": email}
+            for col_name, idx in columns:
+                if idx is not None and len(row) > idx:
+                    prospect_data[col_name] = row[idx].strip()
+                else:
+                    prospect_data[col_name] = ""
+            prospects.append(prospect_data)
+    return prospects
+
+
+def ingestor(pages, header_map, email_col_index, selected_columns):
+    ingestor = ProspectIngestor(header_map, email_col_index, selected_columns, SkipReport())
+    prospects = []
+    for rows in pages:
+        prospects.extend(ingestor.ingest(rows))
+    return prospects
+
+
+def with_pandas(pages, header_map, email_col_index, selected_columns):
+    import pandas as pd
+    from ingest import EMAIL_PATTERN
+
+    frames = []
+    for rows in pages:
+        frame = pd.DataFrame([row for row in rows if row], columns=range(len(HEADERS))).fillna("")
+        frames.append(frame)
+    frame = pd.concat(frames, ignore_index=True)
+    emails = frame[email_col_index].str.strip().str.casefold()
+    keep = (emails != "") & emails.str.fullmatch(EMAIL_PATTERN) & ~emails.duplicated()
+    out = pd.DataFrame({"email": emails[keep]})
+    for name in selected_columns:
+        out[name] = frame.loc[keep, header_map[name]].str.strip()
+    return out.to_dict("records")
+
+
+def check_addresses():
+    valid = ["ana@example.com", "a.b+tag@mail.example.co.uk", "ana@example.xn--p1ai", "ana@xn--80ak6aa92e.xn--90ais"]
+    invalid = ["ana@example", "ana@example.c", "ana@1.2.3.4", "ana@example.xn--", "ana@-example.com",
+               "ana@@example.com", "ana(at)example.com", "ana@example.com."]
+    wrong = [email for email in valid if not is_valid_email(email)] + [email for email in invalid if is_valid_email(email)]
+    if wrong:
+        raise SystemExit(f"address validation is wrong for: {wrong}")
+
+
+def measure(fn, pages, args, repeat):
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        result = fn(pages, *args)
+        times.append(time.perf_counter() - started)
+    return statistics.median(times), min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    page_size = args.page_size or len(rows)
+    pages = [rows[i:i + page_size] for i in range(0, len(rows), page_size)]
+    header_map = {h: i for i, h in enumerate(HEADERS)}
+    email_col_index = find_email_column(header_map, HEADERS)
+    call_args = (header_map, email_col_index, HEADERS)
+
+    check_addresses()
+    candidates = [("old loop", legacy_loop), ("loop + checks", loop_with_checks), ("ingestor", ingestor)]
+    if importlib.util.find_spec("pandas") is not None:
+        candidates.append(("pandas", with_pandas))
+
+    print(f"{args.rows:,} rows in pages of {page_size:,}")
+    results = {}
+    for name, fn in candidates:
+        median, best, prospects = measure(fn, pages, call_args, args.repeat)
+        results[name] = prospects
+        print(f"  {name:14} median {median * 1000:8.1f} ms  min {best * 1000:8.1f} ms  -> {len(prospects):,} prospects")
+
+    # The ingestor must produce exactly what the row-by-row reference produces
+    if results["ingestor"] != results["loop + checks"]:
+        raise SystemExit("ingestor output differs from the row-by-row reference")
+    report = SkipReport()
+    ProspectIngestor(header_map, email_col_index, HEADERS, report).ingest(rows)
+    print(f"  skip report: {report.summary()}")
+    print(f"  old loop would have mailed {len(results['old loop']) - len(results['ingestor']):,} "
+          f"extra rows (malformed or duplicate addresses)")
+
+
+if __name__ == "__main__":
+    main()
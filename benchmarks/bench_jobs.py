@@ -0,0 +1,202 @@
+"""
+Campaign scheduler checks and overhead, with a fake runner in place of process_sending:
+
+  - fairness: with one worker, an operator who queued several campaigns can't starve
+    another operator's single campaign
+  - pause / resume / cancel stop and restart the send loop at the next recipient
+  - a campaign left running by a killed process is queued again by the next start, or
+    failed (not sent twice) when there is no send journal
+  - /status reports live counters, rate and ETA
+  - time from approval (submit) to the first recipient, and scheduler overhead per campaign
+
+Any failure exits non-zero.
+
+    python benchmarks/bench_jobs.py [--campaigns 200] [--recipients 50] [--workers 4]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "execution"))
+
+from jobs import CANCELLED, DONE, FAILED, PAUSED, QUEUED, CampaignScheduler, JobStore  # noqa: E402
+
+FAILURES = []
+
+
+def expect(condition, message):
+    if not condition:
+        FAILURES.append(message)
+        print(f"  FAIL {message}")
+
+
+class FakeRunner:
+    """Sends `recipients` fake emails per campaign, `delay` seconds each, through control.checkpoint()."""
+
+    def __init__(self, recipients=5, delay=0.001):
+        self.recipients = recipients
+        self.delay = delay
+        self.order = []
+        self.first_recipient = {}
+
+    async def __call__(self, campaign, control, bot):
+        self.order.append(campaign.id)
+        control.progress.total = self.recipients
+        for _ in range(self.recipients):
+            if not await control.checkpoint():
+                break
+            self.first_recipient.setdefault(campaign.id, time.perf_counter())
+            await asyncio.sleep(self.delay)
+            control.progress.record(True)
+        return f"sent {control.progress.sent}"
+
+
+def session(sheet="Prospects"):
+    return {"selected_sheet": sheet}
+
+
+async def check_fairness():
+    runner = FakeRunner()
+    scheduler = CampaignScheduler(runner, JobStore(""), workers=1, progress_seconds=0)
+    scheduler.start(bot=object())
+    first = [scheduler.submit(1, session()) for _ in range(3)]
+    other = scheduler.submit(2, session())
+    await scheduler.join()
+    expect(runner.order == [first[0].id, other.id, first[1].id, first[2].id],
+           f"fair order: got {runner.order}")
+    expect(all(c.status == DONE for c in scheduler.store.list()), "all campaigns done")
+
+
+async def check_controls():
+    runner = FakeRunner(recipients=200, delay=0.002)
+    scheduler = CampaignScheduler(runner, JobStore(""), workers=1, progress_seconds=0)
+    scheduler.start(bot=object())
+    campaign = scheduler.submit(1, session())
+    waiting = scheduler.submit(1, session("Second"))
+    await asyncio.sleep(0.05)
+
+    expect(scheduler.pause(2, campaign.id) is None, "another chat can't pause the campaign")
+    expect(scheduler.pause(1, campaign.id) is not None, "pause")
+    # The paused campaign gives up its slot to the queued one
+    await asyncio.sleep(0.02)
+    sent = scheduler.controls[campaign.id].progress.sent
+    await asyncio.sleep(0.05)
+    expect(scheduler.controls[campaign.id].progress.sent == sent, "no sends while paused")
+    expect(scheduler.store.get(campaign.id).status == PAUSED, "paused in the store")
+    expect(waiting.id in runner.order, "queued campaign started while the other is paused")
+
+    status = scheduler.status_text(1)
+    expect("emails/s" in status and "remaining" in status, f"status shows progress: {status!r}")
+    print("  /status while one campaign is paused:\n    " + status.replace("\n", "\n    "))
+
+    expect(scheduler.resume(1, campaign.id) is not None, "resume")
+    await asyncio.sleep(0.02)
+    expect(scheduler.controls[campaign.id].progress.sent > sent, "sends again after resume")
+    expect(scheduler.cancel(1, campaign.id) is not None, "cancel")
+    expect(scheduler.cancel(1, waiting.id) is not None, "cancel the second")
+    await scheduler.join()
+    for c in (campaign, waiting):
+        stored = scheduler.store.get(c.id)
+        expect(stored.status == CANCELLED, f"#{c.id} cancelled, got {stored.status}")
+        expect(stored.sent < runner.recipients, f"#{c.id} stopped early ({stored.sent} sent)")
+
+
+async def killed_run(path):
+    """Starts two campaigns on one worker and kills the process mid-send. Returns (interrupted, queued)."""
+    runner = FakeRunner(recipients=1000, delay=0.001)
+    scheduler = CampaignScheduler(runner, JobStore(path), workers=1, progress_seconds=0.01)
+    scheduler.start(bot=object())
+    interrupted = scheduler.submit(1, session())
+    queued = scheduler.submit(2, session())
+    await asyncio.sleep(0.05)
+    # Simulate a killed process: tasks are cancelled, nothing records a final status
+    for task in list(scheduler.tasks):
+        task.cancel()
+    await asyncio.gather(*scheduler.tasks, return_exceptions=True)
+    scheduler.store.close()
+    return interrupted, queued
+
+
+async def check_recovery(workdir):
+    path = os.path.join(workdir, "jobs.db")
+    interrupted, queued = await killed_run(path)
+    store = JobStore(path)
+    expect(store.get(interrupted.id).sent > 0, "progress saved before the restart")
+    restarted = CampaignScheduler(FakeRunner(recipients=3), store, workers=2, progress_seconds=0, resume_interrupted=True)
+    expect(store.get(interrupted.id).status != QUEUED, "not re-queued before start()")
+    restarted.start(bot=object())
+    await restarted.join()
+    for c in (interrupted, queued):
+        expect(store.get(c.id).status == DONE, f"#{c.id} finished after the restart")
+    store.close()
+
+
+async def check_recovery_without_journal(workdir):
+    path = os.path.join(workdir, "jobs-no-journal.db")
+    interrupted, queued = await killed_run(path)
+    store = JobStore(path)
+    runner = FakeRunner(recipients=3)
+    restarted = CampaignScheduler(runner, store, workers=2, progress_seconds=0, resume_interrupted=False)
+    failed = restarted.start(bot=object())
+    await restarted.join()
+    expect([c.id for c in failed] == [interrupted.id], f"the interrupted campaign is reported: {[c.id for c in failed]}")
+    stored = store.get(interrupted.id)
+    expect(stored.status == FAILED and "partially sent" in (stored.summary or ""),
+           f"#{interrupted.id} failed instead of sending again: {stored.status} {stored.summary}")
+    expect(interrupted.id not in runner.order, "the interrupted campaign did not run again")
+    expect(restarted.resume(1) is None, "/resume can't restart it either")
+    expect(store.get(queued.id).status == DONE, f"#{queued.id}, never started, still runs")
+    print(f"  #{interrupted.id}: {stored.summary}")
+    store.close()
+
+
+async def measure(campaigns, recipients, workers):
+    runner = FakeRunner(recipients=recipients, delay=0)
+    scheduler = CampaignScheduler(runner, JobStore(""), workers=workers, progress_seconds=0)
+    scheduler.start(bot=object())
+    started = time.perf_counter()
+    submitted = {}
+    for i in range(campaigns):
+        submit_started = time.perf_counter()
+        campaign = scheduler.submit(i % 10, session())
+        submitted[campaign.id] = submit_started
+    submit_seconds = time.perf_counter() - started
+    await scheduler.join()
+    elapsed = time.perf_counter() - started
+    first = sorted(runner.first_recipient[i] - submitted[i] for i in submitted)
+    print(f"  {campaigns} campaigns x {recipients} recipients, {workers} workers, 10 operators: {elapsed * 1000:.0f} ms")
+    print(f"  submit (what the approval handler waits for): {submit_seconds / campaigns * 1000:.2f} ms each")
+    print(f"  approval -> first recipient (incl. queueing): p50 {first[len(first) // 2] * 1000:.1f} ms, max {first[-1] * 1000:.1f} ms")
+    print(f"  scheduler overhead: {elapsed / campaigns * 1000:.2f} ms per campaign")
+    expect(sum(c.sent for c in scheduler.store.list()) == campaigns * recipients, "every recipient sent")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--campaigns", type=int, default=200)
+    parser.add_argument("--recipients", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    print("fairness:")
+    asyncio.run(check_fairness())
+    print("pause / resume / cancel:")
+    asyncio.run(check_controls())
+    print("restart recovery:")
+    with tempfile.TemporaryDirectory() as workdir:
+        asyncio.run(check_recovery(workdir))
+        print("restart without a send journal:")
+        asyncio.run(check_recovery_without_journal(workdir))
+    print("throughput:")
+    asyncio.run(measure(args.campaigns, args.recipients, args.workers))
+
+    if FAILURES:
+        raise SystemExit(f"{len(FAILURES)} scheduler checks failed")
+    print("\nall scheduler checks passed")
+
+
+if __name__ == "__main__":
+    main()
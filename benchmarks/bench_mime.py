@@ -0,0 +1,74 @@
+"""
+Per-recipient Gmail payload cost: the old MIMEMultipart path vs the campaign MessageBuilder.
+
+    python benchmarks/bench_mime.py [--recipients 2000] [--size-kb 40]
+"""
+import argparse
+import base64
+import os
+import re
+import sys
+import time
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "execution"))
+
+from bench_template import make_draft  # noqa: E402
+from mime_builder import MessageBuilder  # noqa: E402
+from template import CompiledTemplate  # noqa: E402
+
+
+def legacy_raw(to, subject, body_html):
+    # What GoogleService.send_email did per recipient before MessageBuilder
+    message = MIMEMultipart('alternative')
+    message['to'] = to
+    message['subject'] = subject
+    clean = re.compile('<.*?>')
+    body_text = re.sub(clean, '', body_html)
+    message.attach(MIMEText(body_text, 'plain'))
+    message.attach(MIMEText(body_html, 'html'))
+    return base64.urlsafe_b64encode(message.as_bytes()).decode()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--recipients", type=int, default=2000)
+    parser.add_argument("--size-kb", type=int, default=40)
+    parser.add_argument("--columns", type=int, default=5)
+    args = parser.parse_args()
+
+    columns = [f"Column {c}" for c in range(args.columns)]
+    names = ["email"] + columns
+    draft = make_draft(columns, args.size_kb)
+    subject = "Une offre spéciale pour vous"
+    prospects = [
+        dict({"email": f"user{p}@example.com"}, **{col: f"Valeur {p}-{c}" for c, col in enumerate(columns)})
+        for p in range(args.recipients)
+    ]
+    print(f"draft {len(draft) / 1024:.1f} KB, {args.recipients} recipients")
+
+    template = CompiledTemplate(draft, names)
+    started = time.perf_counter()
+    legacy_bytes = 0
+    for prospect in prospects:
+        legacy_bytes += len(legacy_raw(prospect["email"], subject, template.render(prospect)))
+    legacy = time.perf_counter() - started
+
+    started = time.perf_counter()
+    builder = MessageBuilder(subject, CompiledTemplate(draft, names))
+    built_bytes = 0
+    for prospect in prospects:
+        built_bytes += len(builder.build_raw(prospect["email"], prospect))
+    built = time.perf_counter() - started
+
+    for label, seconds, size in (("legacy MIMEMultipart", legacy, legacy_bytes), ("MessageBuilder", built, built_bytes)):
+        print(
+            f"{label:21s} {seconds * 1e6 / args.recipients:8.1f} us/msg  "
+            f"{size / seconds / 2 ** 20:8.1f} MB/s of payload  avg {size / args.recipients / 1024:.1f} KB/msg"
+        )
+    print(f"speedup: {legacy / built:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
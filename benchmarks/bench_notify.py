@@ -0,0 +1,222 @@
+"""
+Notifier checks and hot-path cost, against FakeBot from benchmarks/fakes.py:
+
+  - thousands of failures inside one window become one summary with the top errors
+  - one chat gets at most one message per interval, other chats are not held up by it
+  - progress updates edit one message in place and skip frames that change nothing
+  - flood control (RetryAfter) delays the queue without losing or reordering messages
+  - the last failure digest goes out before the campaign summary
+  - a finished campaign's drain returns while another campaign in the chat keeps failing
+  - what notifier.failure() costs the send loop, against awaiting one Telegram message
+
+Any failure exits non-zero.
+
+    python benchmarks/bench_notify.py [--failures 10000] [--telegram-latency 0.05]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "execution"))
+sys.path.insert(0, HERE)
+
+from telegram.error import RetryAfter  # noqa: E402
+
+from fakes import FakeBot, Latency  # noqa: E402
+from notifier import Notifier  # noqa: E402
+
+FAILURES = []
+
+ERRORS = [
+    "HttpError 429: Rate Limit Exceeded",
+    "HttpError 400: Invalid To header",
+    "HttpError 500: Backend Error",
+    "TimeoutError: The read operation timed out",
+]
+
+
+def expect(condition, message):
+    if not condition:
+        FAILURES.append(message)
+        print(f"  FAIL {message}")
+
+
+class TimedBot(FakeBot):
+    """Records when each message went out; raises RetryAfter on the sends listed in `flood_on`."""
+
+    def __init__(self, latency=None, flood_on=()):
+        super().__init__(latency)
+        self.times = []
+        self.flood_on = set(flood_on)
+        self.calls = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls += 1
+        if self.calls in self.flood_on:
+            raise RetryAfter(1)
+        message = await super().send_message(chat_id, text, **kwargs)
+        self.times.append((chat_id, time.monotonic()))
+        return message
+
+
+async def check_coalescing(failures):
+    bot = TimedBot()
+    notifier = Notifier(bot, window=0.2, chat_interval=0, global_rate=0)
+    for i in range(failures):
+        notifier.failure(1, f"user{i}@example.com", ERRORS[0 if i % 2 else i % len(ERRORS)], "Campaign #1")
+    await asyncio.sleep(0.3)
+    expect(len(bot.sent) == 1, f"one message for {failures} failures, got {len(bot.sent)}")
+    text = bot.sent[0][1] if bot.sent else ""
+    expect(f"{failures:,} failures" in text and ERRORS[0] in text, f"summary names the count and top error: {text!r}")
+    print("  " + text.replace("\n", "\n  "))
+
+    notifier.failure(1, "single@example.com", "HttpError 400: Invalid To header", "Campaign #1")
+    await notifier.drain(1)
+    expect(bot.sent[-1][1] == "Campaign #1: Failed to send to single@example.com: HttpError 400: Invalid To header",
+           f"a lone failure keeps the old wording: {bot.sent[-1][1]!r}")
+
+
+async def check_pacing():
+    bot = TimedBot()
+    notifier = Notifier(bot, window=1, chat_interval=0.05, global_rate=0)
+    for i in range(10):
+        notifier.post(1, f"busy chat {i}")
+    notifier.post(2, "other chat")
+    await asyncio.gather(notifier.drain(1), notifier.drain(2))
+    busy = [t for chat, t in bot.times if chat == 1]
+    gaps = [b - a for a, b in zip(busy, busy[1:])]
+    expect(min(gaps) >= 0.045, f"per-chat interval respected (smallest gap {min(gaps) * 1000:.0f} ms)")
+    other = next(t for chat, t in bot.times if chat == 2)
+    expect(other - busy[0] < 0.05, "another chat is not queued behind a busy one")
+    expect([text for chat, text in bot.sent if chat == 1] == [f"busy chat {i}" for i in range(10)], "order kept")
+
+    bot = TimedBot()
+    notifier = Notifier(bot, window=1, chat_interval=0, global_rate=100)
+    for chat in range(50):
+        notifier.post(chat, "hello")
+    started = time.monotonic()
+    await asyncio.gather(*(notifier.drain(chat) for chat in range(50)))
+    expect(time.monotonic() - started >= 0.45, "global rate respected across chats")
+
+
+async def check_progress():
+    bot = TimedBot()
+    notifier = Notifier(bot, window=1, chat_interval=0.02, global_rate=0)
+    for i in range(200):
+        notifier.progress(1, "Campaign #1", f"{i // 10} sent")
+        await asyncio.sleep(0.001)
+    await notifier.drain(1)
+    message = notifier.chats[1].progress_messages["Campaign #1"]
+    expect(len(bot.sent) == 1, f"progress posted once, got {len(bot.sent)} messages")
+    expect(message.text == "19 sent", f"latest progress shown: {message.text!r}")
+    expect(message.edits < 20, f"frames that change nothing are skipped ({message.edits} edits for 200 updates)")
+
+    notifier.progress(1, "Campaign #2", "done", edit_only=True)
+    await notifier.drain(1)
+    expect(len(bot.sent) == 1, "edit_only does not post a new message")
+
+
+async def check_flood_control():
+    bot = TimedBot(flood_on={2})
+    notifier = Notifier(bot, window=1, chat_interval=0, global_rate=0)
+    started = time.monotonic()
+    for i in range(3):
+        notifier.post(1, f"message {i}")
+    await notifier.drain(1)
+    expect([text for _, text in bot.sent] == ["message 0", "message 1", "message 2"], f"nothing lost: {bot.sent}")
+    expect(time.monotonic() - started >= 0.95, "waited out RetryAfter")
+
+
+async def check_summary_order():
+    bot = TimedBot()
+    notifier = Notifier(bot, window=60, chat_interval=0, global_rate=0)
+    notifier.failure(1, "a@example.com", ERRORS[0], "Campaign #1")
+    notifier.failure(1, "b@example.com", ERRORS[0], "Campaign #1")
+    notifier.flush(1)
+    notifier.post(1, "Campaign #1 done!")
+    await notifier.drain(1)
+    expect([text.split(":")[0] for _, text in bot.sent] == ["Campaign #1", "Campaign #1 done!"]
+           and "2 failures" in bot.sent[0][1], f"digest before the summary: {bot.sent}")
+
+
+async def check_busy_neighbour():
+    # Campaign #2 in the same chat keeps failing while campaign #1 finishes
+    bot = TimedBot(Latency(0.15))
+    notifier = Notifier(bot, window=0.05, chat_interval=0, global_rate=0)
+    stop = asyncio.Event()
+
+    async def keep_failing():
+        i = 0
+        while not stop.is_set():
+            notifier.failure(1, f"user{i}@example.com", ERRORS[i % len(ERRORS)], "Campaign #2")
+            i += 1
+            await asyncio.sleep(0.01)
+
+    failing = asyncio.create_task(keep_failing())
+    await asyncio.sleep(0.2)
+    notifier.progress(1, "Campaign #1", "Campaign #1: 10 sent")
+    await asyncio.sleep(0.01)
+    # Changed while the first frame is in flight: drain must still wait for the final counts
+    notifier.progress(1, "Campaign #1", "Campaign #1: 20 sent")
+    notifier.post(1, "Campaign #1 done!")
+    started = time.monotonic()
+    try:
+        await asyncio.wait_for(notifier.drain(1, "Campaign #1"), 3)
+    except asyncio.TimeoutError:
+        pass
+    waited = time.monotonic() - started
+    stop.set()
+    await failing
+    texts = [text for _, text in bot.sent]
+    expect(waited < 2, f"drain is not held up by another campaign's failures (waited {waited:.1f}s)")
+    expect("Campaign #1 done!" in texts, "the summary went out before drain returned")
+    message = notifier.chats[1].progress_messages.get("Campaign #1")
+    expect(message is not None and message.text == "Campaign #1: 20 sent",
+           f"final progress shown before drain returned: {message and message.text!r}")
+    print(f"  drain returned after {waited:.2f}s while campaign #2 kept failing")
+    await notifier.drain(1)
+
+
+async def measure(failures, latency):
+    notifier = Notifier(FakeBot(Latency(latency)), window=0.5, chat_interval=1.0)
+    started = time.perf_counter()
+    for i in range(failures):
+        notifier.failure(1, f"user{i}@example.com", ERRORS[i % len(ERRORS)], "Campaign #1")
+    queued = time.perf_counter() - started
+    await notifier.drain(1)
+    print(f"  notifier.failure(): {queued / failures * 1e6:.1f} us per failure on the send loop")
+    print(f"  awaiting send_message per failure instead: {failures * latency:,.0f}s of Telegram round trips, "
+          f"and {failures / 60:,.0f} min of messages at ~1 per second per chat")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--failures", type=int, default=10000)
+    parser.add_argument("--telegram-latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    print("coalescing:")
+    asyncio.run(check_coalescing(args.failures))
+    print("rate limits:")
+    asyncio.run(check_pacing())
+    print("progress edited in place:")
+    asyncio.run(check_progress())
+    print("flood control:")
+    asyncio.run(check_flood_control())
+    print("digest before summary:")
+    asyncio.run(check_summary_order())
+    print("two campaigns in one chat:")
+    asyncio.run(check_busy_neighbour())
+    print("hot path:")
+    asyncio.run(measure(args.failures, args.telegram_latency))
+
+    if FAILURES:
+        raise SystemExit(f"{len(FAILURES)} notifier checks failed")
+    print("\nall notifier checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Per-prospect personalization against the local OpenAI stub: generate-then-send vs the
+pipelined PersonalizationPipeline feeding BulkSender, with 429s from the stub. The
+generation cache is on: per-prospect drafts must bypass it (exits non-zero if one is stored).
+
+    python benchmarks/bench_personalize.py [--prospects 200] [--latency 0.3] [--rate-limit 0.05] [--max-concurrent 12]
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "execution"))
+
+from stub_openai import serve  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--prospects", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--rate-limit", type=float, default=0.05)
+    parser.add_argument("--max-concurrent", type=int, default=12)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--send-latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    server, state = serve(latency=args.latency, jitter=args.latency / 4,
+                          rate_limit=args.rate_limit, max_concurrent=args.max_concurrent, retry_after=0.2)
+    # config reads the environment at import time
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    os.environ["OPENAI_API_KEY"] = "stub"
+    os.environ["GENERATION_CACHE"] = "1"
+    cache_dir = os.environ["GENERATION_CACHE_DIR"] = tempfile.mkdtemp(prefix="generation_cache_")
+    os.environ["GMAIL_SENDS_PER_SECOND"] = "1000"
+
+    from personalize import PersonalizationPipeline
+    from sender import BulkSender
+    from services import AsyncOpenAIService
+
+    service = AsyncOpenAIService()
+    arguments = dict(context="Company context " * 200, prospect_info=None, feedback="Short intro email",
+                     available_columns=["Name", "Company"])
+    approved = "<html><body><p>Hello [Name],</p><p>Approved draft.</p></body></html>"
+    prospects = [{"email": f"user{i}@example.com", "Name": f"User {i}", "Company": f"Co {i}"} for i in range(args.prospects)]
+
+    def send(to, prospect, html):
+        time.sleep(args.send_latency)
+        return True, "stub-id"
+
+    async def source():
+        for prospect in prospects:
+            yield prospect
+
+    async def sequential():
+        pipeline = PersonalizationPipeline(service, arguments, approved, concurrency=args.concurrency, max_spend=0)
+        drafts = [item async for item in pipeline.run(source())]
+        sender = BulkSender(send, rate=1000, burst=1000)
+        stats = await sender.run([(p["email"], p, html) for p, html in drafts])
+        return pipeline, stats
+
+    async def pipelined():
+        pipeline = PersonalizationPipeline(service, arguments, approved, concurrency=args.concurrency, max_spend=0)
+
+        async def jobs():
+            async for prospect, html in pipeline.run(source()):
+                yield prospect["email"], prospect, html
+
+        sender = BulkSender(send, rate=1000, burst=1000)
+        stats = await sender.run(jobs())
+        return pipeline, stats
+
+    for name, run in (("generate, then send", sequential), ("pipelined", pipelined)):
+        state.throttled = state.peak = 0
+        started = time.perf_counter()
+        pipeline, stats = asyncio.run(run())
+        elapsed = time.perf_counter() - started
+        print(f"{name:20} {elapsed:6.2f}s  sent {stats.sent}/{args.prospects}, generated {pipeline.generated}, "
+              f"failed {len(pipeline.failed)}, 429s {state.throttled}, peak in flight {state.peak}, "
+              f"final limit {pipeline.limiter.limit}, est. spend ${pipeline.guard.spent:.3f}")
+
+    # Spend guard: stop well before the end of the list
+    async def capped():
+        pipeline = PersonalizationPipeline(service, arguments, approved, concurrency=4, max_spend=0.02)
+        count = len([item async for item in pipeline.run(source())])
+        return pipeline, count
+
+    pipeline, count = asyncio.run(capped())
+    print(f"spend cap $0.02: generated {count}, skipped {pipeline.not_generated}, est. spend ${pipeline.guard.spent:.4f}")
+    server.shutdown()
+    cached = len(service.cache)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    print(f"generation cache entries after personalizing: {cached}")
+    if cached:
+        raise SystemExit("per-prospect drafts were stored in the generation cache")
+
+
+if __name__ == "__main__":
+    main()
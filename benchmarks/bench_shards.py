@@ -0,0 +1,223 @@
+"""
+Sharded sending (execution/sharding.py) against fake Gmail backends, in real worker processes:
+
+  - recipients split evenly and stably across shards; each account's quota is split
+    between the shards that can send from it at the same time
+  - leases: a worker only claims a shard whose account has a free slot, and a shard whose
+    lease expired on its last attempt is failed instead of leased out again
+  - throughput of one process on one sender account against N shards on N accounts
+  - failover: a worker process killed mid-shard is replaced and its shard finished by
+    another worker, and every recipient ends up sent (checked in the send journal)
+  - a sender account that can't send fails its shards after SHARD_MAX_ATTEMPTS tries
+    without holding up the others
+  - cancelling stops every shard
+
+Any failure exits non-zero.
+
+    python benchmarks/bench_shards.py [--prospects 20000] [--shards 4] [--rate 300]
+                                      [--gmail-latency 0.005]
+"""
+import argparse
+import asyncio
+import os
+import signal
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "execution"))
+sys.path.insert(0, HERE)
+
+from fakes import shard_service  # noqa: E402
+from jobs import JobControl  # noqa: E402
+from sender import BulkSender  # noqa: E402
+from sharding import CANCELLED, DONE, FAILED, LeaseStore, ShardedSender, shard_of, shard_rates  # noqa: E402
+
+from mime_builder import MessageBuilder  # noqa: E402
+from template import CompiledTemplate  # noqa: E402
+
+FAILURES = []
+DRAFT = "<html><body><p>Hello [Name],</p><p>[Company] in [City] could save a lot. " + "Details. " * 300 + "</p></body></html>"
+NAMES = ["email", "Name", "Company", "City"]
+
+
+def expect(condition, message):
+    if not condition:
+        FAILURES.append(message)
+        print(f"  FAIL {message}")
+
+
+def prospects(count):
+    return [{"email": f"user{i}@example.com", "Name": f"Ana {i}", "Company": f"Acme {i % 97}", "City": "Montréal"}
+            for i in range(count)]
+
+
+async def jobs(rows):
+    for prospect in rows:
+        yield prospect["email"], prospect
+
+
+def delivered(journal_path, campaign):
+    db = sqlite3.connect(journal_path)
+    rows = db.execute("SELECT status, COUNT(*) FROM deliveries WHERE campaign_id = ? GROUP BY status", (campaign,)).fetchall()
+    db.close()
+    return dict(rows)
+
+
+def check_partition(count, shards):
+    emails = [p["email"] for p in prospects(count)]
+    sizes = Counter(shard_of(email, shards) for email in emails)
+    mean = count / shards
+    expect(set(sizes) == set(range(shards)), "every shard gets recipients")
+    expect(max(abs(size - mean) / mean for size in sizes.values()) < 0.05, f"shards within 5% of each other: {dict(sizes)}")
+    expect(all(shard_of(email, shards) == shard_of(email, shards) for email in emails[:100]), "stable")
+    print(f"  {count:,} recipients over {shards} shards: {sorted(sizes.values())}")
+    expect(shard_rates(4, ["a", "b"], 2.5, processes=4) == [1.25] * 4, "two shards per account split its quota")
+    expect(shard_rates(3, ["a", "b"], 2.0, processes=3) == [1.0, 2.0, 1.0], "uneven split follows the shard count per account")
+    expect(shard_rates(4, ["a"], 0, processes=4) == [0] * 4, "unthrottled stays unthrottled")
+    # Only the shards that can run at once share an account's quota
+    expect(shard_rates(8, ["a", "b"], 2.0, processes=2) == [2.0] * 8, "one worker per account gets its whole quota")
+    expect(shard_rates(8, ["a"], 2.0, processes=4) == [0.5] * 8, "four workers on one account split it four ways")
+    expect(shard_rates(4, ["a", "b"], 2.5, processes=0) == [1.25] * 4, "external workers may run every shard at once")
+
+
+def check_leases(workdir):
+    store = LeaseStore(os.path.join(workdir, "leases-shards.db"))
+    spec = {"shards": 4, "accounts": ["a", "b"], "slots": 1}
+    store.create("leases", spec)
+    store.open("leases")
+    first, second = store.claim("w1", 30, "leases"), store.claim("w2", 30, "leases")
+    expect([first[1], second[1]] == [0, 1], f"one shard per account: {first[1]}, {second[1]}")
+    expect(store.claim("w3", 30, "leases") is None, "a third worker waits for a free account slot")
+
+    # Shard 0's worker keeps dying: its expired lease is failed, not leased out a fourth time
+    store.db.execute("UPDATE shard_leases SET lease_until = 0, attempts = 3 WHERE campaign = 'leases' AND shard = 0")
+    claim = store.claim("w3", 30, "leases", max_attempts=3)
+    expect(claim is not None and claim[1] == 2, f"account a's next shard goes out instead: {claim and claim[1]}")
+    progress = store.progress("leases")
+    expect(progress.statuses[FAILED] == 1, f"the abandoned shard failed: {progress.summary()}")
+    errors = store.errors("leases")
+    expect(errors and "stopped renewing its lease 3 times" in errors[0][1], f"failure reason kept: {errors}")
+    print(f"  {progress.summary()}: {errors[0][1] if errors else '-'}")
+    store.close()
+
+
+def make_sender(workdir, name, shards, processes, accounts, options, ttl=30.0):
+    store = LeaseStore(os.path.join(workdir, f"{name}-shards.db"))
+    sender = ShardedSender(shards, processes, accounts, store, "fakes:shard_service", options, ttl=ttl, poll_seconds=0.2)
+    spec = sender.spec(name, "Hello [Name]", DRAFT, NAMES, text="Hello [Name]",
+                       journal_path=os.path.join(workdir, f"{name}-journal.db"))
+    return sender, spec
+
+
+async def single_process(rows, rate, options):
+    gmail = shard_service("token.json", options)
+    builder = MessageBuilder("Hello [Name]", CompiledTemplate(DRAFT, NAMES), text="Hello [Name]")
+    sender = BulkSender(lambda to, p: gmail.send_raw(to, builder.build_raw(to, p)), rate=rate, burst=int(rate) or None)
+    started = time.perf_counter()
+    stats = await sender.run(jobs(rows))
+    return stats.sent, time.perf_counter() - started
+
+
+async def compare(workdir, count, shards, rate, options):
+    import config
+    config.GMAIL_SENDS_PER_SECOND = rate
+    config.GMAIL_SEND_BURST = max(1, int(rate / shards))
+    rows = prospects(count)
+    sent, seconds = await single_process(rows, rate, options)
+    print(f"  1 process, 1 account at {rate:g}/s:       {sent:,} sent in {seconds:6.2f}s -> {sent / seconds:7,.0f} emails/s")
+
+    accounts = [f"token-{n}.json" for n in range(shards)]
+    sender, spec = make_sender(workdir, "compare", shards, shards, accounts, options)
+    stats = await sender.run(jobs(rows), spec)
+    print(f"  {shards} processes, {shards} accounts at {rate:g}/s each: {stats.sent:,} sent in {stats.elapsed:6.2f}s "
+          f"-> {stats.rate:7,.0f} emails/s (includes process start-up)")
+    expect(stats.sent == count and stats.progress.statuses == {DONE: shards}, f"sharded run sent everything: {stats.summary()}")
+    expect(delivered(spec["journal_path"], "compare").get("sent") == count, "journal has every recipient")
+
+
+async def check_failover(workdir, count, shards, options):
+    rows = prospects(count)
+    sender, spec = make_sender(workdir, "failover", shards, 2, ["a.json", "b.json"], options, ttl=1.5)
+    killed = []
+
+    def on_progress(progress):
+        # Kill one worker process once sending is under way
+        if not killed and progress.sent > count // 10:
+            owners = sender.store.db.execute(
+                "SELECT owner FROM shard_leases WHERE campaign = 'failover' AND status = 'running'").fetchall()
+            if owners:
+                pid = int(owners[0][0].rsplit(":", 1)[1])
+                os.kill(pid, signal.SIGKILL)
+                killed.append(pid)
+
+    stats = await sender.run(jobs(rows), spec, on_progress=on_progress)
+    expect(killed, "a worker was killed")
+    expect(stats.progress.statuses == {DONE: shards}, f"all shards done after the kill: {stats.progress.summary()}")
+    sent = delivered(spec["journal_path"], "failover").get("sent", 0)
+    expect(sent == count, f"every recipient sent after failover ({sent:,} of {count:,})")
+    print(f"  killed worker {killed[0] if killed else '-'}; {stats.summary()}")
+
+
+async def check_broken_account(workdir, count, shards, options):
+    options = dict(options, broken_accounts=["bad.json"])
+    sender, spec = make_sender(workdir, "broken", shards, 2, ["good.json", "bad.json"], options)
+    stats = await sender.run(jobs(prospects(count)), spec)
+    statuses = stats.progress.statuses
+    expect(statuses[FAILED] == shards // 2 and statuses[DONE] == shards - shards // 2,
+           f"shards on the bad account failed, the others finished: {stats.progress.summary()}")
+    errors = sender.store.errors("broken")
+    expect(all("revoked" in error for _, error in errors), f"failure reason kept: {errors}")
+    expect(stats.unsent == count - stats.sent - stats.failed, f"unsent recipients counted: {stats.unsent}")
+    expect("recipients not sent" in stats.summary() and "revoked" in stats.summary(),
+           f"summary reports the lost shards: {stats.summary()}")
+    print(f"  {stats.summary().splitlines()[-1]}")
+
+
+async def check_cancel(workdir, count, shards, options):
+    sender, spec = make_sender(workdir, "cancel", shards, shards, ["a.json"], dict(options, gmail_latency=0.02))
+    control = JobControl(campaign=None)
+
+    def on_progress(progress):
+        if progress.sent > 0:
+            control.cancel()
+
+    stats = await sender.run(jobs(prospects(count)), spec, control=control, on_progress=on_progress)
+    expect(stats.progress.finished and stats.sent < count, f"cancel stops the run: {stats.summary()}")
+    expect(set(stats.progress.statuses) <= {CANCELLED, DONE}, f"shards cancelled: {stats.progress.summary()}")
+    print(f"  {stats.summary()}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--prospects", type=int, default=20000)
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=300, help="Gmail sends/s per sender account")
+    parser.add_argument("--gmail-latency", type=float, default=0.005)
+    args = parser.parse_args()
+    options = {"gmail_latency": args.gmail_latency}
+
+    print("partitioning:")
+    check_partition(100000, args.shards)
+    with tempfile.TemporaryDirectory() as workdir:
+        print("leases:")
+        check_leases(workdir)
+        print("throughput:")
+        asyncio.run(compare(workdir, args.prospects, args.shards, args.rate, options))
+        print("failover:")
+        asyncio.run(check_failover(workdir, args.prospects // 2, args.shards, options))
+        print("revoked sender account:")
+        asyncio.run(check_broken_account(workdir, 2000, args.shards, options))
+        print("cancel:")
+        asyncio.run(check_cancel(workdir, 20000, args.shards, options))
+
+    if FAILURES:
+        raise SystemExit(f"{len(FAILURES)} sharding checks failed")
+    print("\nall sharding checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Cold start of the bot: a fresh interpreter imports telegram_bot and constructs EmailBot,
+repeated a few times. Also lists which heavy modules were imported along the way.
+
+    python benchmarks/bench_startup.py [--runs 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+EXECUTION = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "execution")
+
+PROBE = r"""
+import json, sys, time
+started = time.perf_counter()
+import telegram_bot
+imported = time.perf_counter()
+bot = telegram_bot.EmailBot()
+built = time.perf_counter()
+heavy = [m for m in ("openai", "googleapiclient.discovery", "google_auth_oauthlib", "httplib2", "pandas") if m in sys.modules]
+print(json.dumps({"import": imported - started, "construct": built - imported, "heavy": heavy}))
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    env = dict(os.environ, JOURNAL_PATH="", JOBS_DB_PATH="", GENERATION_CACHE="0", SESSION_DB_PATH="")
+    results = []
+    for _ in range(args.runs):
+        output = subprocess.run([sys.executable, "-c", PROBE], cwd=EXECUTION, env=env,
+                                capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    for stage in ("import", "construct"):
+        values = [r[stage] * 1000 for r in results]
+        print(f"{stage:10} median {statistics.median(values):7.1f} ms  min {min(values):7.1f} ms")
+    print(f"heavy modules loaded at startup: {', '.join(results[-1]['heavy']) or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
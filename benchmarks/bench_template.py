@@ -0,0 +1,67 @@
+"""
+Per-recipient personalization cost: the old replace-per-column loop vs CompiledTemplate.
+
+    python benchmarks/bench_template.py [--prospects 10000] [--columns 20]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "execution"))
+
+from template import CompiledTemplate  # noqa: E402
+
+
+def make_draft(columns, size_kb=30):
+    block = "<tr><td style='padding:12px;font-family:Arial,sans-serif;color:#333333;'>{}</td></tr>\n"
+    rows = []
+    i = 0
+    while sum(len(r) for r in rows) < size_kb * 1024:
+        col = columns[i % len(columns)]
+        rows.append(block.format(f"Dear [{col}], here is paragraph {i} about [{col.lower()}] and our offer."))
+        i += 1
+    return "<html><body><table>" + "".join(rows) + "</table></body></html>"
+
+
+def legacy_render(draft, prospect):
+    final_email = draft
+    for col_name, value in prospect.items():
+        final_email = final_email.replace(f"[{col_name}]", value)
+    return final_email
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--prospects", type=int, default=10000)
+    parser.add_argument("--columns", type=int, default=20)
+    args = parser.parse_args()
+
+    columns = [f"Column {c}" for c in range(args.columns)]
+    draft = make_draft(columns)
+    prospects = [
+        dict({"email": f"user{p}@example.com"}, **{col: f"value {p}-{c}" for c, col in enumerate(columns)})
+        for p in range(args.prospects)
+    ]
+    print(f"draft {len(draft) / 1024:.1f} KB, {args.columns} columns, {args.prospects} prospects")
+
+    started = time.perf_counter()
+    for prospect in prospects:
+        legacy_render(draft, prospect)
+    legacy = time.perf_counter() - started
+
+    started = time.perf_counter()
+    template = CompiledTemplate(draft, ["email"] + columns)
+    compile_time = time.perf_counter() - started
+    for prospect in prospects:
+        template.render(prospect)
+    compiled = time.perf_counter() - started
+
+    per = 1e6 / args.prospects
+    print(f"legacy replace loop: {legacy * per:8.1f} us/recipient  ({legacy:.2f}s total)")
+    print(f"compiled template:   {compiled * per:8.1f} us/recipient  ({compiled:.2f}s total, compile {compile_time * 1000:.1f} ms)")
+    print(f"speedup: {legacy / compiled:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+"""
+In-process stand-ins for the Google Docs/Sheets/Gmail clients, the OpenAI client and the
+Telegram objects EmailBot touches, so the bot can be driven end to end without credentials.
+Every fake takes a latency (seconds) and an error rate; rows, drafts and ids are generated
+deterministically, so runs are comparable.
+"""
+import asyncio
+import os
+import random
+import re
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "execution"))
+
+import httplib2  # noqa: E402
+import openai  # noqa: E402
+from googleapiclient.errors import HttpError  # noqa: E402
+
+from credentials import CredentialsManager  # noqa: E402
+from services import GoogleService  # noqa: E402
+
+try:
+    import httpx2 as httpx  # what openai 3.x builds its errors from
+except ImportError:
+    import httpx
+
+RANGE_RE = re.compile(r"!A(\d+):([A-Z]+)(\d+)$")
+
+
+class Latency:
+    """Sleeps `seconds` (+/- jitter); reports a failure with probability `error_rate`."""
+
+    def __init__(self, seconds=0.0, jitter=0.0, error_rate=0.0, seed=1):
+        self.seconds = seconds
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def delay(self):
+        with self.lock:
+            self.calls += 1
+            delay = max(0.0, self.seconds + self.random.uniform(-self.jitter, self.jitter))
+            failed = self.error_rate and self.random.random() < self.error_rate
+        return delay, failed
+
+    def wait(self):
+        delay, failed = self.delay()
+        if delay:
+            time.sleep(delay)
+        return failed
+
+    async def await_(self):
+        delay, failed = self.delay()
+        if delay:
+            await asyncio.sleep(delay)
+        return failed
+
+
+def http_error(status=500):
+    return HttpError(httplib2.Response({"status": status}), b'{"error": {"message": "injected failure"}}')
+
+
+class FakeRequest:
+    """What googleapiclient's resource methods return: something with .execute(http=...)."""
+
+    def __init__(self, fn, latency, status=500):
+        self.fn = fn
+        self.latency = latency
+        self.status = status
+
+    def execute(self, http=None, num_retries=0):
+        if self.latency.wait():
+            raise http_error(self.status)
+        return self.fn()
+
+
+class FakeDocs:
+    def __init__(self, text=None, latency=None):
+        self.text = text or "Acme Corp sells solar panels to small businesses. " * 40
+        self.latency = latency or Latency()
+
+    def documents(self):
+        return self
+
+    def get(self, documentId, fields=None):
+        body = {"content": [{"paragraph": {"elements": [{"textRun": {"content": self.text}}]}}]}
+        return FakeRequest(lambda: {"revisionId": "rev-1", "body": body}, self.latency)
+
+
+class FakeSheets:
+    """
+    One or more sheets of `rows` generated prospects. Row n has Name, Company, Email, City;
+    `invalid_every` makes every n-th email blank and `duplicate_every` repeats an earlier one.
+    `page_errors` maps a page's first sheet row to how many reads of it fail with a 503
+    (row 1 is the header row; 0 stands for the sheet metadata, which holds the row count).
+    """
+
+    HEADERS = ["Name", "Company", "Email", "City"]
+
+    def __init__(self, rows, sheet_names=("Prospects",), latency=None, invalid_every=0, duplicate_every=0,
+                 page_errors=None):
+        self.rows = rows
+        self.sheet_names = list(sheet_names)
+        self.latency = latency or Latency()
+        self.invalid_every = invalid_every
+        self.duplicate_every = duplicate_every
+        self.page_errors = dict(page_errors or {})
+        self.cells_read = 0
+
+    def row(self, n):
+        # n is the 1-based data row (sheet row n + 1)
+        email = f"prospect{n}@example.com"
+        if self.invalid_every and n % self.invalid_every == 0:
+            email = ""
+        elif self.duplicate_every and n % self.duplicate_every == 0:
+            email = f"prospect{n - 1}@example.com"
+        return [f"Person {n}", f"Company {n % 997}", email, f"City {n % 50}"]
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def _fail(self, first):
+        if self.page_errors.get(first, 0) > 0:
+            self.page_errors[first] -= 1
+            raise http_error(503)
+
+    def get(self, spreadsheetId, fields=None, **kwargs):
+        range_name = kwargs.get("range")  # the real client's keyword shadows the builtin
+        if range_name is None:
+            # spreadsheets().get(): sheet metadata (only the row count read fails, not the sheet list)
+            sheets = [{"properties": {"title": name, "gridProperties": {"rowCount": self.rows + 1}}}
+                      for name in self.sheet_names]
+
+            def metadata():
+                if fields == "sheets.properties":
+                    self._fail(0)
+                return {"sheets": sheets}
+            return FakeRequest(metadata, self.latency)
+        if range_name.endswith("!1:1"):
+            def headers():
+                self._fail(1)
+                return {"values": [list(self.HEADERS)]}
+            return FakeRequest(headers, self.latency)
+        match = RANGE_RE.search(range_name)
+        first, last = int(match.group(1)), int(match.group(3))
+
+        def page():
+            self._fail(first)
+            values = [self.row(n - 1) for n in range(max(first, 2), min(last, self.rows + 1) + 1)]
+            self.cells_read += len(values) * len(self.HEADERS)
+            return {"values": values}
+        return FakeRequest(page, self.latency)
+
+
+class FakeBatch:
+    def __init__(self, gmail, callback):
+        self.gmail = gmail
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request, request_id))
+
+    def execute(self, http=None):
+        # One round trip for the whole batch, then each sub-request can fail on its own
+        self.gmail.batch_latency.wait()
+        for request, request_id in self.requests:
+            failed = self.gmail.latency.delay()[1]
+            if failed:
+                self.callback(request_id, None, http_error(self.gmail.error_status))
+            else:
+                self.callback(request_id, request.fn(), None)
+
+
+class FakeGmail:
+    def __init__(self, latency=None, batch_latency=None, error_status=429):
+        self.latency = latency or Latency()
+        self.batch_latency = batch_latency or Latency(self.latency.seconds * 2)
+        self.error_status = error_status
+        self.sent = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def send(self, userId, body):
+        def deliver():
+            with self._lock:
+                self.sent += 1
+                self.bytes += len(body["raw"])
+                return {"id": f"msg-{self.sent}"}
+        return FakeRequest(deliver, self.latency, self.error_status)
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback)
+
+
+class FakeGoogleService(GoogleService):
+    """The real GoogleService (caching, paging, batching, retries) on top of the fake clients."""
+
+    def __init__(self, docs=None, sheets=None, gmail=None):
+        # Token without expiry (no refresher thread); the fake requests ignore the transport
+        creds = SimpleNamespace(valid=True, expired=False, token="fake", expiry=None)
+        super().__init__(CredentialsManager(lambda: creds, transport_factory=lambda creds: object(), token_file=""))
+        # Pre-filled, so client building never runs
+        self._clients = {
+            "docs_service": docs or FakeDocs(),
+            "sheets_service": sheets or FakeSheets(100),
+            "gmail_service": gmail or FakeGmail(),
+        }
+
+
+
+def shard_service(account, options):
+    """
+    sharding.ShardedSender service factory ("fakes:shard_service"), built inside each worker
+    process: a FakeGoogleService whose Gmail uses `options` gmail_latency / gmail_errors
+    (default: FAKE_GMAIL_LATENCY / FAKE_GMAIL_ERRORS from the environment). Accounts listed
+    in options["broken_accounts"] fail like a revoked token.
+    """
+    if account in options.get("broken_accounts", ()):
+        raise RuntimeError(f"token for {account} was revoked")
+    seconds = options.get("gmail_latency", float(os.getenv("FAKE_GMAIL_LATENCY", "0")))
+    errors = options.get("gmail_errors", float(os.getenv("FAKE_GMAIL_ERRORS", "0")))
+    latency = Latency(seconds, seconds / 4, errors, seed=os.getpid())
+    return FakeGoogleService(gmail=FakeGmail(latency=latency))
+
+
+FAKE_DRAFT = (
+    "<html><body style=\"font-family: Arial, sans-serif; color: #333;\">"
+    "<p>Hello [Name],</p>"
+    "<p>I noticed [Company] is growing fast in [City]. {filler}</p>"
+    "<p>Best regards,<br>The Acme team</p>"
+    "</body></html>"
+)
+
+
+def rate_limit_error(retry_after=0.1):
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(429, request=request, headers={"retry-after": str(retry_after)})
+    return openai.RateLimitError("Rate limit reached (injected)", response=response, body=None)
+
+
+class FakeCompletions:
+    def __init__(self, latency, first_token, draft_kb, chunk_chars=40):
+        self.latency = latency
+        self.first_token = first_token
+        self.chunk_chars = chunk_chars
+        self.draft = FAKE_DRAFT.format(filler="We help teams like yours save on energy. " * max(1, draft_kb * 25))
+        self.calls = 0
+
+    def _usage(self, messages):
+        prompt = sum(len(str(m.get("content", ""))) for m in messages) // 4
+        return SimpleNamespace(
+            prompt_tokens=prompt,
+            completion_tokens=len(self.draft) // 4,
+            prompt_tokens_details=SimpleNamespace(cached_tokens=prompt // 2),
+        )
+
+    async def create(self, model, messages, stream=False, stream_options=None, **kwargs):
+        self.calls += 1
+        if await self.latency.await_():
+            raise rate_limit_error()
+        usage = self._usage(messages)
+        content = "```html\n" + self.draft + "\n```"
+        if not stream:
+            return SimpleNamespace(usage=usage, choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+        return self._stream(content, usage, (stream_options or {}).get("include_usage"))
+
+    async def _stream(self, content, usage, include_usage):
+        await asyncio.sleep(self.first_token)
+        for i in range(0, len(content), self.chunk_chars):
+            yield SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=SimpleNamespace(content=content[i:i + self.chunk_chars]))])
+            await asyncio.sleep(0)
+        if include_usage:
+            yield SimpleNamespace(usage=usage, choices=[])
+
+
+class FakeOpenAIClient:
+    """Duck-types the parts of openai.AsyncOpenAI the services use. Errors are 429s."""
+
+    def __init__(self, latency=None, first_token=0.0, draft_kb=5):
+        self.chat = SimpleNamespace(completions=FakeCompletions(latency or Latency(), first_token, draft_kb))
+
+    def with_options(self, **kwargs):
+        return self
+
+
+class FakeBot:
+    """context.bot: records what the bot would have sent to Telegram."""
+
+    def __init__(self, latency=None):
+        self.latency = latency or Latency()
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await self.latency.await_()
+        self.sent.append((chat_id, text))
+        return FakeMessage(chat_id, self, text)
+
+
+class FakeMessage:
+    def __init__(self, chat_id, bot, text=""):
+        self.chat_id = chat_id
+        self.bot = bot
+        self.text = text
+        self.edits = 0
+
+    async def reply_text(self, text, reply_markup=None, **kwargs):
+        return await self.bot.send_message(self.chat_id, text, reply_markup=reply_markup)
+
+    async def reply_document(self, document, filename=None, caption=None, **kwargs):
+        await self.bot.latency.await_()
+        self.bot.sent.append((self.chat_id, f"[document {filename}, {len(document)} bytes] {caption or ''}"))
+
+    async def edit_text(self, text, **kwargs):
+        await self.bot.latency.await_()
+        self.edits += 1
+        self.text = text
+        return self
+
+
+class FakeCallbackQuery:
+    def __init__(self, chat_id, bot, data):
+        self.data = data
+        self.message = FakeMessage(chat_id, bot)
+
+    async def answer(self, *args, **kwargs):
+        pass
+
+    async def edit_message_text(self, text, reply_markup=None, **kwargs):
+        return await self.message.edit_text(text)
+
+
+class Chat:
+    """
+    One scripted Telegram chat. `text(...)` and `press(...)` build duck-typed Update objects
+    with the attributes EmailBot reads (effective_chat.id, message, callback_query).
+    """
+
+    def __init__(self, chat_id, bot=None):
+        self.chat_id = chat_id
+        self.bot = bot or FakeBot()
+        self.context = SimpleNamespace(bot=self.bot, user_data={}, chat_data={}, args=[])
+
+    def text(self, text):
+        message = FakeMessage(self.chat_id, self.bot, text)
+        return SimpleNamespace(effective_chat=SimpleNamespace(id=self.chat_id), message=message, callback_query=None)
+
+    def press(self, data):
+        query = FakeCallbackQuery(self.chat_id, self.bot, data)
+        return SimpleNamespace(effective_chat=SimpleNamespace(id=self.chat_id), message=None, callback_query=query)
@@ -0,0 +1,154 @@
+"""
+Local stand-in for the OpenAI chat completions endpoint, for offline runs of the bot and
+the personalization pipeline. Each request waits `--latency` seconds (plus jitter) and
+answers with an HTML email naming the prospect; a `--rate-limit` fraction of requests
+(and any request above `--max-concurrent` in flight) gets a 429 with Retry-After.
+
+    python benchmarks/stub_openai.py --port 8765 --latency 0.5 --rate-limit 0.05
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=stub python execution/telegram_bot.py
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EMAIL_RE = re.compile(r"'email': '([^']*)'")
+
+
+class StubState:
+    def __init__(self, latency=0.2, jitter=0.1, rate_limit=0.0, max_concurrent=0, retry_after=0.5):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.max_concurrent = max_concurrent
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.peak = 0
+        self.completed = 0
+        self.throttled = 0
+
+
+def make_html(messages):
+    text = " ".join(m["content"] for m in messages if isinstance(m.get("content"), str))
+    found = EMAIL_RE.findall(text)
+    recipient = found[-1] if found else "there"
+    return (
+        "<html><body style=\"font-family: Arial, sans-serif;\">"
+        f"<p>Hello {recipient},</p>"
+        "<p>This is a stub draft generated offline.</p>"
+        "<p>Best regards,<br>The team</p>"
+        "</body></html>"
+    )
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _json(self, status, payload, headers=()):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if not self.path.endswith("/chat/completions"):
+            self._json(404, {"error": {"message": "not found"}})
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        state = self.state
+        with state.lock:
+            busy = state.max_concurrent and state.in_flight >= state.max_concurrent
+            if busy or random.random() < state.rate_limit:
+                state.throttled += 1
+                throttled = True
+            else:
+                throttled = False
+                state.in_flight += 1
+                state.peak = max(state.peak, state.in_flight)
+        if throttled:
+            self._json(429, {"error": {"message": "Rate limit reached (stub)", "type": "rate_limit_exceeded"}},
+                       [("Retry-After", str(state.retry_after))])
+            return
+
+        try:
+            time.sleep(max(0.0, state.latency + random.uniform(-state.jitter, state.jitter)))
+            html = make_html(request.get("messages", []))
+            prompt_tokens = sum(len(str(m.get("content", ""))) for m in request.get("messages", [])) // 4
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(html) // 4,
+                "total_tokens": prompt_tokens + len(html) // 4,
+                "prompt_tokens_details": {"cached_tokens": prompt_tokens // 2},
+            }
+            if request.get("stream"):
+                self._stream(request, html, usage)
+            else:
+                self._json(200, {
+                    "id": "chatcmpl-stub",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model"),
+                    "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": html}}],
+                    "usage": usage,
+                })
+        finally:
+            with state.lock:
+                state.in_flight -= 1
+                state.completed += 1
+
+    def _stream(self, request, html, usage):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        base = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": int(time.time()), "model": request.get("model")}
+        for i in range(0, len(html), 40):
+            chunk = dict(base, choices=[{"index": 0, "delta": {"content": html[i:i + 40]}, "finish_reason": None}])
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        final = dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        self.wfile.write(f"data: {json.dumps(final)}\n\n".encode("utf-8"))
+        if (request.get("stream_options") or {}).get("include_usage"):
+            self.wfile.write(f"data: {json.dumps(dict(base, choices=[], usage=usage))}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+
+
+def serve(port=0, **options):
+    """Starts the stub on a background thread. Returns (server, state); base URL is http://127.0.0.1:<port>/v1."""
+    state = StubState(**options)
+    handler = type("Handler", (StubHandler,), {"state": state})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--max-concurrent", type=int, default=0, help="429 above this many in-flight requests (0 = no cap)")
+    args = parser.parse_args()
+
+    server, _ = serve(args.port, latency=args.latency, jitter=args.jitter,
+                      rate_limit=args.rate_limit, max_concurrent=args.max_concurrent)
+    print(f"Stub OpenAI API on http://127.0.0.1:{server.server_address[1]}/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
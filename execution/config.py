@@ -5,7 +5,109 @@ load_dotenv()
 
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Optional OpenAI-compatible endpoint (e.g. benchmarks/stub_openai.py for offline runs)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
 GOOGLE_DOC_ID = os.getenv("GOOGLE_DOC_ID")
 GOOGLE_SHEET_ID = os.getenv("GOOGLE_SHEET_ID")
 GOOGLE_CREDENTIALS_FILE = "credentials.json"
 GOOGLE_TOKEN_FILE = "token.json"
+
+# Bulk sending. Gmail allows 250 quota units per user per second and messages.send
+# costs 100 units, so ~2.5 sends/s is the sustained per-user ceiling.
+SEND_CONCURRENCY = int(os.getenv("SEND_CONCURRENCY", "4"))
+GMAIL_SENDS_PER_SECOND = float(os.getenv("GMAIL_SENDS_PER_SECOND", "2.5"))
+GMAIL_SEND_BURST = int(os.getenv("GMAIL_SEND_BURST", "5"))
+# Sub-requests per Gmail batch call (max 100, Google recommends <= 50). 0 or 1 sends one by one.
+GMAIL_BATCH_SIZE = int(os.getenv("GMAIL_BATCH_SIZE", "0"))
+GMAIL_BATCH_RETRIES = int(os.getenv("GMAIL_BATCH_RETRIES", "3"))
+# Threads used to run blocking Google API calls off the bot's event loop
+GOOGLE_IO_THREADS = int(os.getenv("GOOGLE_IO_THREADS", "8"))
+
+# Per-chat sessions. Set SESSION_DB_PATH (e.g. .tmp/sessions.db) to keep them in SQLite across restarts.
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(6 * 3600)))
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "1000"))
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "")
+
+# Rows fetched per Sheets values().get call when streaming a prospect sheet
+SHEET_PAGE_SIZE = int(os.getenv("SHEET_PAGE_SIZE", "1000"))
+# A page that still fails after this many retries (429/5xx/timeouts, with backoff) stops the campaign
+SHEET_READ_RETRIES = int(os.getenv("SHEET_READ_RETRIES", "4"))
+
+# Send journal used to resume interrupted campaigns without double-sending. Empty disables it.
+JOURNAL_PATH = os.getenv("JOURNAL_PATH", ".tmp/send_journal.db")
+JOURNAL_BATCH_SIZE = int(os.getenv("JOURNAL_BATCH_SIZE", "200"))
+JOURNAL_FLUSH_SECONDS = float(os.getenv("JOURNAL_FLUSH_SECONDS", "1.0"))
+
+# Approved campaigns are queued here and sent in the background (empty keeps the queue in memory)
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", ".tmp/campaign_jobs.db")
+# Campaigns sending at the same time, across all chats
+CAMPAIGN_WORKERS = int(os.getenv("CAMPAIGN_WORKERS", "2"))
+# How often a running campaign's counters are written to JOBS_DB_PATH
+JOB_PROGRESS_SECONDS = float(os.getenv("JOB_PROGRESS_SECONDS", "5"))
+
+# Sharded sending for very large sheets: campaigns with at least SHARD_MIN_ROWS rows are split by
+# recipient into SEND_SHARDS shards (0 or 1 = off), sent by SHARD_PROCESSES local worker processes
+# (0 = only workers started with `python execution/sharding.py worker`). Shard n sends from
+# SHARD_TOKEN_FILES[n % count]; shards on the same account split its GMAIL_SENDS_PER_SECOND.
+SEND_SHARDS = int(os.getenv("SEND_SHARDS", "0"))
+SHARD_MIN_ROWS = int(os.getenv("SHARD_MIN_ROWS", "20000"))
+SHARD_PROCESSES = int(os.getenv("SHARD_PROCESSES", str(SEND_SHARDS)))
+SHARD_TOKEN_FILES = [f.strip() for f in os.getenv("SHARD_TOKEN_FILES", GOOGLE_TOKEN_FILE).split(",") if f.strip()]
+# Shard assignments and aggregated progress; a shard whose worker stops renewing its lease for
+# SHARD_LEASE_SECONDS is taken over by another worker (the send journal skips who already got it)
+SHARD_DB_PATH = os.getenv("SHARD_DB_PATH", ".tmp/shards.db")
+SHARD_LEASE_SECONDS = float(os.getenv("SHARD_LEASE_SECONDS", "30"))
+SHARD_MAX_ATTEMPTS = int(os.getenv("SHARD_MAX_ATTEMPTS", "3"))
+# 'module:function' building each shard's Google service (e.g. fakes:shard_service for offline runs)
+SHARD_SERVICE_FACTORY = os.getenv("SHARD_SERVICE_FACTORY", "sharding:google_service")
+
+# Campaign messages to Telegram: failures are summarized every NOTIFY_WINDOW_SECONDS, each chat
+# gets at most one message per NOTIFY_CHAT_INTERVAL seconds and the bot NOTIFY_GLOBAL_RATE per second
+NOTIFY_WINDOW_SECONDS = float(os.getenv("NOTIFY_WINDOW_SECONDS", "5"))
+NOTIFY_CHAT_INTERVAL = float(os.getenv("NOTIFY_CHAT_INTERVAL", "1.0"))
+NOTIFY_GLOBAL_RATE = float(os.getenv("NOTIFY_GLOBAL_RATE", "25"))
+# How often a running campaign's progress message is edited (0 disables it)
+NOTIFY_PROGRESS_SECONDS = float(os.getenv("NOTIFY_PROGRESS_SECONDS", "15"))
+
+# Cache for Google Doc context and sheet metadata (cleared with /refresh)
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", "600"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "256"))
+
+# Number of draft variants generated in parallel for each draft/refine round
+DRAFT_VARIANTS = int(os.getenv("DRAFT_VARIANTS", "1"))
+# Stream single drafts and edit the Telegram preview in place every STREAM_EDIT_INTERVAL seconds
+STREAM_PREVIEW = os.getenv("STREAM_PREVIEW", "1") == "1"
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+# Earlier feedback items restated (compacted) when refining a draft
+REFINE_HISTORY = int(os.getenv("REFINE_HISTORY", "5"))
+
+# On-disk cache of generated drafts for identical requests. GENERATION_CACHE=0 turns it off.
+GENERATION_CACHE = os.getenv("GENERATION_CACHE", "1") == "1"
+GENERATION_CACHE_DIR = os.getenv("GENERATION_CACHE_DIR", ".tmp/generation_cache")
+GENERATION_CACHE_MAX_MB = int(os.getenv("GENERATION_CACHE_MAX_MB", "50"))
+
+# Approved drafts are minified and get a real plain-text part before sending. OPTIMIZE_HTML=0 sends them as generated.
+OPTIMIZE_HTML = os.getenv("OPTIMIZE_HTML", "1") == "1"
+
+# Per-prospect AI personalization ("Approve & Personalize" button). Off by default: one model call per recipient.
+PERSONALIZATION = os.getenv("PERSONALIZATION", "0") == "1"
+PERSONALIZE_CONCURRENCY = int(os.getenv("PERSONALIZE_CONCURRENCY", "8"))
+# A campaign stops generating once its estimated spend would exceed MAX_SPEND_USD (0 = no limit)
+MAX_SPEND_USD = float(os.getenv("MAX_SPEND_USD", "5.0"))
+# USD per million tokens, used for the spend estimate
+OPENAI_INPUT_PRICE_PER_M = float(os.getenv("OPENAI_INPUT_PRICE_PER_M", "1.25"))
+OPENAI_CACHED_INPUT_PRICE_PER_M = float(os.getenv("OPENAI_CACHED_INPUT_PRICE_PER_M", "0.125"))
+OPENAI_OUTPUT_PRICE_PER_M = float(os.getenv("OPENAI_OUTPUT_PRICE_PER_M", "10.0"))
+
+# Metrics: /debug always shows them. METRICS_PORT serves Prometheus text on :<port>/metrics,
+# METRICS_FILE rewrites a Prometheus text file every METRICS_FILE_SECONDS. Both off by default.
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_FILE = os.getenv("METRICS_FILE", "")
+METRICS_FILE_SECONDS = float(os.getenv("METRICS_FILE_SECONDS", "15"))
+# Operations slower than this are logged with their parent operation (0 disables)
+METRICS_SLOW_SECONDS = float(os.getenv("METRICS_SLOW_SECONDS", "10"))
+
+# Google access tokens are refreshed in the background this many seconds before they expire
+GOOGLE_TOKEN_REFRESH_MARGIN = int(os.getenv("GOOGLE_TOKEN_REFRESH_MARGIN", "600"))
+# Authorized transports shared by all Google calls (0 = GOOGLE_IO_THREADS + SEND_CONCURRENCY)
+GOOGLE_HTTP_POOL_SIZE = int(os.getenv("GOOGLE_HTTP_POOL_SIZE", "0"))
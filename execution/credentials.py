@@ -0,0 +1,209 @@
+import contextlib
+import datetime
+import os
+import queue
+import threading
+import time
+
+import config
+import metrics
+
+
+def _utcnow():
+    # google-auth keeps `expiry` as a naive UTC datetime
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def save_token(path, creds):
+    # Written to a temp file and renamed, so other processes loading the token never read half of it
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as token:
+        token.write(creds.to_json())
+    os.replace(tmp_path, path)
+
+
+def _permanent(error):
+    # A revoked or expired refresh token (invalid_grant) fails the same way on every retry
+    from google.auth.exceptions import RefreshError
+    return isinstance(error, RefreshError) and not getattr(error, "retryable", False)
+
+
+def _authorized_http(creds):
+    import httplib2
+    from google_auth_httplib2 import AuthorizedHttp
+    return AuthorizedHttp(creds, http=httplib2.Http())
+
+
+class CredentialsManager:
+    """
+    Owns the Google credentials for one account. After the first load a daemon thread
+    refreshes the access token `margin` seconds before it expires, so requests never pay
+    for a refresh in the hot path. If that thread falls behind, the first caller to notice
+    refreshes under a lock while the others wait for the result instead of all refreshing.
+
+    `transport()` lends out one authorized transport per concurrent caller from a bounded
+    pool. httplib2 transports are not thread-safe, so each is used by one thread at a time,
+    but they outlive the threads that use them: a new campaign (new sender threads) reuses
+    warm connections instead of opening new ones. All transports share the same credentials,
+    so one background refresh covers them all.
+    """
+
+    def __init__(self, loader, margin=None, pool_size=None, transport_factory=None, token_file=None):
+        self.loader = loader
+        self.margin = config.GOOGLE_TOKEN_REFRESH_MARGIN if margin is None else margin
+        self.pool_size = pool_size or config.GOOGLE_HTTP_POOL_SIZE or (config.GOOGLE_IO_THREADS + config.SEND_CONCURRENCY)
+        self.transport_factory = transport_factory or _authorized_http
+        self.token_file = config.GOOGLE_TOKEN_FILE if token_file is None else token_file
+        self._creds = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._pool = queue.LifoQueue()
+        self._created = 0
+        self._in_use = 0
+        self._pool_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._refresher = None
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self.error = None  # set when the refresh token is rejected; no more refreshes are tried
+        self.pool_waits = 0
+
+    @property
+    def creds(self):
+        if self._creds is None:
+            with self._lock:
+                if self._creds is None:
+                    self._creds = self.loader()
+                    self._start_refresher()
+        return self._creds
+
+    @property
+    def loaded(self):
+        return self._creds is not None
+
+    def seconds_left(self):
+        """Seconds until the access token expires; None if it has no expiry (or isn't loaded)."""
+        creds = self._creds
+        expiry = getattr(creds, "expiry", None)
+        if expiry is None:
+            return None
+        return (expiry - _utcnow()).total_seconds()
+
+    def _due(self):
+        left = self.seconds_left()
+        return left is not None and left <= self.margin
+
+    def refresh(self, force=False):
+        """Refreshes the token unless another thread just did. Returns True if this call refreshed."""
+        creds = self.creds
+        with self._refresh_lock:
+            if not force and not self._due():
+                return False
+            from google.auth.transport.requests import Request
+            started = time.perf_counter()
+            try:
+                creds.refresh(Request())
+            except Exception:
+                self.refresh_failures += 1
+                metrics.inc("google_token_refreshes_total", result="error")
+                raise
+            self.refreshes += 1
+            metrics.inc("google_token_refreshes_total", result="ok")
+            metrics.observe("google_token_refresh_seconds", time.perf_counter() - started)
+            self._save(creds)
+            return True
+
+    def _save(self, creds):
+        # Same token file GoogleService writes at first login, kept current for the next start
+        if not self.token_file or not hasattr(creds, "to_json"):
+            return
+        try:
+            save_token(self.token_file, creds)
+        except OSError as e:
+            print(f"Error saving refreshed token: {e}")
+
+    def ensure_fresh(self):
+        """Cheap check on the request path; only refreshes if the background thread fell behind."""
+        if self._due() and self.error is None:
+            try:
+                self.refresh()
+            except Exception as e:
+                # The transport will still try its own refresh on a 401
+                print(f"Error refreshing token: {e}")
+
+    def _start_refresher(self):
+        if self._refresher is not None or getattr(self._creds, "expiry", None) is None:
+            return
+        self._refresher = threading.Thread(target=self._run, name="google-token-refresh", daemon=True)
+        self._refresher.start()
+
+    def _run(self):
+        delay = 0.0
+        failures = 0
+        while not self._stop.wait(delay):
+            left = self.seconds_left()
+            if left is None:
+                return
+            if left > self.margin:
+                delay = left - self.margin
+                continue
+            try:
+                self.refresh()
+                delay = 0.0
+                failures = 0
+            except Exception as e:
+                if _permanent(e):
+                    # Retrying can't help; /debug shows the error until the token is replaced
+                    self.error = f"{type(e).__name__}: {e}"
+                    print(f"Google refresh token rejected, background refresh stopped: {e}")
+                    return
+                print(f"Error refreshing token in background: {e}")
+                # Exponential backoff from 5 seconds up to 5 minutes
+                failures += 1
+                delay = min(300.0, 5.0 * 2 ** (failures - 1))
+
+    @contextlib.contextmanager
+    def transport(self):
+        """Borrows an authorized transport for one request (or one batch) on this thread."""
+        self.ensure_fresh()
+        http = self._borrow()
+        try:
+            yield http
+        finally:
+            with self._pool_lock:
+                self._in_use -= 1
+            self._pool.put(http)
+
+    def _borrow(self):
+        try:
+            http = self._pool.get_nowait()
+        except queue.Empty:
+            http = None
+            with self._pool_lock:
+                create = self._created < self.pool_size
+                if create:
+                    self._created += 1
+            if create:
+                http = self.transport_factory(self.creds)
+            else:
+                # Every transport is busy: wait for one rather than growing past the pool size
+                self.pool_waits += 1
+                http = self._pool.get()
+        with self._pool_lock:
+            self._in_use += 1
+        return http
+
+    def stats(self):
+        return {
+            "transports": self._created,
+            "in_use": self._in_use,
+            "pool_size": self.pool_size,
+            "pool_waits": self.pool_waits,
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures,
+            "error": self.error,
+            "token_seconds_left": self.seconds_left(),
+        }
+
+    def close(self):
+        self._stop.set()
@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import config
+
+
+class GenerationCache:
+    """
+    On-disk cache of cleaned drafts, keyed by a hash of everything sent to the model
+    (model name + full message list). Entries are plain files named <sha256>.html; the
+    total size is bounded and the least recently used files are deleted first.
+    """
+
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = directory or config.GENERATION_CACHE_DIR
+        self.max_bytes = max_bytes or config.GENERATION_CACHE_MAX_MB * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._sizes = OrderedDict()  # key -> bytes, least recently used first
+        self._total = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".html"):
+                path = os.path.join(self.directory, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, name[:-5], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._sizes[key] = size
+            self._total += size
+
+    @staticmethod
+    def key(model, messages):
+        payload = json.dumps({"model": model, "messages": messages}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".html")
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._sizes:
+                self.misses += 1
+                return None
+            self._sizes.move_to_end(key)
+        try:
+            with open(self._path(key), encoding='utf-8') as f:
+                html = f.read()
+            # mtime doubles as the LRU timestamp across restarts
+            os.utime(self._path(key))
+        except OSError:
+            with self._lock:
+                self._total -= self._sizes.pop(key, 0)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return html
+
+    def set(self, key, html):
+        data = html.encode('utf-8')
+        tmp_path = self._path(key) + ".tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            print(f"Error writing generation cache: {e}")
+            return
+        with self._lock:
+            self._total += len(data) - self._sizes.pop(key, 0)
+            self._sizes[key] = len(data)
+            while self._total > self.max_bytes and len(self._sizes) > 1:
+                old_key, size = self._sizes.popitem(last=False)
+                self._total -= size
+                try:
+                    os.remove(self._path(old_key))
+                except OSError:
+                    pass
+
+    def __len__(self):
+        return len(self._sizes)
@@ -0,0 +1,390 @@
+import html as html_lib
+import re
+from html.parser import HTMLParser
+
+# What plain-text parts used to be: every tag stripped. Still used for the Telegram preview.
+TAG_RE = re.compile('<.*?>')
+# HTML whitespace only: a non-breaking space (U+00A0) is content, not whitespace
+WHITESPACE_RE = re.compile(r"[ \t\n\r\f]+")
+# Quoted CSS strings and url(...) are copied as written; only the text between them is squeezed
+CSS_LITERAL_RE = re.compile(r'("(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'|url\([^)]*\))', re.IGNORECASE)
+CSS_COMMENT_RE = re.compile(r"/\*.*?\*/", re.DOTALL)
+CSS_PUNCTUATION_RE = re.compile(r" ?([{};,]) ?")
+IMPORTANT_RE = re.compile(r"!\s*important$", re.IGNORECASE)
+CHARREF_RE = re.compile(r"&(?:#[0-9]+|#[xX][0-9a-fA-F]+|[a-zA-Z][a-zA-Z0-9]*);")
+TAG_NAME_RE = re.compile(r"<([^\s/>]+)")
+ATTRIBUTE_RE = re.compile(r"""([^\s/>"'=]+)(?:[ \t\n\r\f]*=[ \t\n\r\f]*("[^"]*"|'[^']*'|[^\s>]+))?""")
+PRE_WHITESPACE_RE = re.compile(r"white-space\s*:\s*(pre|break-spaces)", re.IGNORECASE)
+INLINE_DISPLAY_RE = re.compile(r"display\s*:\s*inline", re.IGNORECASE)
+
+# Whitespace-only text between two of these (or at the document edges) is never rendered
+BLOCK_TAGS = {
+    "html", "head", "body", "title", "meta", "link", "style", "script", "base",
+    "div", "p", "table", "thead", "tbody", "tfoot", "tr", "td", "th", "caption", "colgroup", "col",
+    "ul", "ol", "li", "dl", "dt", "dd", "h1", "h2", "h3", "h4", "h5", "h6", "br", "hr",
+    "blockquote", "pre", "center", "section", "header", "footer", "article", "aside", "nav", "main",
+    "form", "fieldset", "figure", "figcaption", "address",
+}
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+# Content copied byte for byte
+PRESERVE_TAGS = {"pre", "textarea", "script", "plaintext", "xmp", "listing"}
+
+
+def _squeeze_css(css):
+    """Collapses whitespace in a CSS fragment, leaving quoted strings and url() untouched."""
+    pieces = CSS_LITERAL_RE.split(css)
+    for i in range(0, len(pieces), 2):
+        piece = WHITESPACE_RE.sub(" ", CSS_COMMENT_RE.sub(" ", pieces[i]))
+        pieces[i] = CSS_PUNCTUATION_RE.sub(r"\1", piece)
+    return "".join(pieces).strip()
+
+
+def _split_declarations(style):
+    """Splits a style attribute on ';', ignoring semicolons inside strings and parentheses."""
+    declarations, current, depth, quote = [], [], 0, None
+    for char in style:
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in "\"'":
+            quote = char
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth = max(0, depth - 1)
+        elif char == ";" and depth == 0:
+            declarations.append("".join(current))
+            current = []
+            continue
+        current.append(char)
+    declarations.append("".join(current))
+    return declarations
+
+
+def optimize_style(style):
+    """
+    Minifies an inline style attribute and drops exact repeats of a declaration (same
+    property and value), keeping the last one so the cascade is unchanged. A property set
+    to different values is kept every time, in order: "background:#06c;background:linear-
+    gradient(...)" is a fallback for clients like Outlook that ignore the second one.
+    """
+    parsed = []  # (property or None, text)
+    for declaration in _split_declarations(style):
+        declaration = _squeeze_css(declaration)
+        if not declaration:
+            continue
+        name, colon, value = declaration.partition(":")
+        if not colon:
+            parsed.append((None, declaration))
+            continue
+        name = name.strip().lower()
+        value = value.strip()
+        if IMPORTANT_RE.search(value):
+            value = IMPORTANT_RE.sub("", value).rstrip() + "!important"
+        parsed.append((name, f"{name}:{value}"))
+    last = {text: index for index, (name, text) in enumerate(parsed) if name is not None}
+    return ";".join(text for index, (name, text) in enumerate(parsed) if name is None or last[text] == index)
+
+
+def _raw_attribute(tag_text, name):
+    """
+    An attribute value as written in the tag, with only ;-terminated references decoded.
+    HTMLParser would also decode "&copy" in "?a=1&copy=2", which browsers leave alone.
+    """
+    match = TAG_NAME_RE.match(tag_text)
+    for attribute in ATTRIBUTE_RE.finditer(tag_text, match.end() if match else 0):
+        if attribute.group(1).lower() == name and attribute.group(2) is not None:
+            value = attribute.group(2)
+            if value[:1] in "\"'":
+                value = value[1:-1]
+            return _decode(value)
+    return ""
+
+
+def _decode(value):
+    return CHARREF_RE.sub(lambda m: html_lib.unescape(m.group(0)), value)
+
+
+def _attribute(name, value):
+    if "&" in value:
+        value = value.replace("&", "&amp;")
+    if '"' in value and "'" not in value:
+        return f"{name}='{value}'"
+    return f'{name}="{value.replace(chr(34), "&quot;")}"'
+
+
+class _Minifier(HTMLParser):
+    def __init__(self, source):
+        super().__init__(convert_charrefs=False)
+        self.source = source
+        # Offset of each line in `source`, to find the parser's (line, column) position in it
+        self.line_starts = [0] + [match.end() for match in re.finditer("\n", source)]
+        self.tokens = []  # (kind, text, is_block); kind is "tag" or "text"
+        self.text = []
+        self.preserve = 0
+        self.preserve_stack = []  # per open element: did it start a preserved region?
+        self.block_stack = {}     # tag name -> block-ness of each open element with that name
+
+    def _flush(self):
+        if self.text:
+            self.tokens.append(("text", "".join(self.text), False))
+            self.text = []
+
+    def _tag(self, text, is_block):
+        self._flush()
+        self.tokens.append(("tag", text, is_block))
+
+    def _start(self, raw, tag, attrs, self_closing):
+        style = dict(attrs).get("style") or ""
+        is_block = tag in BLOCK_TAGS and not INLINE_DISPLAY_RE.search(style)
+        preserves = tag in PRESERVE_TAGS or PRE_WHITESPACE_RE.search(style) is not None
+        if not self_closing and tag not in VOID_TAGS:
+            self.block_stack.setdefault(tag, []).append(is_block)
+            self.preserve_stack.append((tag, preserves))
+            if preserves:
+                self.preserve += 1
+        self._tag(self._rewrite_tag(raw, self_closing), is_block)
+
+    def _rewrite_tag(self, raw, self_closing):
+        # Attributes are re-emitted as written (so entity-like text in URLs is never
+        # re-interpreted); only the whitespace between them and the style value change
+        match = TAG_NAME_RE.match(raw)
+        if not match:
+            return raw
+        body = raw[match.end():-1]
+        if self_closing:
+            body = body.rstrip()[:-1]
+        parts = [match.group(0)]
+        for attribute in ATTRIBUTE_RE.finditer(body):
+            name, value = attribute.group(1), attribute.group(2)
+            if value is not None and name.lower() == "style":
+                if value[:1] in "\"'":
+                    value = value[1:-1]
+                style = optimize_style(_decode(value))
+                if style:
+                    parts.append(_attribute(name, style))
+            elif value is None:
+                parts.append(name)
+            else:
+                parts.append(f"{name}={value}")
+        return " ".join(parts) + ("/>" if self_closing else ">")
+
+    def handle_starttag(self, tag, attrs):
+        self._start(self.get_starttag_text(), tag, attrs, False)
+
+    def handle_startendtag(self, tag, attrs):
+        self._start(self.get_starttag_text(), tag, attrs, True)
+
+    def handle_endtag(self, tag):
+        blocks = self.block_stack.get(tag)
+        is_block = blocks.pop() if blocks else tag in BLOCK_TAGS
+        # Close back to the matching element, like a browser does with unclosed children
+        for i in range(len(self.preserve_stack) - 1, -1, -1):
+            if self.preserve_stack[i][0] == tag:
+                for _, preserves in self.preserve_stack[i:]:
+                    self.preserve -= preserves
+                del self.preserve_stack[i:]
+                break
+        self._tag(f"</{tag}>", is_block)
+
+    def handle_data(self, data):
+        if self.preserve:
+            self._tag(data, False)  # a "tag" token is emitted verbatim
+        elif self.cdata_elem == "style":
+            self._tag(_squeeze_css(data), True)
+        else:
+            self.text.append(data)
+
+    def _reference(self, prefix, name):
+        # The parser drops the ';' and also reports a bare "&" followed by letters ("AT&T")
+        # as a reference: re-emit it as written, with a ';' only if the source had one
+        line, column = self.getpos()
+        end = self.line_starts[line - 1] + column + len(prefix) + len(name)
+        return f"{prefix}{name}" + (";" if self.source.startswith(";", end) else "")
+
+    def handle_entityref(self, name):
+        self.handle_data(self._reference("&", name))
+
+    def handle_charref(self, name):
+        self.handle_data(self._reference("&#", name))
+
+    def handle_comment(self, data):
+        # Outlook conditional comments carry markup; every other comment goes
+        if data.lstrip().startswith("[if") or data.rstrip().endswith("[endif]"):
+            self._tag(f"<!--{data}-->", False)
+
+    def handle_decl(self, decl):
+        self._tag(f"<!{decl}>", True)
+
+    def handle_pi(self, data):
+        self._tag(f"<?{data}>", True)
+
+    def unknown_decl(self, data):
+        self._tag(f"<![{data}]>", False)
+
+    def result(self):
+        if re.fullmatch(r"&#?[a-zA-Z0-9]*", self.rawdata):
+            # A reference cut off by the end of the document ("... R&D"): close() would drop its "&"
+            self.handle_data(self.rawdata)
+            self.rawdata = ""
+        self.close()
+        self._flush()
+        out = []
+        tokens = self.tokens
+        for i, (kind, text, is_block) in enumerate(tokens):
+            if kind == "tag":
+                out.append(text)
+                continue
+            text = WHITESPACE_RE.sub(" ", text)
+            if text == " ":
+                before = tokens[i - 1][2] if i > 0 else True
+                after = tokens[i + 1][2] if i + 1 < len(tokens) else True
+                if before and after:
+                    continue
+            out.append(text)
+        return "".join(out)
+
+
+def minify_html(html):
+    """
+    Rendering-preserving minification: collapses whitespace runs in text to one space and
+    drops whitespace that sits only between block-level tags, removes comments (keeping
+    Outlook conditional comments), squeezes <style> blocks and de-duplicates inline style
+    declarations. <pre>, <textarea>, scripts and white-space:pre elements are left as is.
+    """
+    parser = _Minifier(html)
+    parser.feed(html)
+    return parser.result()
+
+
+class _TextExtractor(HTMLParser):
+    SKIP = {"head", "title", "style", "script", "template", "noscript"}
+    LINE = {"div", "tr", "li", "dt", "dd", "section", "header", "footer", "article", "center",
+            "form", "address", "figure", "figcaption", "caption", "nav", "aside", "main"}
+    PARAGRAPH = {"p", "h1", "h2", "h3", "h4", "h5", "h6", "table", "ul", "ol", "dl", "blockquote", "pre", "hr"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.chunks = []
+        self.breaks = 0         # line breaks owed before the next text
+        self.line_start = True
+        self.skip = 0
+        self.pre = 0
+        self.links = []         # [href, collected text] of open <a> elements
+
+    def _break(self, count):
+        self.breaks = max(self.breaks, count)
+
+    def _write(self, text):
+        if not self.pre:
+            if self.line_start or self.breaks:
+                text = text.lstrip(" ")
+            elif text.startswith(" ") and self.chunks and self.chunks[-1].endswith(" "):
+                text = text[1:]
+            if not text:
+                return
+        if self.breaks:
+            if self.chunks:
+                self.chunks.append("\n" * self.breaks)
+            self.breaks = 0
+        self.chunks.append(text)
+        self.line_start = text.endswith("\n")
+        for link in self.links:
+            link[1].append(text)
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self.skip += 1
+        elif tag == "br":
+            if self.chunks:
+                self.breaks = min(self.breaks + 1, 2)
+        elif tag in self.PARAGRAPH:
+            self._break(2)
+            if tag == "hr":
+                self._write("-" * 40)
+                self._break(2)
+            elif tag == "pre":
+                self.pre += 1
+        elif tag in self.LINE:
+            self._break(1)
+            if tag == "li" and not self.skip:
+                self._write("- ")
+        elif tag in ("td", "th"):
+            if self.chunks and not self.line_start and not self.breaks:
+                self._write(" ")
+        elif tag == "img" and not self.skip:
+            alt = (dict(attrs).get("alt") or "").strip()
+            if alt:
+                self._write(WHITESPACE_RE.sub(" ", alt))
+        elif tag == "a":
+            self.links.append([_raw_attribute(self.get_starttag_text(), "href").strip(), []])
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag in self.SKIP:
+            self.skip -= 1
+        elif tag == "a":
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP:
+            self.skip = max(0, self.skip - 1)
+        elif tag in self.PARAGRAPH:
+            if tag == "pre":
+                self.pre = max(0, self.pre - 1)
+            self._break(2)
+        elif tag in self.LINE:
+            self._break(1)
+        elif tag == "a" and self.links:
+            href, text = self.links.pop()
+            text = "".join(text).strip()
+            # Spell out real links; mailto and in-page anchors add nothing to the text
+            if href and not href.startswith(("#", "mailto:", "javascript:")) and href != text:
+                self._write(f" ({href})" if text else href)
+
+    def handle_data(self, data):
+        if self.skip:
+            return
+        if not self.pre:
+            data = WHITESPACE_RE.sub(" ", data)
+        self._write(data)
+
+    def result(self):
+        self.close()
+        text = "".join(self.chunks)
+        text = re.sub(r"[ \t]+\n", "\n", text)
+        return text.strip()
+
+
+def html_to_text(html):
+    """
+    Plain-text alternative for an HTML email: head, styles and scripts are skipped,
+    paragraphs and table rows become lines, list items get "- ", links are spelled out
+    as "text (url)", images contribute their alt text and entities are decoded.
+    """
+    parser = _TextExtractor()
+    parser.feed(html)
+    return parser.result()
+
+
+class OptimizedDraft:
+    """
+    The approved draft as it goes out: minified HTML plus its plain-text alternative,
+    computed once per campaign. The sizes compare against what was sent before, the raw
+    draft and a tag-stripped copy of it.
+    """
+
+    def __init__(self, html):
+        self.original = html
+        self.html = minify_html(html)
+        self.text = html_to_text(self.html)
+        self.bytes_before = len(html.encode("utf-8")) + len(TAG_RE.sub("", html).encode("utf-8"))
+        self.bytes_after = len(self.html.encode("utf-8")) + len(self.text.encode("utf-8"))
+
+    @property
+    def saved_ratio(self):
+        return 1 - self.bytes_after / self.bytes_before if self.bytes_before else 0.0
+
+    def summary(self):
+        return (f"Email body {self.bytes_before / 1024:.1f} KB -> {self.bytes_after / 1024:.1f} KB "
+                f"per recipient ({self.saved_ratio:.0%} smaller)")
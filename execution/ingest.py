@@ -0,0 +1,95 @@
+import re
+
+# Practical RFC 5322 subset (dot-atom local part, hostname labels, then an alphabetic or
+# punycode "xn--" TLD), applied to addresses that are already stripped and case-folded.
+# Every quantifier is possessive (Python 3.11+): no part can give characters back to the
+# next, so the regex never backtracks.
+EMAIL_PATTERN = (
+    r"[a-z0-9!#$%&'*+/=?^_`{|}~-]++(?:\.[a-z0-9!#$%&'*+/=?^_`{|}~-]++)*+"
+    r"@(?:[a-z0-9]++(?:-++[a-z0-9]++)*+\.)++(?:[a-z]{2,63}+|xn--[a-z0-9]++(?:-++[a-z0-9]++)*+)"
+)
+EMAIL_RE = re.compile(EMAIL_PATTERN)
+MAX_EMAIL_LENGTH = 254
+
+
+class SkipReport:
+    def __init__(self):
+        self.accepted = 0
+        self.blank = 0
+        self.invalid = 0
+        self.duplicate = 0
+
+    @property
+    def skipped(self):
+        return self.blank + self.invalid + self.duplicate
+
+    def summary(self):
+        text = f"{self.accepted} prospects, {self.skipped} rows skipped"
+        if self.skipped:
+            text += f" ({self.blank} without email, {self.invalid} invalid, {self.duplicate} duplicates)"
+        return text
+
+
+def normalize_email(value):
+    return value.strip().casefold()
+
+
+def is_valid_email(email):
+    return len(email) <= MAX_EMAIL_LENGTH and EMAIL_RE.fullmatch(email) is not None
+
+
+def find_email_column(header_map, selected_columns):
+    """Index of the email column: a selected column first, then any header mentioning 'email'."""
+    for col in selected_columns:
+        if "email" in col.lower():
+            index = header_map.get(col)
+            if index is not None:
+                return index
+
+    # Fallback: look for 'email' in any header if not explicitly selected (though it should be)
+    for h, i in header_map.items():
+        if "email" in h.lower():
+            return i
+    return -1
+
+
+class ProspectIngestor:
+    """
+    Turns pages of raw sheet rows into prospect dicts ({"email": ..., <column>: value}).
+
+    Addresses are trimmed, case-folded and checked with is_valid_email, and deduplicated
+    across pages too, so an address listed twice anywhere in the sheet is mailed once.
+    Blank, invalid and duplicate rows are counted in `report`; completely empty rows are
+    ignored, as before.
+    """
+
+    def __init__(self, header_map, email_col_index, selected_columns, report=None):
+        self.email_index = email_col_index
+        self.columns = [(name, header_map.get(name)) for name in selected_columns]
+        self.report = report if report is not None else SkipReport()
+        self.seen = set()
+
+    def ingest(self, rows):
+        report = self.report
+        prospects = []
+        for row in rows:
+            if not row:
+                continue
+            email = normalize_email(row[self.email_index]) if len(row) > self.email_index else ""
+            if not email:
+                report.blank += 1
+                continue
+            if email in self.seen:
+                report.duplicate += 1
+                continue
+            if not is_valid_email(email):
+                report.invalid += 1
+                continue
+            self.seen.add(email)
+            prospect = {"email": email}
+            for name, index in self.columns:
+                # The API drops trailing empty cells, so short rows just miss those columns
+                prospect[name] = row[index].strip() if index is not None and index < len(row) else ""
+            prospects.append(prospect)
+        report.accepted += len(prospects)
+        return prospects
@@ -0,0 +1,496 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter, deque
+
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+PAUSED = "paused"
+CANCELLED = "cancelled"
+DONE = "done"
+FAILED = "failed"
+ACTIVE = (QUEUED, RUNNING, PAUSED)
+INTERRUPTED = "Interrupted by a restart; it may have partially sent. Not restarted: without a send journal it would email the same people again."
+
+
+class CampaignFailed(Exception):
+    """Raised by a runner that stopped a campaign and already told the chat why; the message is its summary."""
+
+
+class Campaign:
+    """One approved campaign. `session` is the chat's Session.to_dict() snapshot at approval."""
+
+    __slots__ = (
+        "id",
+        "chat_id",
+        "status",
+        "personalize",
+        "session",
+        "created_at",
+        "started_at",
+        "finished_at",
+        "sent",
+        "failed",
+        "skipped",
+        "total",
+        "summary",
+    )
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+    @classmethod
+    def from_row(cls, row):
+        campaign = cls(**dict(zip(cls.__slots__, row)))
+        campaign.personalize = bool(campaign.personalize)
+        campaign.session = json.loads(campaign.session)
+        return campaign
+
+    @property
+    def sheet(self):
+        return self.session.get("selected_sheet") or "?"
+
+
+class JobStore:
+    """
+    Campaign queue in SQLite (JOBS_DB_PATH), so queued and interrupted campaigns survive a
+    restart. An empty path keeps the queue in memory.
+    """
+
+    def __init__(self, path=None):
+        path = config.JOBS_DB_PATH if path is None else path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        if path:
+            self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS campaigns ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " chat_id INTEGER NOT NULL,"
+            " status TEXT NOT NULL,"
+            " personalize INTEGER NOT NULL,"
+            " session TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " started_at REAL,"
+            " finished_at REAL,"
+            " sent INTEGER NOT NULL DEFAULT 0,"
+            " failed INTEGER NOT NULL DEFAULT 0,"
+            " skipped INTEGER NOT NULL DEFAULT 0,"
+            " total INTEGER,"
+            " summary TEXT)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS campaigns_by_status ON campaigns (status, id)")
+        self.db.commit()
+        self._lock = threading.Lock()
+
+    def add(self, chat_id, session, personalize=False):
+        with self._lock:
+            cursor = self.db.execute(
+                "INSERT INTO campaigns (chat_id, status, personalize, session, created_at) VALUES (?, ?, ?, ?, ?)",
+                (chat_id, QUEUED, int(personalize), json.dumps(session), time.time()),
+            )
+            self.db.commit()
+        return self.get(cursor.lastrowid)
+
+    def get(self, campaign_id):
+        with self._lock:
+            row = self.db.execute(
+                f"SELECT {', '.join(Campaign.__slots__)} FROM campaigns WHERE id = ?", (campaign_id,)
+            ).fetchone()
+        return Campaign.from_row(row) if row else None
+
+    def list(self, chat_id=None, statuses=None, limit=None):
+        """Campaigns in id order, optionally for one chat and/or with the given statuses."""
+        query = f"SELECT {', '.join(Campaign.__slots__)} FROM campaigns WHERE 1 = 1"
+        params = []
+        if chat_id is not None:
+            query += " AND chat_id = ?"
+            params.append(chat_id)
+        if statuses:
+            query += f" AND status IN ({', '.join('?' * len(statuses))})"
+            params.extend(statuses)
+        query += " ORDER BY id"
+        if limit:
+            # Most recent `limit`, still returned oldest first
+            query = f"SELECT * FROM ({query} DESC LIMIT {int(limit)}) ORDER BY id"
+        with self._lock:
+            rows = self.db.execute(query, params).fetchall()
+        return [Campaign.from_row(row) for row in rows]
+
+    def update(self, campaign_id, **fields):
+        if not fields:
+            return
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self.db.execute(f"UPDATE campaigns SET {assignments} WHERE id = ?", (*fields.values(), campaign_id))
+            self.db.commit()
+
+    def counts(self):
+        with self._lock:
+            rows = self.db.execute("SELECT status, COUNT(*) FROM campaigns GROUP BY status").fetchall()
+        return dict(rows)
+
+    def recover(self):
+        """Campaigns left running by a previous process go back to the queue. Returns how many."""
+        with self._lock:
+            cursor = self.db.execute("UPDATE campaigns SET status = ? WHERE status = ?", (QUEUED, RUNNING))
+            self.db.commit()
+        return cursor.rowcount
+
+    def interrupt(self, summary):
+        """
+        Fails the campaigns a previous process had started and not finished (running, paused, or
+        resumed into the queue) with `summary`, for when nothing records who they already reached.
+        Returns them.
+        """
+        where = "status IN (?, ?) OR (status = ? AND started_at IS NOT NULL)"
+        params = (RUNNING, PAUSED, QUEUED)
+        with self._lock:
+            rows = self.db.execute(f"SELECT {', '.join(Campaign.__slots__)} FROM campaigns WHERE {where} ORDER BY id",
+                                   params).fetchall()
+            self.db.execute(f"UPDATE campaigns SET status = ?, finished_at = ?, summary = ? WHERE {where}",
+                            (FAILED, time.time(), summary, *params))
+            self.db.commit()
+        campaigns = [Campaign.from_row(row) for row in rows]
+        for campaign in campaigns:
+            campaign.status, campaign.summary = FAILED, summary
+        return campaigns
+
+    def close(self):
+        self.db.close()
+
+
+class CampaignProgress:
+    """Live counters of a running campaign. The rate is measured over the last `window` seconds."""
+
+    def __init__(self, total=None, window=30.0):
+        self.sent = 0
+        self.failed = 0
+        self.skipped = 0
+        self.total = total  # upper bound: data rows in the sheet
+        self.window = window
+        self.samples = deque([(time.monotonic(), 0)])
+
+    @property
+    def processed(self):
+        return self.sent + self.failed + self.skipped
+
+    @property
+    def remaining(self):
+        if self.total is None:
+            return None
+        return max(0, self.total - self.processed)
+
+    def record(self, success):
+        if success:
+            self.sent += 1
+        else:
+            self.failed += 1
+        self._sample()
+
+    def update(self, sent, failed):
+        """Takes the counters from an outside tally, e.g. the summed shards of a sharded send."""
+        self.sent, self.failed = sent, failed
+        self._sample()
+
+    def _sample(self):
+        now = time.monotonic()
+        self.samples.append((now, self.sent + self.failed))
+        while len(self.samples) > 2 and now - self.samples[1][0] > self.window:
+            self.samples.popleft()
+
+    def rate(self):
+        """Send attempts per second over the recent window."""
+        (first_time, first_count), (last_time, last_count) = self.samples[0], self.samples[-1]
+        # Include the idle time since the last send, so a stalled campaign shows a falling rate
+        elapsed = max(last_time, time.monotonic()) - first_time
+        return (last_count - first_count) / elapsed if elapsed > 0 else 0.0
+
+    def eta(self):
+        rate, remaining = self.rate(), self.remaining
+        if remaining is None or rate <= 0:
+            return None
+        return remaining / rate
+
+    def summary(self, eta=True):
+        text = f"{self.sent:,} sent, {self.failed:,} failed, {self.skipped:,} skipped"
+        if self.remaining is not None:
+            text += f", ~{self.remaining:,} remaining"
+        text += f"\n  {self.rate():.1f} emails/s"
+        seconds = self.eta() if eta else None
+        if seconds is not None:
+            text += f", ETA {format_duration(seconds)}"
+        return text
+
+
+class JobControl:
+    """Handed to the running campaign: the send loop calls `checkpoint()` before each recipient."""
+
+    def __init__(self, campaign, progress=None):
+        self.campaign = campaign
+        self.progress = progress or CampaignProgress()
+        self._running = asyncio.Event()
+        self._running.set()
+        self.cancelled = False
+
+    @property
+    def paused(self):
+        return not self._running.is_set()
+
+    def pause(self):
+        self._running.clear()
+
+    def resume(self):
+        self._running.set()
+
+    def cancel(self):
+        self.cancelled = True
+        self._running.set()
+
+    async def checkpoint(self):
+        """Waits while paused. Returns False once the campaign is cancelled."""
+        if not self._running.is_set():
+            await self._running.wait()
+        return not self.cancelled
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return f"{minutes}m {seconds:02d}s"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes:02d}m"
+
+
+class CampaignScheduler:
+    """
+    Runs approved campaigns in the background, at most `workers` at a time, so the Telegram
+    handler that approved one returns right away. When a slot frees up, the next campaign
+    comes from the operator (chat) with the fewest campaigns running, then the one served
+    longest ago, so one operator queueing several large sheets can't starve the others.
+
+    `runner(campaign, control, bot)` does the actual sending and returns a summary text. A
+    paused campaign keeps its task but gives up its slot; resuming it can briefly run one
+    campaign over `workers`. Status and counters are kept in the JobStore, and campaigns
+    interrupted by a restart are queued again (the send journal skips who already got it).
+    With `resume_interrupted` off (no send journal), they are failed instead: running them
+    again would email everyone they already reached.
+    """
+
+    def __init__(self, runner, store=None, workers=None, progress_seconds=None, resume_interrupted=None):
+        self.runner = runner
+        self.store = store or JobStore()
+        self.resume_interrupted = bool(config.JOURNAL_PATH) if resume_interrupted is None else resume_interrupted
+        self.workers = max(1, workers or config.CAMPAIGN_WORKERS)
+        self.progress_seconds = config.JOB_PROGRESS_SECONDS if progress_seconds is None else progress_seconds
+        self.bot = None
+        self.controls = {}  # campaign id -> JobControl, for campaigns that have a task
+        self.tasks = set()
+        self.last_served = {}
+
+    def start(self, bot):
+        """
+        Attaches the Telegram bot used for campaign messages and starts queued campaigns.
+        Returns the campaigns failed because a restart interrupted them (see `resume_interrupted`).
+        """
+        interrupted = []
+        if self.bot is None:
+            if self.resume_interrupted:
+                recovered = self.store.recover()
+                if recovered:
+                    logger.info("Re-queued %d campaigns interrupted by a restart", recovered)
+            else:
+                interrupted = self.store.interrupt(INTERRUPTED)
+                for campaign in interrupted:
+                    logger.warning("Campaign #%s was interrupted by a restart after %s sent; not re-queued",
+                                   campaign.id, campaign.sent or 0)
+                    metrics.inc("campaigns_finished_total", status=FAILED)
+        self.bot = bot
+        self._dispatch()
+        return interrupted
+
+    def submit(self, chat_id, session, personalize=False):
+        campaign = self.store.add(chat_id, session, personalize)
+        metrics.inc("campaigns_submitted_total")
+        self._dispatch()
+        return self.store.get(campaign.id)
+
+    def _active(self):
+        return sum(1 for control in self.controls.values() if not control.paused)
+
+    def _pick(self):
+        queued = self.store.list(statuses=(QUEUED,))
+        if not queued:
+            return None
+        running = Counter(c.campaign.chat_id for c in self.controls.values() if not c.paused)
+        return min(queued, key=lambda c: (running[c.chat_id], self.last_served.get(c.chat_id, 0.0), c.id))
+
+    def _dispatch(self):
+        if self.bot is None:
+            return
+        while self._active() < self.workers:
+            campaign = self._pick()
+            if campaign is None:
+                return
+            self._launch(campaign)
+
+    def _launch(self, campaign):
+        campaign.status = RUNNING
+        campaign.started_at = campaign.started_at or time.time()
+        self.store.update(campaign.id, status=RUNNING, started_at=campaign.started_at)
+        self.last_served[campaign.chat_id] = time.monotonic()
+        control = JobControl(campaign)
+        self.controls[campaign.id] = control
+        task = asyncio.create_task(self._run(control))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _run(self, control):
+        campaign = control.campaign
+        saver = asyncio.create_task(self._save_periodically(control))
+        status, summary = DONE, None
+        try:
+            summary = await self.runner(campaign, control, self.bot)
+            if control.cancelled:
+                status = CANCELLED
+        except asyncio.CancelledError:
+            # Shutdown: leave it "running" so the next start re-queues it
+            status = None
+            raise
+        except CampaignFailed as e:
+            logger.warning("Campaign #%s failed: %s", campaign.id, e)
+            status, summary = FAILED, str(e)
+        except Exception as e:
+            logger.exception("Campaign #%s failed", campaign.id)
+            status, summary = FAILED, f"{type(e).__name__}: {e}"
+        finally:
+            saver.cancel()
+            self.controls.pop(campaign.id, None)
+            if status is not None:
+                self._save(control, status=status, finished_at=time.time(), summary=summary)
+                metrics.inc("campaigns_finished_total", status=status)
+                self._dispatch()
+
+    def _save(self, control, **fields):
+        progress = control.progress
+        self.store.update(control.campaign.id, sent=progress.sent, failed=progress.failed,
+                          skipped=progress.skipped, total=progress.total, **fields)
+
+    async def _save_periodically(self, control):
+        if self.progress_seconds <= 0:
+            return
+        while True:
+            await asyncio.sleep(self.progress_seconds)
+            try:
+                await asyncio.to_thread(self._save, control)
+            except sqlite3.Error as e:
+                print(f"Error saving campaign progress: {e}")
+
+    def _find(self, chat_id, campaign_id, statuses):
+        """The chat's campaign `campaign_id`, or its most recent one in `statuses` if no id is given."""
+        if campaign_id is not None:
+            campaign = self.store.get(campaign_id)
+            if campaign is None or campaign.chat_id != chat_id:
+                return None
+            return campaign
+        campaigns = self.store.list(chat_id=chat_id, statuses=statuses)
+        return campaigns[-1] if campaigns else None
+
+    def pause(self, chat_id, campaign_id=None):
+        campaign = self._find(chat_id, campaign_id, (RUNNING, QUEUED))
+        if campaign is None or campaign.status not in (RUNNING, QUEUED):
+            return None
+        control = self.controls.get(campaign.id)
+        if control:
+            control.pause()
+        self.store.update(campaign.id, status=PAUSED)
+        campaign.status = PAUSED
+        self._dispatch()
+        return campaign
+
+    def resume(self, chat_id, campaign_id=None, retry_failed=False):
+        """Resumes a paused campaign; with `retry_failed`, also queues a failed one to run again."""
+        statuses = (PAUSED, FAILED) if retry_failed else (PAUSED,)
+        campaign = self._find(chat_id, campaign_id, statuses)
+        if campaign is None or campaign.status not in statuses:
+            return None
+        control = self.controls.get(campaign.id)
+        if control:
+            control.resume()
+            campaign.status = RUNNING
+            self.store.update(campaign.id, status=RUNNING)
+        else:
+            campaign.status = QUEUED
+            self.store.update(campaign.id, status=QUEUED, finished_at=None, summary=None)
+        self._dispatch()
+        return campaign
+
+    def cancel(self, chat_id, campaign_id=None):
+        campaign = self._find(chat_id, campaign_id, ACTIVE)
+        if campaign is None or campaign.status not in ACTIVE:
+            return None
+        control = self.controls.get(campaign.id)
+        if control:
+            # In-flight sends finish, then the runner returns and _run records the final counts
+            control.cancel()
+            self.store.update(campaign.id, status=CANCELLED)
+        else:
+            self.store.update(campaign.id, status=CANCELLED, finished_at=time.time())
+            metrics.inc("campaigns_finished_total", status=CANCELLED)
+        campaign.status = CANCELLED
+        return campaign
+
+    def queue_position(self, campaign):
+        """1-based position among queued campaigns (by age; the fair pick may reorder slightly)."""
+        queued = self.store.list(statuses=(QUEUED,))
+        return next((i for i, c in enumerate(queued, 1) if c.id == campaign.id), None)
+
+    def describe(self, campaign):
+        text = f"#{campaign.id} '{campaign.sheet}'{' (personalized)' if campaign.personalize else ''}: {campaign.status}"
+        control = self.controls.get(campaign.id)
+        if control:
+            text += "\n  " + control.progress.summary(eta=not control.paused)
+            if campaign.started_at:
+                text += f", running for {format_duration(time.time() - campaign.started_at)}"
+        elif campaign.status == QUEUED:
+            text += f" (position {self.queue_position(campaign)})"
+        elif campaign.status in (DONE, FAILED, CANCELLED):
+            text += f"\n  {campaign.sent:,} sent, {campaign.failed:,} failed, {campaign.skipped:,} skipped"
+            if campaign.status == FAILED and campaign.summary:
+                text += f"\n  {campaign.summary}"
+        return text
+
+    def status_text(self, chat_id, recent=3):
+        campaigns = self.store.list(chat_id=chat_id, limit=20)
+        active = [c for c in campaigns if c.status in ACTIVE]
+        finished = [c for c in campaigns if c.status not in ACTIVE][-recent:]
+        if not active and not finished:
+            return "No campaigns yet. Approve a draft to start one."
+        lines = []
+        if active:
+            lines.append("Active campaigns:")
+            lines.extend(self.describe(c) for c in active)
+        if finished:
+            lines.append("Recently finished:")
+            lines.extend(self.describe(c) for c in finished)
+        return "\n".join(lines)
+
+    async def join(self):
+        """Waits until no campaign is running or waiting for a slot (used by benchmarks)."""
+        while self.tasks:
+            await asyncio.gather(*list(self.tasks), return_exceptions=True)
@@ -0,0 +1,132 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import config
+
+
+def campaign_id(*parts):
+    """Stable id for a campaign: same sheet, subject and draft give the same id after a restart."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b"\0")
+    return digest.hexdigest()[:16]
+
+
+class SendJournal:
+    """
+    Local record of every send attempt, keyed by (campaign, recipient), so a restarted run
+    can skip people who already got the email. `record` only appends to an in-memory buffer;
+    a background thread writes the buffer in one transaction every `flush_seconds` or once
+    `batch_size` rows are waiting. A crash can lose at most that last unflushed window.
+    """
+
+    def __init__(self, path=None, batch_size=None, flush_seconds=None):
+        self.path = path or config.JOURNAL_PATH
+        self.batch_size = batch_size or config.JOURNAL_BATCH_SIZE
+        self.flush_seconds = flush_seconds or config.JOURNAL_FLUSH_SECONDS
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS deliveries ("
+            " campaign_id TEXT NOT NULL,"
+            " recipient TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " message_id TEXT,"
+            " error TEXT,"
+            " updated_at REAL NOT NULL,"
+            " PRIMARY KEY (campaign_id, recipient)) WITHOUT ROWID"
+        )
+        self.db.commit()
+
+        self._db_lock = threading.Lock()
+        self._buffer = []
+        self._buffer_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._writer = threading.Thread(target=self._run, name="send-journal", daemon=True)
+        self._writer.start()
+
+    def delivered(self, campaign):
+        """Recipients (lower-cased) already sent successfully in this campaign."""
+        self.flush()
+        with self._db_lock:
+            rows = self.db.execute(
+                "SELECT recipient FROM deliveries WHERE campaign_id = ? AND status = 'sent'", (campaign,)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def record(self, campaign, recipient, success, detail=None):
+        """`detail` is the Gmail message id on success and the error text on failure."""
+        row = (
+            campaign,
+            recipient.lower(),
+            "sent" if success else "failed",
+            detail if success else None,
+            None if success else detail,
+            time.time(),
+        )
+        with self._buffer_lock:
+            self._buffer.append(row)
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        with self._buffer_lock:
+            rows, self._buffer = self._buffer, []
+        if not rows:
+            return
+        with self._db_lock:
+            try:
+                self._write(rows)
+            except sqlite3.Error:
+                # Keep the rows for the next attempt rather than losing them
+                with self._buffer_lock:
+                    self._buffer[:0] = rows
+                raise
+
+    def _write(self, rows):
+        # A success is never downgraded by a later failed retry of the same recipient
+        self.db.executemany(
+            "INSERT INTO deliveries (campaign_id, recipient, status, message_id, error, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (campaign_id, recipient) DO UPDATE SET"
+            " status = excluded.status, message_id = excluded.message_id,"
+            " error = excluded.error, updated_at = excluded.updated_at"
+            " WHERE deliveries.status != 'sent'",
+            rows,
+        )
+        self.db.commit()
+
+    def counts(self, campaign):
+        self.flush()
+        with self._db_lock:
+            rows = self.db.execute(
+                "SELECT status, COUNT(*) FROM deliveries WHERE campaign_id = ? GROUP BY status", (campaign,)
+            ).fetchall()
+        return dict(rows)
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        self._writer.join()
+        self.flush()
+        self.db.close()
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"Error writing send journal: {e}")
@@ -0,0 +1,396 @@
+import asyncio
+import bisect
+import contextlib
+import contextvars
+import functools
+import inspect
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import config
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "aiden_"
+# Seconds; wide enough for a 5ms cache hit and a 2 minute model call
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Name of the operation currently running in this task/thread, for nested traces in slow logs
+_current = contextvars.ContextVar("metrics_operation", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th observation (capped at the observed max)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+def _status(error):
+    # A consumer that stops iterating early is not a failure; a cancelled task is its own outcome
+    if isinstance(error, GeneratorExit):
+        return "ok"
+    if isinstance(error, asyncio.CancelledError):
+        return "cancelled"
+    return "error"
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class Registry:
+    """
+    Process-wide counters and latency histograms. Everything is keyed by (name, labels) and
+    guarded by one lock; updates are a dict lookup and an add, so they are cheap enough to
+    sit on every API call. Callbacks registered with `register` are read only when exporting,
+    for numbers other objects already keep (cache hits, queue sizes...).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.callbacks = {}
+        self.help = {}
+        self.started = time.time()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def register(self, name, fn, kind="gauge", help=""):
+        """`fn()` returns a number, or a dict of {label value: number} exported with label `key`."""
+        self.callbacks[name] = (fn, kind)
+        if help:
+            self.help[name] = help
+
+    def describe(self, name, help):
+        self.help[name] = help
+
+    def reset(self):
+        """Drops recorded values (callbacks and help text stay), e.g. between benchmark runs."""
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+        self.started = time.time()
+
+    @contextlib.contextmanager
+    def timer(self, operation):
+        """Times the block into operation_seconds / operation_calls_total, labelled `operation`."""
+        parent = _current.get()
+        token = _current.set(operation)
+        started = time.perf_counter()
+        status = "ok"
+        try:
+            yield
+        except BaseException as e:
+            status = _status(e)
+            raise
+        finally:
+            _current.reset(token)
+            self._finish(operation, parent, status, time.perf_counter() - started)
+
+    def _finish(self, operation, parent, status, seconds):
+        self.observe("operation_seconds", seconds, operation=operation)
+        self.inc("operation_calls_total", operation=operation, status=status)
+        if config.METRICS_SLOW_SECONDS and seconds >= config.METRICS_SLOW_SECONDS:
+            path = f"{parent} > {operation}" if parent else operation
+            logger.warning("Slow operation %s: %.2fs (%s)", path, seconds, status)
+
+    def timed(self, operation):
+        """
+        Decorator version of `timer` for plain functions, coroutines and (async) generators.
+        Generators are charged only for the time spent producing items, not for the time the
+        consumer holds each one, so a paged reader doesn't absorb the sends it feeds.
+        """
+        def decorate(fn):
+            if inspect.isasyncgenfunction(fn):
+                @functools.wraps(fn)
+                async def wrapper(*args, **kwargs):
+                    parent = _current.get()
+                    spent = 0.0
+                    status = "ok"
+                    generator = fn(*args, **kwargs)
+                    try:
+                        while True:
+                            token = _current.set(operation)
+                            started = time.perf_counter()
+                            try:
+                                item = await generator.__anext__()
+                            except StopAsyncIteration:
+                                break
+                            finally:
+                                spent += time.perf_counter() - started
+                                _current.reset(token)
+                            yield item
+                    except BaseException as e:
+                        status = _status(e)
+                        raise
+                    finally:
+                        await generator.aclose()
+                        self._finish(operation, parent, status, spent)
+                return wrapper
+
+            if inspect.isgeneratorfunction(fn):
+                @functools.wraps(fn)
+                def wrapper(*args, **kwargs):
+                    parent = _current.get()
+                    spent = 0.0
+                    status = "ok"
+                    generator = fn(*args, **kwargs)
+                    try:
+                        while True:
+                            token = _current.set(operation)
+                            started = time.perf_counter()
+                            try:
+                                item = next(generator)
+                            except StopIteration:
+                                break
+                            finally:
+                                spent += time.perf_counter() - started
+                                _current.reset(token)
+                            yield item
+                    except BaseException as e:
+                        status = _status(e)
+                        raise
+                    finally:
+                        generator.close()
+                        self._finish(operation, parent, status, spent)
+                return wrapper
+
+            if inspect.iscoroutinefunction(fn):
+                @functools.wraps(fn)
+                async def wrapper(*args, **kwargs):
+                    with self.timer(operation):
+                        return await fn(*args, **kwargs)
+                return wrapper
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.timer(operation):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def instrument(self, prefix):
+        """Class decorator: times every public method as "<prefix>.<method>"."""
+        def decorate(cls):
+            for name, attr in list(vars(cls).items()):
+                if name.startswith("_") or not inspect.isfunction(attr):
+                    continue
+                setattr(cls, name, self.timed(f"{prefix}.{name}")(attr))
+            return cls
+        return decorate
+
+    def operations(self):
+        """[(operation, calls, errors, histogram)] sorted by total time spent, slowest first."""
+        with self._lock:
+            calls = {}
+            for (name, labels), value in self.counters.items():
+                if name == "operation_calls_total":
+                    labels = dict(labels)
+                    ok, errors = calls.get(labels["operation"], (0, 0))
+                    if labels["status"] == "error":
+                        errors += value
+                    else:
+                        ok += value
+                    calls[labels["operation"]] = (ok, errors)
+            rows = []
+            for (name, labels), histogram in self.histograms.items():
+                if name == "operation_seconds":
+                    operation = dict(labels)["operation"]
+                    ok, errors = calls.get(operation, (0, 0))
+                    rows.append((operation, ok + errors, errors, histogram))
+        rows.sort(key=lambda row: row[3].sum, reverse=True)
+        return rows
+
+    def counter_values(self):
+        with self._lock:
+            return {key: value for key, value in self.counters.items() if key[0] != "operation_calls_total"}
+
+    def summary(self, limit=15):
+        """Short text table for /debug."""
+        lines = []
+        rows = self.operations()
+        if rows:
+            lines.append("operation: calls (errors) avg / p95 / max")
+            for operation, calls, errors, h in rows[:limit]:
+                avg = h.sum / h.count if h.count else 0.0
+                lines.append(
+                    f"{operation}: {calls:.0f}" + (f" ({errors:.0f})" if errors else "")
+                    + f" {avg * 1000:.0f} / {h.quantile(0.95) * 1000:.0f} / {h.max * 1000:.0f} ms"
+                )
+            if len(rows) > limit:
+                lines.append(f"... {len(rows) - limit} more")
+        for (name, labels), value in sorted(self.counter_values().items()):
+            lines.append(f"{name}{_format_labels(labels)}: {value:g}")
+        return "\n".join(lines) or "No metrics recorded yet."
+
+    def render_prometheus(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        out = []
+
+        def header(name, kind):
+            full = PREFIX + name
+            if name in self.help:
+                out.append(f"# HELP {full} {self.help[name]}")
+            out.append(f"# TYPE {full} {kind}")
+            return full
+
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+            histograms = [(key, (list(h.counts), h.count, h.sum, h.buckets)) for key, h in histograms]
+
+        seen = set()
+        for (name, labels), value in counters:
+            if name not in seen:
+                seen.add(name)
+                header(name, "counter")
+            out.append(f"{PREFIX}{name}{_format_labels(labels)} {value:g}")
+
+        seen = set()
+        for (name, labels), (counts, count, total, buckets) in histograms:
+            full = PREFIX + name
+            if name not in seen:
+                seen.add(name)
+                header(name, "histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                out.append(f"{full}_bucket{_format_labels(labels, [('le', f'{bound:g}')])} {cumulative}")
+            out.append(f"{full}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}")
+            out.append(f"{full}_sum{_format_labels(labels)} {total:.6f}")
+            out.append(f"{full}_count{_format_labels(labels)} {count}")
+
+        for name, (fn, kind) in sorted(self.callbacks.items()):
+            try:
+                value = fn()
+            except Exception as e:
+                logger.debug("Metrics callback %s failed: %s", name, e)
+                continue
+            full = header(name, kind)
+            if isinstance(value, dict):
+                for label, number in sorted(value.items()):
+                    out.append(f"{full}{_format_labels([('key', label)])} {number:g}")
+            else:
+                out.append(f"{full} {value:g}")
+
+        header("uptime_seconds", "gauge")
+        out.append(f"{PREFIX}uptime_seconds {time.time() - self.started:.0f}")
+        return "\n".join(out) + "\n"
+
+    def write_file(self, path):
+        # Written to a temp file and renamed, so a scraper never reads half a file
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render_prometheus())
+        os.replace(tmp_path, path)
+
+
+REGISTRY = Registry()
+REGISTRY.describe("operation_seconds", "Time spent in instrumented bot, Google and OpenAI operations")
+REGISTRY.describe("operation_calls_total", "Instrumented operation calls by outcome (ok, error = raised, cancelled)")
+
+# Module-level shortcuts on the default registry
+inc = REGISTRY.inc
+observe = REGISTRY.observe
+register = REGISTRY.register
+timer = REGISTRY.timer
+timed = REGISTRY.timed
+instrument = REGISTRY.instrument
+summary = REGISTRY.summary
+render_prometheus = REGISTRY.render_prometheus
+
+
+def start_http_server(port, registry=REGISTRY):
+    """Serves GET /metrics on a daemon thread. Returns the server (call .shutdown() to stop)."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = registry.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info("Serving Prometheus metrics on :%d/metrics", server.server_address[1])
+    return server
+
+
+def start_file_writer(path, interval=None, registry=REGISTRY):
+    """Rewrites `path` every `interval` seconds (e.g. for node_exporter's textfile collector)."""
+    interval = interval or config.METRICS_FILE_SECONDS
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    def run():
+        while True:
+            try:
+                registry.write_file(path)
+            except OSError as e:
+                print(f"Error writing metrics file: {e}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name="metrics-file", daemon=True)
+    thread.start()
+    return thread
+
+
+def start_exporters():
+    """Starts whatever METRICS_PORT / METRICS_FILE ask for."""
+    if config.METRICS_PORT:
+        start_http_server(config.METRICS_PORT)
+    if config.METRICS_FILE:
+        start_file_writer(config.METRICS_FILE)
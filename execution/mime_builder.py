@@ -0,0 +1,95 @@
+import base64
+import binascii
+import uuid
+from email.header import Header
+
+from html_optimizer import html_to_text
+from template import CompiledTemplate
+
+
+def _qp(text):
+    return binascii.b2a_qp(text.encode('utf-8'))
+
+
+def _header(name, value):
+    # Drop CR/LF so a sheet cell can't inject extra headers
+    value = value.replace('\r', ' ').replace('\n', ' ')
+    try:
+        value.encode('ascii')
+        charset = 'us-ascii'
+    except UnicodeEncodeError:
+        charset = 'utf-8'
+    return f"{name}: {Header(value, charset, header_name=name).encode()}\n".encode('ascii')
+
+
+class MessageBuilder:
+    """
+    Builds multipart/alternative messages for one campaign. The subject header, boundary,
+    part headers and the quoted-printable encoding of every literal segment of the HTML and
+    text bodies are prepared once. Per recipient only the To header and the placeholder
+    values are encoded, and the message is a single bytes join.
+
+    Quoted-printable decodes each segment independently, so encoded segments are joined
+    with soft line breaks ("=\\n"), which keeps lines short and decode to nothing.
+    """
+
+    def __init__(self, subject, html, names=(), text=None):
+        if not isinstance(html, CompiledTemplate):
+            html = CompiledTemplate(html, names)
+        # The text part fills the same placeholders as the HTML part
+        names = names or html.names
+        if text is None:
+            text = html_to_text(html.text)
+        if not isinstance(text, CompiledTemplate):
+            text = CompiledTemplate(text, names)
+
+        boundary = "===============" + uuid.uuid4().hex + "=="
+        self.head = (
+            b"MIME-Version: 1.0\n"
+            + f'Content-Type: multipart/alternative; boundary="{boundary}"\n'.encode('ascii')
+            + _header("Subject", subject)
+        )
+        self.text_open = (
+            f"\n--{boundary}\n"
+            'Content-Type: text/plain; charset="utf-8"\n'
+            "Content-Transfer-Encoding: quoted-printable\n\n"
+        ).encode('ascii')
+        self.html_open = (
+            f"\n--{boundary}\n"
+            'Content-Type: text/html; charset="utf-8"\n'
+            "Content-Transfer-Encoding: quoted-printable\n\n"
+        ).encode('ascii')
+        self.close = f"\n--{boundary}--\n".encode('ascii')
+        self.text_parts, self.text_slots = self._encode(text)
+        self.html_parts, self.html_slots = self._encode(html)
+
+    @staticmethod
+    def _encode(template):
+        parts = [_qp(part) for part in template.parts]
+        slots = [(index, key) for index, key, _ in template.slots]
+        return parts, slots
+
+    @staticmethod
+    def _render(parts, slots, values):
+        if slots and values:
+            parts = parts.copy()
+            for index, key in slots:
+                if key in values:
+                    parts[index] = _qp(values[key])
+        return b"=\n".join(parts)
+
+    def build(self, to, values=None):
+        """Raw RFC 822 bytes for one recipient. `values` fills the [Column] placeholders."""
+        return b"".join((
+            self.head,
+            _header("To", to),
+            self.text_open,
+            self._render(self.text_parts, self.text_slots, values),
+            self.html_open,
+            self._render(self.html_parts, self.html_slots, values),
+            self.close,
+        ))
+
+    def build_raw(self, to, values=None):
+        """base64url form expected by the Gmail API `raw` field."""
+        return base64.urlsafe_b64encode(self.build(to, values)).decode('ascii')
@@ -0,0 +1,226 @@
+import asyncio
+import logging
+import time
+from collections import Counter, deque
+
+from telegram.error import RetryAfter, TelegramError
+
+import config
+import metrics
+from sender import error_kind
+
+logger = logging.getLogger(__name__)
+
+
+class FailureWindow:
+    """Failed recipients collected for one chat and label until the window is flushed."""
+
+    __slots__ = ("count", "errors", "examples", "handle")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = Counter()
+        self.examples = {}  # error kind -> first recipient that hit it
+        self.handle = None
+
+    def add(self, email, error):
+        kind = error_kind(error)
+        self.count += 1
+        self.errors[kind] += 1
+        self.examples.setdefault(kind, email)
+
+    def text(self, label, top=3):
+        if self.count == 1:
+            (kind, email), = self.examples.items()
+            return f"{label}: Failed to send to {email}: {kind}"
+        lines = [f"{label}: {self.count:,} failures, top errors:"]
+        for kind, count in self.errors.most_common(top):
+            lines.append(f"  {count:,} x {kind} (e.g. {self.examples[kind]})")
+        if len(self.errors) > top:
+            others = len(self.errors) - top
+            lines.append(f"  ... and {others} other error{'s' if others > 1 else ''}")
+        return "\n".join(lines)
+
+
+class ChatOutbox:
+    """Everything waiting to go out to one chat, in order, plus its coalescing state."""
+
+    __slots__ = ("queue", "failures", "progress", "progress_messages", "progress_sent", "next_at", "task")
+
+    def __init__(self):
+        self.queue = deque()  # ("text", text), ("progress", key) or ("mark", (label, future)) from drain()
+        self.failures = {}  # label -> FailureWindow
+        self.progress = {}  # key -> latest progress text not sent yet
+        self.progress_messages = {}  # key -> Telegram message edited in place
+        self.progress_sent = {}  # key -> text currently shown
+        self.next_at = 0.0
+        self.task = None
+
+
+class Notifier:
+    """
+    Outbound Telegram messages for campaigns. Nothing here is awaited by the send loop:
+    `post`, `failure` and `progress` only queue, and one task per chat delivers the queue
+    at most one message every `chat_interval` seconds (Telegram allows about one per
+    second per chat and 30 per second overall), waiting out flood-control errors.
+
+    Failures are coalesced per chat and label over `window` seconds into one summary
+    ("37 failures, top errors: ..."), and progress updates for the same key edit one
+    message in place, skipping frames that would not change it.
+    """
+
+    def __init__(self, bot=None, window=None, chat_interval=None, global_rate=None):
+        self.bot = bot
+        self.window = config.NOTIFY_WINDOW_SECONDS if window is None else window
+        self.chat_interval = config.NOTIFY_CHAT_INTERVAL if chat_interval is None else chat_interval
+        self.global_rate = config.NOTIFY_GLOBAL_RATE if global_rate is None else global_rate
+        self.chats = {}
+        self.next_global = 0.0
+
+    def start(self, bot):
+        self.bot = bot
+
+    def _outbox(self, chat_id):
+        outbox = self.chats.get(chat_id)
+        if outbox is None:
+            outbox = self.chats[chat_id] = ChatOutbox()
+        return outbox
+
+    def _wake(self, chat_id, outbox):
+        if outbox.task is None or outbox.task.done():
+            outbox.task = asyncio.create_task(self._deliver(chat_id, outbox))
+
+    def post(self, chat_id, text):
+        outbox = self._outbox(chat_id)
+        outbox.queue.append(("text", text))
+        self._wake(chat_id, outbox)
+
+    def failure(self, chat_id, email, error, label="Campaign"):
+        outbox = self._outbox(chat_id)
+        window = outbox.failures.get(label)
+        if window is None:
+            window = outbox.failures[label] = FailureWindow()
+            window.handle = asyncio.get_running_loop().call_later(self.window, self._flush_failures, chat_id, label)
+        window.add(email, error)
+        metrics.inc("telegram_failures_coalesced_total")
+
+    def _flush_failures(self, chat_id, label):
+        outbox = self.chats[chat_id]
+        window = outbox.failures.pop(label, None)
+        if window is None:
+            return
+        window.handle.cancel()
+        outbox.queue.append(("text", window.text(label)))
+        self._wake(chat_id, outbox)
+
+    def progress(self, chat_id, key, text, edit_only=False):
+        """
+        Shows `text` in the chat's progress message for `key`, editing it in place. With
+        `edit_only`, nothing is posted if there is no progress message yet.
+        """
+        outbox = self._outbox(chat_id)
+        if edit_only and key not in outbox.progress_messages and key not in outbox.progress:
+            return
+        if key not in outbox.progress:
+            outbox.queue.append(("progress", key))
+        outbox.progress[key] = text
+        self._wake(chat_id, outbox)
+
+    def end_progress(self, chat_id, key):
+        """Forgets the progress message for `key`, so the next progress() posts a new one."""
+        outbox = self._outbox(chat_id)
+        outbox.progress_messages.pop(key, None)
+        outbox.progress_sent.pop(key, None)
+
+    def flush(self, chat_id, label=None):
+        """Queues the chat's pending failure summaries for `label` (or all) now instead of at the end of their window."""
+        outbox = self.chats.get(chat_id)
+        for name in list(outbox.failures) if outbox else ():
+            if label is None or name == label:
+                self._flush_failures(chat_id, name)
+
+    async def drain(self, chat_id, label=None):
+        """
+        Flushes the chat's failure summaries for `label` (or all labels) and waits until
+        everything queued for the chat so far is sent, including the latest progress text
+        for `label`. Messages queued afterwards, e.g. by another campaign in the same chat
+        that keeps failing, don't hold it up.
+        """
+        self.flush(chat_id, label)
+        outbox = self.chats.get(chat_id)
+        if outbox is None:
+            return
+        done = asyncio.get_running_loop().create_future()
+        outbox.queue.append(("mark", (label, done)))
+        self._wake(chat_id, outbox)
+        await done
+
+    async def _pace(self, outbox):
+        # Reserve the next slot for this chat and globally, then wait for it
+        now = time.monotonic()
+        slot = max(now, outbox.next_at, self.next_global)
+        outbox.next_at = slot + self.chat_interval
+        if self.global_rate > 0:
+            self.next_global = slot + 1 / self.global_rate
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def _deliver(self, chat_id, outbox):
+        while outbox.queue:
+            kind, value = outbox.queue.popleft()
+            if kind == "mark":
+                label, done = value
+                if label in outbox.progress:
+                    # An edit in flight queued a newer progress frame behind the mark: wait for it too
+                    outbox.queue.append((kind, value))
+                elif not done.done():
+                    done.set_result(None)
+                continue
+            if kind == "progress" and outbox.progress.get(value) == outbox.progress_sent.get(value):
+                # Nothing new to show: don't spend a slot on it
+                outbox.progress.pop(value, None)
+                continue
+            await self._pace(outbox)
+            try:
+                if kind == "text":
+                    await self._send(chat_id, value)
+                else:
+                    await self._show_progress(chat_id, outbox, value)
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                seconds = retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else retry_after
+                logger.warning("Telegram flood control for chat %s, waiting %.0fs", chat_id, seconds)
+                metrics.inc("telegram_flood_waits_total")
+                outbox.queue.appendleft((kind, value))
+                outbox.next_at = time.monotonic() + seconds
+            except TelegramError as e:
+                logger.warning("Dropped Telegram message for chat %s: %s", chat_id, e)
+                metrics.inc("telegram_messages_dropped_total")
+                if kind == "progress":
+                    # E.g. the progress message was deleted: the next update posts a new one
+                    outbox.progress.pop(value, None)
+                    self.end_progress(chat_id, value)
+
+    async def _send(self, chat_id, text):
+        message = await self.bot.send_message(chat_id=chat_id, text=text[:4096])
+        metrics.inc("telegram_messages_total", kind="send")
+        return message
+
+    async def _show_progress(self, chat_id, outbox, key):
+        text = outbox.progress[key]
+        message = outbox.progress_messages.get(key)
+        if message is None:
+            outbox.progress_messages[key] = await self._send(chat_id, text)
+        else:
+            await message.edit_text(text[:4096])
+            metrics.inc("telegram_messages_total", kind="edit")
+        outbox.progress_sent[key] = text
+        if outbox.progress[key] == text:
+            del outbox.progress[key]
+        else:
+            # Updated while the edit was in flight: show the newer text next
+            outbox.queue.append(("progress", key))
+
+    def pending(self):
+        """Queued messages and open failure windows, across all chats (for /debug)."""
+        return sum(sum(kind != "mark" for kind, _ in o.queue) + len(o.failures) for o in self.chats.values())
@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import random
+import time
+
+import config
+import metrics
+from services import build_email_prompt
+
+logger = logging.getLogger(__name__)
+
+PERSONALIZE_INSTRUCTION = (
+    "Personalize the approved email above for the prospect described in Prospect Info. "
+    "Adapt the greeting, opening and value proposition to them and fill every placeholder with their data. "
+    "Keep the design, structure, images and tone unchanged."
+)
+
+
+class SpendGuard:
+    """
+    Running cost estimate from token usage. A request may only start if the spend so far plus
+    the expected cost of every request already in flight stays under `max_usd`.
+    """
+
+    def __init__(self, max_usd=None):
+        self.max_usd = config.MAX_SPEND_USD if max_usd is None else max_usd
+        self.spent = 0.0
+        self.requests = 0
+        self.in_flight = 0
+
+    @staticmethod
+    def cost(usage):
+        uncached = usage["prompt"] - usage["cached"]
+        return (
+            uncached * config.OPENAI_INPUT_PRICE_PER_M
+            + usage["cached"] * config.OPENAI_CACHED_INPUT_PRICE_PER_M
+            + usage["completion"] * config.OPENAI_OUTPUT_PRICE_PER_M
+        ) / 1_000_000
+
+    @property
+    def average(self):
+        return self.spent / self.requests if self.requests else 0.0
+
+    def reserve(self):
+        if self.max_usd > 0 and self.spent + (self.in_flight + 1) * self.average > self.max_usd:
+            return False
+        self.in_flight += 1
+        return True
+
+    def settle(self, usage):
+        self.in_flight -= 1
+        if usage and not usage.get("from_cache"):
+            cost = self.cost(usage)
+            self.spent += cost
+            self.requests += 1
+            metrics.inc("openai_estimated_spend_usd_total", cost)
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD limit on in-flight generations: a 429 halves the limit and pauses new requests
+    (honouring Retry-After when the API sends it); every `limit` successes raise it by one.
+    """
+
+    def __init__(self, maximum):
+        self.maximum = max(1, maximum)
+        self.limit = self.maximum
+        self.active = 0
+        self.successes = 0
+        self.resume_at = 0.0
+        self.changed = asyncio.Condition()
+
+    async def acquire(self):
+        async with self.changed:
+            await self.changed.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+        delay = self.resume_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def release(self, throttled=False, retry_after=None):
+        async with self.changed:
+            self.active -= 1
+            if throttled:
+                # 429s from requests that were already in flight count as one decrease
+                if time.monotonic() >= self.resume_at:
+                    self.limit = max(1, self.limit // 2)
+                    self.successes = 0
+                    pause = retry_after or min(30.0, 2.0 ** (self.maximum - self.limit)) + random.random()
+                    self.resume_at = time.monotonic() + pause
+            else:
+                self.successes += 1
+                if self.successes >= self.limit and self.limit < self.maximum:
+                    self.limit += 1
+                    self.successes = 0
+            self.changed.notify_all()
+
+
+def _retry_after(error):
+    try:
+        return float(error.response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class PersonalizationPipeline:
+    """
+    Generates one personalized draft per prospect with bounded, adaptive concurrency.
+    `run` is an async generator of (prospect, html) in completion order, so the caller can
+    send finished drafts while later ones are still generating. Prospects that fail after
+    `max_attempts` are reported through `failed`; once the spend guard trips, the remaining
+    prospects are counted in `not_generated` and never requested.
+    """
+
+    def __init__(self, openai_service, draft_arguments, approved_draft, concurrency=None, max_spend=None, max_attempts=4):
+        self.openai_service = openai_service
+        self.draft_arguments = draft_arguments
+        self.approved_draft = approved_draft
+        self.limiter = AdaptiveConcurrency(concurrency or config.PERSONALIZE_CONCURRENCY)
+        self.guard = SpendGuard(max_spend)
+        self.max_attempts = max_attempts
+        self.generated = 0
+        self.failed = []
+        self.not_generated = 0
+        self.spend_exceeded = False
+
+    def messages_for(self, prospect):
+        arguments = dict(self.draft_arguments)
+        arguments.update(
+            prospect_info=prospect,
+            previous_draft=self.approved_draft,
+            revision=PERSONALIZE_INSTRUCTION,
+            earlier_revisions=(),
+        )
+        return build_email_prompt(**arguments)
+
+    async def _generate(self, prospect):
+        messages = self.messages_for(prospect)
+        for attempt in range(self.max_attempts):
+            await self.limiter.acquire()
+            if not self.guard.reserve():
+                await self.limiter.release()
+                self.spend_exceeded = True
+                self.not_generated += 1
+                return None
+            usage = None
+            try:
+                html, usage = await self.openai_service.request(
+                    messages, label=f"Personalized draft for {prospect.get('email')}", max_retries=0, use_cache=False)
+            except Exception as e:
+                self.guard.settle(None)
+                # openai.RateLimitError, matched by status so the SDK isn't imported at startup
+                if getattr(e, "status_code", None) != 429:
+                    await self.limiter.release()
+                    self.failed.append((prospect.get('email'), f"{type(e).__name__}: {e}"))
+                    return None
+                metrics.inc("openai_rate_limited_total")
+                await self.limiter.release(throttled=True, retry_after=_retry_after(e))
+                logger.warning("Rate limited (attempt %d), concurrency now %d", attempt + 1, self.limiter.limit)
+                continue
+            self.guard.settle(usage)
+            await self.limiter.release()
+            self.generated += 1
+            return html
+        self.failed.append((prospect.get('email'), "rate limited"))
+        return None
+
+    async def run(self, prospects):
+        results = asyncio.Queue(maxsize=self.limiter.maximum * 2)
+        done = object()
+
+        async def one(prospect):
+            html = await self._generate(prospect)
+            if html is not None:
+                await results.put((prospect, html))
+
+        async def produce():
+            tasks = set()
+            try:
+                async for prospect in prospects:
+                    if self.spend_exceeded:
+                        self.not_generated += 1
+                        continue
+                    # Don't read further ahead than the limiter lets us generate
+                    while len(tasks) >= self.limiter.limit * 2:
+                        _, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                    task = asyncio.create_task(one(prospect))
+                    tasks.add(task)
+                if tasks:
+                    await asyncio.gather(*tasks)
+            finally:
+                await results.put(done)
+
+        producer = asyncio.create_task(produce())
+        try:
+            while True:
+                item = await results.get()
+                if item is done:
+                    break
+                yield item
+            await producer
+        finally:
+            producer.cancel()
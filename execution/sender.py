@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Longest error text kept per failure kind in failure summaries
+ERROR_TEXT_LENGTH = 120
+
+
+def error_kind(error):
+    """Groups failures by the first line of their error, e.g. 'HttpError 429: rateLimitExceeded'."""
+    text = str(error).strip().splitlines()[0] if str(error).strip() else "unknown error"
+    return text[:ERROR_TEXT_LENGTH]
+
+
+class TokenBucket:
+    """Thread-safe token bucket. `acquire` blocks the calling worker thread until a token is free."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, count=1):
+        if self.rate <= 0:
+            return
+        for _ in range(count):
+            while True:
+                with self.lock:
+                    now = time.monotonic()
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        break
+                    wait = (1 - self.tokens) / self.rate
+                time.sleep(wait)
+
+
+class SendStats:
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.latencies = []
+        self.started = time.monotonic()
+        self.finished = None
+
+    def record(self, success, latency):
+        self.latencies.append(latency)
+        if success:
+            self.sent += 1
+        else:
+            self.failed += 1
+
+    def finish(self):
+        self.finished = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def rate(self):
+        return self.sent / self.elapsed if self.elapsed > 0 else 0.0
+
+    def percentile(self, pct):
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        # Nearest-rank percentile
+        index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+        return ordered[index]
+
+    def summary(self):
+        return (
+            f"{self.sent} sent, {self.failed} failed in {self.elapsed:.1f}s "
+            f"({self.rate:.2f} sends/s, p50 {self.percentile(50) * 1000:.0f}ms, "
+            f"p95 {self.percentile(95) * 1000:.0f}ms)"
+        )
+
+
+async def _aiter(iterable):
+    for item in iterable:
+        yield item
+
+
+class BulkSender:
+    """
+    Runs blocking Gmail sends on a bounded thread pool so the bot's event loop stays free.
+    Jobs are tuples whose first item is the recipient address; `send_fn(*job)` must return
+    (success, detail) like GoogleService.send_raw, where detail is the message id or the error. When `batch_fn` is given (e.g.
+    GoogleService.send_emails_batch) and `batch_size` > 1, jobs are grouped and each worker
+    sends a whole group in one batch request with `batch_fn(jobs)` instead.
+    """
+
+    def __init__(self, send_fn, concurrency=None, rate=None, burst=None, batch_fn=None, batch_size=None):
+        self.send_fn = send_fn
+        self.batch_fn = batch_fn
+        self.batch_size = config.GMAIL_BATCH_SIZE if batch_size is None else batch_size
+        if not batch_fn or self.batch_size < 2:
+            self.batch_size = 1
+        self.concurrency = max(1, concurrency or config.SEND_CONCURRENCY)
+        self.limiter = TokenBucket(
+            config.GMAIL_SENDS_PER_SECOND if rate is None else rate,
+            burst or config.GMAIL_SEND_BURST,
+        )
+
+    def _send_group(self, group):
+        # Every message in a batch still costs its own quota units
+        self.limiter.acquire(len(group))
+        started = time.monotonic()
+        try:
+            if self.batch_size > 1:
+                results = self.batch_fn(group)
+            else:
+                results = [self.send_fn(*group[0])]
+        except Exception as e:
+            results = [(False, f"{type(e).__name__}: {e}")] * len(group)
+        return results, time.monotonic() - started
+
+    async def _groups(self, jobs):
+        if not hasattr(jobs, "__aiter__"):
+            jobs = _aiter(jobs)
+        group = []
+        async for job in jobs:
+            group.append(job)
+            if len(group) >= self.batch_size:
+                yield group
+                group = []
+        if group:
+            yield group
+
+    async def run(self, jobs, on_failure=None, on_success=None):
+        """
+        Sends every job in `jobs`, e.g. (to, subject, html). At most `concurrency` sends (or
+        batches) are in flight, so `jobs` can be a lazy (sync or async) generator.
+        `on_failure(to, error)` is awaited per failed send and `on_success(to, message_id)`
+        per delivered one.
+        """
+        stats = SendStats()
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(self.concurrency)
+        pending = set()
+
+        async def worker(pool, group):
+            try:
+                results, latency = await loop.run_in_executor(pool, self._send_group, group)
+                for job, (success, detail) in zip(group, results):
+                    stats.record(success, latency)
+                    if success and on_success:
+                        await on_success(job[0], detail)
+                    elif not success and on_failure:
+                        await on_failure(job[0], detail)
+            finally:
+                slots.release()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="gmail-send") as pool:
+            async for group in self._groups(jobs):
+                await slots.acquire()
+                task = asyncio.create_task(worker(pool, group))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.gather(*pending)
+
+        stats.finish()
+        logger.info("Bulk send finished: %s", stats.summary())
+        return stats
@@ -1,15 +1,21 @@
 import os
 import json
-from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+import asyncio
+import functools
+import random
+import threading
+import time
+import logging
 from googleapiclient.errors import HttpError
-import openai
 import config
-import base64
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from credentials import CredentialsManager, save_token
+from mime_builder import MessageBuilder
+from generation_cache import GenerationCache
+import metrics
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
 
 # If modifying these scopes, delete the file token.json.
 SCOPES = [
@@ -18,9 +24,130 @@ SCOPES = [
     'https://www.googleapis.com/auth/gmail.send'
 ]
 
+# Gmail accepts at most 100 calls per batch request
+GMAIL_BATCH_LIMIT = 100
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+class SheetReadError(Exception):
+    """
+    Part of a sheet (a page of prospect rows, its header row or its size) could not be read,
+    even after retrying. Rows from `first_row` on were not read.
+    """
+
+    def __init__(self, sheet_name, first_row, last_row, error, what=None):
+        what = what or f"rows {first_row}-{last_row}"
+        super().__init__(f"could not read {what} of '{sheet_name}': {error}")
+        self.sheet_name = sheet_name
+        self.first_row = first_row
+        self.last_row = last_row
+        self.error = error
+
+
+class TTLCache:
+    """
+    Small thread-safe LRU cache whose entries go stale after `ttl` seconds. A stale entry
+    is still returned by `lookup` (with fresh=False) so callers can revalidate it cheaply
+    against a version id instead of refetching.
+    """
+
+    def __init__(self, ttl=None, max_entries=None):
+        self.ttl = config.CACHE_TTL_SECONDS if ttl is None else ttl
+        self.max_entries = max_entries or config.CACHE_MAX_ENTRIES
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key):
+        """Returns (value, version, fresh), or None if the key is not cached."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            value, version, expires = entry
+            fresh = time.monotonic() < expires
+            if fresh:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return value, version, fresh
+
+    def get(self, key):
+        entry = self.lookup(key)
+        if entry is None or not entry[2]:
+            return None
+        return entry[0]
+
+    def set(self, key, value, version=None):
+        with self._lock:
+            self._entries[key] = (value, version, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def quote_sheet_name(sheet_name):
+    # A1 notation needs sheet names with spaces or punctuation wrapped in single quotes
+    return "'" + sheet_name.replace("'", "''") + "'"
+
+
+def column_letter(index):
+    """1 -> A, 26 -> Z, 27 -> AA"""
+    letters = ""
+    while index > 0:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters or "A"
+
+
+@metrics.instrument("google")
 class GoogleService:
-    def __init__(self):
-        self.creds = None
+    """
+    Credentials and the docs/sheets/gmail clients are created on first use, so constructing
+    the service (and starting the bot) costs nothing until a command actually needs Google.
+    """
+
+    # attribute -> (API name, version)
+    APIS = {
+        "docs_service": ("docs", "v1"),
+        "sheets_service": ("sheets", "v4"),
+        "gmail_service": ("gmail", "v1"),
+    }
+
+    def __init__(self, auth=None, token_file=None):
+        # Another sender account's token (sharded sends); GOOGLE_TOKEN_JSON only applies to the default one
+        self.token_file = token_file or config.GOOGLE_TOKEN_FILE
+        # Token refresh and the pool of per-worker transports live in the credentials manager
+        self.auth = auth or CredentialsManager(self._load_credentials, token_file=self.token_file)
+        self._clients = {}
+        self._lock = threading.Lock()
+        # Doc context and sheet metadata rarely change between sessions
+        self.cache = TTLCache()
+
+    @property
+    def creds(self):
+        return self.auth.creds
+
+    @property
+    def creds_loaded(self):
+        return self.auth.loaded
+
+    def _load_credentials(self):
+        started = time.perf_counter()
+        from google.oauth2.credentials import Credentials
+        creds = None
         
         # 1. Handle Client Secrets (credentials.json) from Env Var if file missing
         if not os.path.exists(config.GOOGLE_CREDENTIALS_FILE):
@@ -32,51 +159,103 @@ class GoogleService:
         # 2. Try to load Token
         # Priority: Env Var (JSON) -> File (JSON) -> File (Pickle - Legacy)
         
-        token_json = os.getenv("GOOGLE_TOKEN_JSON")
+        token_json = os.getenv("GOOGLE_TOKEN_JSON") if self.token_file == config.GOOGLE_TOKEN_FILE else None
         if token_json:
             try:
-                self.creds = Credentials.from_authorized_user_info(json.loads(token_json), SCOPES)
+                creds = Credentials.from_authorized_user_info(json.loads(token_json), SCOPES)
             except Exception as e:
                 print(f"Error loading token from env: {e}")
 
-        if not self.creds and os.path.exists(config.GOOGLE_TOKEN_FILE):
+        if not creds and os.path.exists(self.token_file):
             try:
-                self.creds = Credentials.from_authorized_user_file(config.GOOGLE_TOKEN_FILE, SCOPES)
+                creds = Credentials.from_authorized_user_file(self.token_file, SCOPES)
             except Exception:
                 # Fallback to pickle for backward compatibility
                 try:
                     import pickle
-                    with open(config.GOOGLE_TOKEN_FILE, 'rb') as token:
-                        self.creds = pickle.load(token)
+                    with open(self.token_file, 'rb') as token:
+                        creds = pickle.load(token)
                 except Exception as e:
                     print(f"Error loading token file: {e}")
 
         # 3. Refresh or Login
-        if not self.creds or not self.creds.valid:
-            if self.creds and self.creds.expired and self.creds.refresh_token:
+        if not creds or not creds.valid:
+            if creds and creds.expired and creds.refresh_token:
+                from google.auth.transport.requests import Request
                 try:
-                    self.creds.refresh(Request())
+                    creds.refresh(Request())
                 except Exception as e:
                     print(f"Error refreshing token: {e}")
-                    self.creds = None # Force re-login
+                    creds = None # Force re-login
             
-            if not self.creds:
+            if not creds:
                 # This will fail on server if no browser, but necessary for local setup
+                from google_auth_oauthlib.flow import InstalledAppFlow
                 flow = InstalledAppFlow.from_client_secrets_file(
                     config.GOOGLE_CREDENTIALS_FILE, SCOPES)
-                self.creds = flow.run_local_server(port=0)
+                creds = flow.run_local_server(port=0)
             
             # Save as JSON for future use (and easy copy-paste to env var)
-            with open(config.GOOGLE_TOKEN_FILE, 'w') as token:
-                token.write(self.creds.to_json())
+            save_token(self.token_file, creds)
+        logger.info("Google credentials loaded in %.0fms", (time.perf_counter() - started) * 1000)
+        return creds
+
+    def _client(self, attribute):
+        client = self._clients.get(attribute)
+        if client is None:
+            creds = self.creds
+            with self._lock:
+                client = self._clients.get(attribute)
+                if client is None:
+                    from googleapiclient.discovery import build
+                    name, version = self.APIS[attribute]
+                    started = time.perf_counter()
+                    # Discovery documents ship with google-api-python-client: no network fetch,
+                    # and no file cache to read or write
+                    client = build(name, version, credentials=creds, static_discovery=True, cache_discovery=False)
+                    self._clients[attribute] = client
+                    logger.info("Built %s %s client in %.0fms", name, version, (time.perf_counter() - started) * 1000)
+        return client
+
+    @property
+    def docs_service(self):
+        return self._client("docs_service")
+
+    @property
+    def sheets_service(self):
+        return self._client("sheets_service")
+
+    @property
+    def gmail_service(self):
+        return self._client("gmail_service")
+
+    def built_clients(self):
+        return [self.APIS[attribute][0] for attribute in self.APIS if attribute in self._clients]
 
-        self.docs_service = build('docs', 'v1', credentials=self.creds)
-        self.sheets_service = build('sheets', 'v4', credentials=self.creds)
-        self.gmail_service = build('gmail', 'v1', credentials=self.creds)
+    def _execute(self, request):
+        # One pooled transport per call: httplib2 objects must not be shared between threads
+        with self.auth.transport() as http:
+            return request.execute(http=http)
+
+    def invalidate_cache(self):
+        self.cache.invalidate()
 
     def read_doc(self, doc_id):
+        key = ("doc", doc_id)
         try:
-            document = self.docs_service.documents().get(documentId=doc_id).execute()
+            cached = self.cache.lookup(key)
+            if cached:
+                content, revision_id, fresh = cached
+                if fresh:
+                    return content
+                # Expired: ask only for the revisionId and keep our copy if the doc hasn't changed
+                latest = self._execute(self.docs_service.documents().get(
+                    documentId=doc_id, fields="revisionId"))
+                if revision_id and latest.get('revisionId') == revision_id:
+                    self.cache.set(key, content, revision_id)
+                    return content
+
+            document = self._execute(self.docs_service.documents().get(documentId=doc_id))
             content = ""
             for element in document.get('body').get('content'):
                 if 'paragraph' in element:
@@ -84,139 +263,604 @@ class GoogleService:
                     for elem in elements:
                         if 'textRun' in elem:
                             content += elem.get('textRun').get('content')
+            self.cache.set(key, content, document.get('revisionId'))
             return content
         except HttpError as err:
             print(err)
+            metrics.inc("google_api_errors_total", method="read_doc")
             return None
 
     def read_sheet(self, sheet_id, range_name):
         try:
             sheet = self.sheets_service.spreadsheets()
-            result = sheet.values().get(spreadsheetId=sheet_id, range=range_name).execute()
+            result = self._execute(sheet.values().get(spreadsheetId=sheet_id, range=range_name))
             values = result.get('values', [])
             return values
         except HttpError as err:
             print(err)
+            metrics.inc("google_api_errors_total", method="read_sheet")
             return []
 
     def get_sheet_names(self, spreadsheet_id):
+        key = ("sheet_names", spreadsheet_id)
+        names = self.cache.get(key)
+        if names:
+            return names
         try:
-            sheet_metadata = self.sheets_service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
+            sheet_metadata = self._execute(self.sheets_service.spreadsheets().get(
+                spreadsheetId=spreadsheet_id, fields="sheets.properties.title"))
             sheets = sheet_metadata.get('sheets', [])
-            return [sheet.get("properties", {}).get("title", "Sheet1") for sheet in sheets]
+            names = [sheet.get("properties", {}).get("title", "Sheet1") for sheet in sheets]
+            if names:
+                self.cache.set(key, names)
+            return names
         except HttpError as err:
             print(err)
+            metrics.inc("google_api_errors_total", method="get_sheet_names")
             return []
 
-    def get_sheet_headers(self, spreadsheet_id, sheet_name):
-        try:
-            # Read just the first row to get headers
-            range_name = f"{sheet_name}!A1:Z1"
-            result = self.sheets_service.spreadsheets().values().get(
-                spreadsheetId=spreadsheet_id, range=range_name).execute()
-            values = result.get('values', [])
-            if values:
-                return values[0] # Return the first row as a list of headers
-            return []
-        except HttpError as err:
-            print(err)
-            return []
+    def get_sheet_headers(self, spreadsheet_id, sheet_name, use_cache=True):
+        # Sheets has no cheap revision id, so headers are cached on TTL only. Sending passes
+        # use_cache=False: stale headers there would shift every column.
+        key = ("headers", spreadsheet_id, sheet_name)
+        if use_cache:
+            headers = self.cache.get(key)
+            if headers:
+                return headers
+        # Read just the first row to get headers (whole row, so columns past Z are kept)
+        range_name = f"{quote_sheet_name(sheet_name)}!1:1"
+        result = self._read_sheet(
+            "get_sheet_headers",
+            lambda: self.sheets_service.spreadsheets().values().get(spreadsheetId=spreadsheet_id, range=range_name),
+            sheet_name, 1, 1, what="the header row")
+        values = result.get('values', [])
+        if values:
+            self.cache.set(key, values[0])
+            return values[0] # Return the first row as a list of headers
+        return []
+
+    def get_sheet_row_count(self, spreadsheet_id, sheet_name):
+        # No data row was read if the size can't be: rows from 2 on are missing
+        sheet_metadata = self._read_sheet(
+            "get_sheet_row_count",
+            lambda: self.sheets_service.spreadsheets().get(spreadsheetId=spreadsheet_id, fields="sheets.properties"),
+            sheet_name, 2, None, what="the size")
+        for sheet in sheet_metadata.get('sheets', []):
+            properties = sheet.get("properties", {})
+            if properties.get("title") == sheet_name:
+                return properties.get("gridProperties", {}).get("rowCount", 0)
+        return 0
+
+    def _read_sheet(self, method, request, sheet_name, first_row, last_row, what=None):
+        """
+        Executes `request()`, retrying 429/5xx and timeouts with exponential backoff. A failed
+        read is never taken as empty: SheetReadError is raised once the retries run out.
+        """
+        for attempt in range(config.SHEET_READ_RETRIES + 1):
+            if attempt:
+                time.sleep(min(32, 2 ** (attempt - 1)) + random.random())
+            try:
+                return self._execute(request())
+            except HttpError as err:
+                print(err)
+                metrics.inc("google_api_errors_total", method=method)
+                error = err
+                if int(err.resp.status) not in RETRYABLE_STATUSES:
+                    break
+            except (TimeoutError, ConnectionError) as err:
+                print(err)
+                metrics.inc("google_api_errors_total", method=method)
+                error = err
+        raise SheetReadError(sheet_name, first_row, last_row, error, what)
+
+    def read_sheet_page(self, spreadsheet_id, sheet_name, first_row, last_row, width):
+        """
+        Reads rows first_row..last_row (1-based, inclusive) of the first `width` columns.
+        Unlike read_sheet, a failed page is never returned as empty: it is retried, then
+        SheetReadError is raised.
+        """
+        range_name = f"{quote_sheet_name(sheet_name)}!A{first_row}:{column_letter(width)}{last_row}"
+        result = self._read_sheet(
+            "read_sheet_page",
+            lambda: self.sheets_service.spreadsheets().values().get(spreadsheetId=spreadsheet_id, range=range_name),
+            sheet_name, first_row, last_row)
+        return result.get('values', [])
+
+    def iter_sheet_pages(self, spreadsheet_id, sheet_name, width, page_size=None):
+        """
+        Yields the data rows under the header row, `page_size` rows per request. Raises
+        SheetReadError if a page can't be read, so no range of the sheet is skipped silently.
+        """
+        page_size = page_size or config.SHEET_PAGE_SIZE
+        row_count = self.get_sheet_row_count(spreadsheet_id, sheet_name)
+        for first_row in range(2, row_count + 1, page_size):
+            last_row = min(row_count, first_row + page_size - 1)
+            rows = self.read_sheet_page(spreadsheet_id, sheet_name, first_row, last_row, width)
+            if rows:
+                yield rows
 
     def send_email(self, to, subject, body_html):
+        return self.send_raw(to, MessageBuilder(subject, body_html).build_raw(to))
+
+    def send_raw(self, to, raw):
+        """
+        Sends a message already encoded by MessageBuilder.build_raw.
+        Returns (True, gmail_message_id) or (False, error).
+        """
         try:
-            message = MIMEMultipart('alternative')
-            message['to'] = to
-            message['subject'] = subject
-            
-            # Create a plain text version by stripping tags (simple approximation)
-            import re
-            clean = re.compile('<.*?>')
-            body_text = re.sub(clean, '', body_html)
-            
-            part1 = MIMEText(body_text, 'plain')
-            part2 = MIMEText(body_html, 'html')
-            
-            message.attach(part1)
-            message.attach(part2)
-            
-            raw = base64.urlsafe_b64encode(message.as_bytes()).decode()
-            message = {'raw': raw}
-            self.gmail_service.users().messages().send(userId='me', body=message).execute()
-            return True, None
+            response = self._execute(self.gmail_service.users().messages().send(userId='me', body={'raw': raw}))
+            return True, response.get('id')
         except HttpError as err:
             print(err)
+            metrics.inc("google_api_errors_total", method="send_raw")
             return False, str(err)
 
+    def send_emails_batch(self, messages):
+        """Batch version of send_email for a list of (to, subject, body_html)."""
+        return self.send_raw_batch([
+            (to, MessageBuilder(subject, body_html).build_raw(to)) for to, subject, body_html in messages
+        ])
+
+    def send_raw_batch(self, messages):
+        """
+        Sends a list of (to, raw) through Gmail batch requests, up to config.GMAIL_BATCH_SIZE
+        sub-requests per HTTP call. Returns a list of (success, message_id or error) in the same order.
+        Sub-requests that fail with a retryable status (429/5xx) are resent on their own with
+        exponential backoff; the rest of the batch is not repeated.
+        """
+        results = [None] * len(messages)
+        raws = {i: raw for i, (_, raw) in enumerate(messages)}
+        pending = list(raws)
+        batch_size = max(1, min(config.GMAIL_BATCH_SIZE, GMAIL_BATCH_LIMIT))
+        for attempt in range(config.GMAIL_BATCH_RETRIES + 1):
+            if not pending:
+                break
+            if attempt:
+                time.sleep(min(32, 2 ** (attempt - 1)) + random.random())
+
+            retry = []
+
+            def callback(request_id, response, exception):
+                i = int(request_id)
+                if exception is None:
+                    results[i] = (True, (response or {}).get('id'))
+                    return
+                results[i] = (False, str(exception))
+                metrics.inc("google_api_errors_total", method="send_raw_batch")
+                status = getattr(getattr(exception, 'resp', None), 'status', None)
+                if status is not None and int(status) in RETRYABLE_STATUSES:
+                    retry.append(i)
+
+            for offset in range(0, len(pending), batch_size):
+                batch = self.gmail_service.new_batch_http_request(callback=callback)
+                chunk = pending[offset:offset + batch_size]
+                for i in chunk:
+                    batch.add(
+                        self.gmail_service.users().messages().send(userId='me', body={'raw': raws[i]}),
+                        request_id=str(i),
+                    )
+                try:
+                    self._execute(batch)
+                except HttpError as err:
+                    # The whole multipart call failed; every sub-request in it is worth retrying
+                    print(err)
+                    metrics.inc("google_api_errors_total", method="send_raw_batch")
+                    for i in chunk:
+                        if results[i] is None or not results[i][0]:
+                            results[i] = (False, str(err))
+                            retry.append(i)
+            pending = sorted(set(retry))
+        return results
+
+class AsyncGoogleService:
+    """
+    Awaitable wrapper around GoogleService. The googleapiclient calls stay blocking, so each
+    one runs on a small dedicated thread pool (one authorized transport per thread).
+    """
+
+    def __init__(self, service=None):
+        self.service = service or GoogleService()
+        self.executor = ThreadPoolExecutor(max_workers=config.GOOGLE_IO_THREADS, thread_name_prefix="google-io")
+
+    @property
+    def creds(self):
+        return self.service.creds
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(fn, *args))
+
+    async def read_doc(self, doc_id):
+        return await self._run(self.service.read_doc, doc_id)
+
+    async def read_sheet(self, sheet_id, range_name):
+        return await self._run(self.service.read_sheet, sheet_id, range_name)
+
+    async def get_sheet_names(self, spreadsheet_id):
+        return await self._run(self.service.get_sheet_names, spreadsheet_id)
+
+    async def get_sheet_headers(self, spreadsheet_id, sheet_name, use_cache=True):
+        return await self._run(self.service.get_sheet_headers, spreadsheet_id, sheet_name, use_cache)
+
+    async def get_sheet_row_count(self, spreadsheet_id, sheet_name):
+        return await self._run(self.service.get_sheet_row_count, spreadsheet_id, sheet_name)
+
+    def invalidate_cache(self):
+        self.service.invalidate_cache()
+
+    async def iter_sheet_pages(self, spreadsheet_id, sheet_name, width, page_size=None):
+        """
+        Async version of GoogleService.iter_sheet_pages. The next page is already being
+        fetched while the caller works through the current one. Raises SheetReadError too.
+        """
+        page_size = page_size or config.SHEET_PAGE_SIZE
+        row_count = await self._run(self.service.get_sheet_row_count, spreadsheet_id, sheet_name)
+        ranges = [
+            (first_row, min(row_count, first_row + page_size - 1))
+            for first_row in range(2, row_count + 1, page_size)
+        ]
+        loop = asyncio.get_running_loop()
+
+        def fetch(bounds):
+            return loop.run_in_executor(
+                self.executor, self.service.read_sheet_page, spreadsheet_id, sheet_name, bounds[0], bounds[1], width)
+
+        upcoming = fetch(ranges[0]) if ranges else None
+        try:
+            for index in range(len(ranges)):
+                rows = await upcoming
+                upcoming = fetch(ranges[index + 1]) if index + 1 < len(ranges) else None
+                if rows:
+                    yield rows
+        finally:
+            if upcoming is not None:
+                upcoming.cancel()
+
+    async def send_email(self, to, subject, body_html):
+        return await self._run(self.service.send_email, to, subject, body_html)
+
+    async def send_emails_batch(self, messages):
+        return await self._run(self.service.send_emails_batch, messages)
+
+    async def send_raw(self, to, raw):
+        return await self._run(self.service.send_raw, to, raw)
+
+    async def send_raw_batch(self, messages):
+        return await self._run(self.service.send_raw_batch, messages)
+
+
+MODEL = "gpt-5.1"
+SYSTEM_PROMPT = "You are a helpful sales assistant and expert email designer. You output ONLY raw HTML."
+
+
+STYLE_INSTRUCTIONS = """
+    Draft a premium email to this prospect.
+    Use HTML and inline CSS.
+    
+    CRITICAL STYLE INSTRUCTIONS:
+    1. Analyze the 'Context about the company' provided above. Look for any specific branding, tone, style, or formatting guidelines mentioned there.
+    2. STRICTLY ADHERE to those style instructions.
+    3. If the context does NOT specify a style, use a clean, professional, and modern design with a subtle background color and a white content box.
+    4. Do NOT force a "newspaper" style unless the context explicitly asks for it.
+    
+    - Add a professional header and footer.
+    - Make it responsive.
+    - IMPORTANT: Return ONLY the raw HTML code. Do not include any conversational text like "Here is the email" or markdown formatting. Start directly with <!DOCTYPE html> or <html>.
+    """
+
+
+def build_email_prompt(context, prospect_info, feedback=None, image_url=None, logo_url=None, available_columns=None,
+                       previous_draft=None, revision=None, earlier_revisions=()):
+    """
+    Chat messages for a draft. The large, invariant part (system prompt, company context and
+    style rules) always comes first and is byte-identical between rounds, so the provider's
+    prompt caching can reuse it. `feedback` is the operator's original request.
+
+    For a refinement round pass the `previous_draft` and the latest `revision` feedback: the
+    model edits its own last answer instead of starting over from an ever-growing prompt.
+    `earlier_revisions` are only listed briefly so they are not undone.
+    """
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"Context about the company:\n{context}\n\n{STYLE_INSTRUCTIONS}"},
+    ]
+
+    prompt = f"Prospect Info: {prospect_info}\n"
+    if available_columns:
+        prompt += f"Available Placeholders: {', '.join([f'[{col}]' for col in available_columns])}\n"
+    prompt += "\n"
+    if feedback:
+        prompt += f"Previous feedback from user: {feedback}\n\n"
+    if logo_url:
+        prompt += f"- Include this LOGO at the very top of the email (centered, small, e.g. 150px width): <img src='{logo_url}' alt='Logo' style='width:150px; height:auto; display:block; margin: 0 auto 20px auto;' />\n"
+    if image_url:
+        prompt += f"- Include this HEADER IMAGE after the logo (full width): <img src='{image_url}' alt='Header Image' style='width:100%; max-width:600px; height:auto; display:block; margin: 0 auto;' />\n"
+    messages.append({"role": "user", "content": prompt.strip()})
+
+    if previous_draft and revision:
+        messages.append({"role": "assistant", "content": previous_draft})
+        request = f"Revise the email above. Apply this feedback: {revision}\n"
+        if earlier_revisions:
+            request += "Keep these earlier changes in place:\n"
+            request += "".join(f"- {compact_feedback(item)}\n" for item in earlier_revisions)
+        request += "Return the complete updated HTML only."
+        messages.append({"role": "user", "content": request})
+    return messages
+
+
+def compact_feedback(text, limit=200):
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit - 3] + "..."
+
+
+def usage_summary(usage, seconds):
+    """Token counts from an OpenAI usage object, including prompt tokens served from cache."""
+    details = getattr(usage, 'prompt_tokens_details', None)
+    return {
+        "prompt": getattr(usage, 'prompt_tokens', 0) or 0,
+        "cached": getattr(details, 'cached_tokens', 0) or 0,
+        "completion": getattr(usage, 'completion_tokens', 0) or 0,
+        "seconds": seconds,
+        "from_cache": False,
+    }
+
+
+def record_usage(usage):
+    metrics.inc("openai_tokens_total", usage["prompt"] - usage["cached"], kind="prompt")
+    metrics.inc("openai_tokens_total", usage["cached"], kind="cached_prompt")
+    metrics.inc("openai_tokens_total", usage["completion"], kind="completion")
+
+
+def cache_hit_usage(seconds):
+    return {"prompt": 0, "cached": 0, "completion": 0, "seconds": seconds, "from_cache": True}
+
+
+def clean_email_html(content):
+    content = content.strip()
+    
+    # cleaning logic
+    # 1. Strip markdown code blocks
+    if "```html" in content:
+        content = content.split("```html")[1]
+    if "```" in content:
+        content = content.split("```")[0]
+    
+    # 2. Find start of HTML if there is still conversational text
+    start_index = content.find("<html")
+    if start_index == -1:
+        start_index = content.find("<!DOCTYPE")
+    if start_index == -1:
+        start_index = content.find("<div")
+        
+    if start_index != -1:
+        content = content[start_index:]
+        
+    return content.strip()
+
+
+class HtmlStreamExtractor:
+    """
+    Incremental version of clean_email_html for streamed completions. Feed it deltas and
+    `visible` holds the HTML seen so far with the markdown fence and any leading chatter
+    removed. Once the start is found, only the new tail is scanned for the closing fence.
+    """
+
+    MARKERS = ("```html", "<html", "<!DOCTYPE", "<div")
+
+    def __init__(self):
+        self.buffer = ""
+        self.start = -1
+        self.end = -1
+        self.fenced = False
+        self._scanned = 0
+
+    def feed(self, delta):
+        self.buffer += delta
+        if self.start == -1:
+            self._find_start()
+        if self.start != -1 and self.end == -1 and self.fenced:
+            closing = self.buffer.find("```", max(self.start, self._scanned - 2))
+            if closing != -1:
+                self.end = closing
+        self._scanned = len(self.buffer)
+        return self.visible
+
+    def _find_start(self):
+        # Only runs until the start is found, while the buffer is still short chatter
+        fence = self.buffer.find("```html")
+        if fence != -1:
+            self.start = fence + len("```html")
+            self.fenced = True
+            return
+        # Without a fence, take the first marker in clean_email_html's priority order
+        for marker in self.MARKERS[1:]:
+            index = self.buffer.find(marker)
+            if index != -1:
+                self.start = index
+                return
+
+    @property
+    def visible(self):
+        if self.start == -1:
+            return ""
+        text = self.buffer[self.start:] if self.end == -1 else self.buffer[self.start:self.end]
+        # Hold back a fence that is still arriving one backtick at a time
+        return text.rstrip("`").strip()
+
+    @property
+    def done(self):
+        return self.end != -1
+
+
+def _openai_api_key():
+    # Strip whitespace and handle potential copy-paste errors (newlines)
+    raw_key = config.OPENAI_API_KEY or ""
+    return raw_key.strip().split('\n')[0].split('\r')[0]
+
+
+@metrics.instrument("openai_sync")
 class OpenAIService:
     def __init__(self):
-        # Strip whitespace and handle potential copy-paste errors (newlines)
-        raw_key = config.OPENAI_API_KEY or ""
-        api_key = raw_key.strip().split('\n')[0].split('\r')[0]
-        
-        # Increase timeout to 60 seconds to avoid connection errors on slow networks
-        self.client = openai.OpenAI(api_key=api_key, timeout=60.0)
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import openai
+            # Increase timeout to 60 seconds to avoid connection errors on slow networks
+            self._client = openai.OpenAI(api_key=_openai_api_key(), base_url=config.OPENAI_BASE_URL, timeout=60.0)
+        return self._client
 
     def generate_email(self, context, prospect_info, feedback=None, image_url=None, logo_url=None, available_columns=None):
-        prompt = f"Context about the company:\n{context}\n\n"
-        prompt += f"Prospect Info: {prospect_info}\n"
-        if available_columns:
-            prompt += f"Available Placeholders: {', '.join([f'[{col}]' for col in available_columns])}\n"
-        prompt += "\n"
-        if feedback:
-            prompt += f"Previous feedback from user: {feedback}\n\n"
-        
-        image_instruction = ""
-        if logo_url:
-            image_instruction += f"- Include this LOGO at the very top of the email (centered, small, e.g. 150px width): <img src='{logo_url}' alt='Logo' style='width:150px; height:auto; display:block; margin: 0 auto 20px auto;' />\n"
-        
-        if image_url:
-            image_instruction += f"- Include this HEADER IMAGE after the logo (full width): <img src='{image_url}' alt='Header Image' style='width:100%; max-width:600px; height:auto; display:block; margin: 0 auto;' />\n"
+        messages = build_email_prompt(context, prospect_info, feedback, image_url, logo_url, available_columns)
+        try:
+            response = self.client.chat.completions.create(model=MODEL, messages=messages)
+            return clean_email_html(response.choices[0].message.content)
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            metrics.inc("openai_errors_total", error=type(e).__name__)
+            return f"Error generating email ({type(e).__name__}): {str(e)}"
 
-        prompt += f"""
-        Draft a premium email to this prospect.
-        Use HTML and inline CSS.
-        {image_instruction}
-        
-        CRITICAL STYLE INSTRUCTIONS:
-        1. Analyze the 'Context about the company' provided above. Look for any specific branding, tone, style, or formatting guidelines mentioned there.
-        2. STRICTLY ADHERE to those style instructions.
-        3. If the context does NOT specify a style, use a clean, professional, and modern design with a subtle background color and a white content box.
-        4. Do NOT force a "newspaper" style unless the context explicitly asks for it.
-        
-        - Add a professional header and footer.
-        - Make it responsive.
-        - IMPORTANT: Return ONLY the raw HTML code. Do not include any conversational text like "Here is the email" or markdown formatting. Start directly with <!DOCTYPE html> or <html>.
+
+@metrics.instrument("openai")
+class AsyncOpenAIService:
+    """
+    Same contract as OpenAIService.generate_email, but awaits the API without blocking the event loop.
+    The refinement arguments (previous_draft, revision, earlier_revisions) are passed through
+    to build_email_prompt. Usage dicts come from usage_summary and are None when a call failed.
+    """
+
+    def __init__(self, client=None):
+        # `client` lets benchmarks pass a stand-in with the same chat.completions.create interface.
+        # Otherwise the SDK (a slow import) is loaded on the first request.
+        self._client = client
+        # Identical requests (same context, prompt, feedback, images...) reuse the earlier draft
+        self.cache = GenerationCache() if config.GENERATION_CACHE else None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import openai
+            self._client = openai.AsyncOpenAI(api_key=_openai_api_key(), base_url=config.OPENAI_BASE_URL, timeout=60.0)
+        return self._client
+
+    def _cached(self, messages, label):
+        """Returns (cache_key, html, usage); html is None on a miss or when caching is off."""
+        if self.cache is None:
+            return None, None, None
+        started = time.monotonic()
+        key = GenerationCache.key(MODEL, messages)
+        html = self.cache.get(key)
+        if html is None:
+            return key, None, None
+        usage = cache_hit_usage(time.monotonic() - started)
+        logger.info("%s: served from generation cache in %.1fms", label, usage["seconds"] * 1000)
+        return key, html, usage
+
+    async def request(self, messages, label="Draft", max_retries=None, use_cache=True):
+        """
+        One completion for a prepared message list, through the generation cache.
+        Returns (html, usage) and lets API errors (e.g. openai.RateLimitError) propagate.
+        `max_retries=0` disables the client's own retries for callers doing their own backoff.
+        `use_cache=False` neither reads nor stores the draft: per-prospect drafts never repeat,
+        would push the operator's drafts out of the cache and would keep prospect data on disk.
         """
+        key, html, usage = self._cached(messages, label) if use_cache else (None, None, None)
+        if html is not None:
+            return html, usage
+        client = self.client if max_retries is None else self.client.with_options(max_retries=max_retries)
+        started = time.monotonic()
+        response = await client.chat.completions.create(model=MODEL, messages=messages)
+        usage = usage_summary(response.usage, time.monotonic() - started)
+        logger.info(
+            "%s: %.1fs, %d prompt (%d cached) + %d completion tokens",
+            label, usage["seconds"], usage["prompt"], usage["cached"], usage["completion"],
+        )
+        record_usage(usage)
+        html = clean_email_html(response.choices[0].message.content)
+        if key:
+            self.cache.set(key, html)
+        return html, usage
 
+    async def _complete(self, messages, label="Draft"):
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-5.1",
-                messages=[
-                    {"role": "system", "content": "You are a helpful sales assistant and expert email designer. You output ONLY raw HTML."},
-                    {"role": "user", "content": prompt}
-                ]
-            )
-            content = response.choices[0].message.content.strip()
-            
-            # cleaning logic
-            # 1. Strip markdown code blocks
-            if "```html" in content:
-                content = content.split("```html")[1]
-            if "```" in content:
-                content = content.split("```")[0]
-            
-            # 2. Find start of HTML if there is still conversational text
-            start_index = content.find("<html")
-            if start_index == -1:
-                start_index = content.find("<!DOCTYPE")
-            if start_index == -1:
-                start_index = content.find("<div")
-                
-            if start_index != -1:
-                content = content[start_index:]
-                
-            return content.strip()
+            return await self.request(messages, label)
         except Exception as e:
             import traceback
             traceback.print_exc()
-            return f"Error generating email ({type(e).__name__}): {str(e)}"
+            metrics.inc("openai_errors_total", error=type(e).__name__)
+            return f"Error generating email ({type(e).__name__}): {str(e)}", None
+
+    async def generate_email(self, context, prospect_info, feedback=None, image_url=None, logo_url=None, available_columns=None,
+                             previous_draft=None, revision=None, earlier_revisions=()):
+        messages = build_email_prompt(context, prospect_info, feedback, image_url, logo_url, available_columns,
+                                      previous_draft, revision, earlier_revisions)
+        html, _ = await self._complete(messages)
+        return html
+
+    async def stream_email(self, context, prospect_info, feedback=None, image_url=None, logo_url=None, available_columns=None,
+                           previous_draft=None, revision=None, earlier_revisions=()):
+        """
+        Streams one draft. Yields (html_so_far, False, None) as tokens arrive, then
+        (final_html, True, usage) where final_html is cleaned exactly like generate_email's result.
+        """
+        messages = build_email_prompt(context, prospect_info, feedback, image_url, logo_url, available_columns,
+                                      previous_draft, revision, earlier_revisions)
+        key, html, usage = self._cached(messages, "Streamed draft")
+        if html is not None:
+            yield html, True, usage
+            return
+        started = time.monotonic()
+        first_token = None
+        extractor = HtmlStreamExtractor()
+        try:
+            stream = await self.client.chat.completions.create(
+                model=MODEL, messages=messages, stream=True, stream_options={"include_usage": True})
+            async for chunk in stream:
+                if chunk.usage:
+                    usage = chunk.usage
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                if first_token is None:
+                    first_token = time.monotonic() - started
+                yield extractor.feed(chunk.choices[0].delta.content), False, None
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            metrics.inc("openai_errors_total", error=type(e).__name__)
+            yield f"Error generating email ({type(e).__name__}): {str(e)}", True, None
+            return
+        usage = usage_summary(usage, time.monotonic() - started)
+        logger.info(
+            "Streamed draft: first token %.1fs, total %.1fs, %d prompt (%d cached) + %d completion tokens",
+            first_token or 0, usage["seconds"], usage["prompt"], usage["cached"], usage["completion"],
+        )
+        record_usage(usage)
+        html = clean_email_html(extractor.buffer)
+        if key:
+            self.cache.set(key, html)
+        yield html, True, usage
+
+    async def generate_variants(self, context, prospect_info, feedback=None, image_url=None, logo_url=None, available_columns=None,
+                                previous_draft=None, revision=None, earlier_revisions=(), n=None):
+        """
+        Requests `n` drafts concurrently and yields (index, html, usage) as each one finishes,
+        so the first variant can be shown while the others are still generating.
+        """
+        n = max(1, n or config.DRAFT_VARIANTS)
+        messages = build_email_prompt(context, prospect_info, feedback, image_url, logo_url, available_columns,
+                                      previous_draft, revision, earlier_revisions)
+
+        async def variant(index):
+            variant_messages = messages
+            if n > 1:
+                variant_messages = messages + [{
+                    "role": "user",
+                    "content": f"This is variant {index + 1} of {n}. Take a clearly different angle, hook or layout from the other variants.",
+                }]
+            html, usage = await self._complete(variant_messages, label=f"Draft variant {index + 1}/{n}")
+            return index, html, usage
+
+        for finished in asyncio.as_completed([variant(i) for i in range(n)]):
+            yield await finished
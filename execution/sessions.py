@@ -0,0 +1,190 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import config
+
+
+class Session:
+    """Conversation state for one chat. Slots keep thousands of idle sessions cheap."""
+
+    __slots__ = (
+        "chat_id",
+        "context_doc",
+        "current_draft",
+        "variants",
+        "draft_id",
+        "user_prompt",
+        "feedback_history",
+        "email_subject",
+        "image_url",
+        "logo_url",
+        "selected_sheet",
+        "selected_columns",
+        "available_headers",
+        "last_seen",
+    )
+
+    # Fields written to the on-disk backend (everything except bookkeeping)
+    PERSISTED = __slots__[1:-1]
+
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+        self.context_doc = ""
+        self.current_draft = ""
+        self.variants = []
+        self.draft_id = ""  # changes every drafting round; preview buttons carry it
+        self.user_prompt = ""
+        self.feedback_history = []
+        self.email_subject = ""
+        self.image_url = None
+        self.logo_url = None
+        self.selected_sheet = None
+        self.selected_columns = []
+        self.available_headers = []
+        self.last_seen = time.time()
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.PERSISTED}
+
+    @classmethod
+    def from_dict(cls, chat_id, data):
+        session = cls(chat_id)
+        for name in cls.PERSISTED:
+            if name in data:
+                setattr(session, name, data[name])
+        return session
+
+
+class SessionStore:
+    """
+    In-memory sessions keyed by chat_id. Sessions idle for longer than `ttl` seconds are
+    evicted, and at most `max_sessions` are kept (least recently used go first).
+    """
+
+    def __init__(self, ttl=None, max_sessions=None):
+        self.ttl = config.SESSION_TTL_SECONDS if ttl is None else ttl
+        self.max_sessions = max_sessions or config.MAX_SESSIONS
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_sweep = time.time()
+
+    def get(self, chat_id):
+        """
+        Returns the chat's session, or None if it has none (never started, expired or
+        evicted). Only /start creates sessions, through `reset`.
+        """
+        now = time.time()
+        with self._lock:
+            session = self._sessions.get(chat_id)
+            if session is not None and self._expired(session, now):
+                self._drop(chat_id)
+                session = None
+            if session is None:
+                session = self._load(chat_id)
+                if session is None:
+                    return None
+                self._sessions[chat_id] = session
+            self._sessions.move_to_end(chat_id)
+            session.last_seen = now
+            self._evict(now)
+            return session
+
+    def reset(self, chat_id):
+        """Starts a fresh session for `chat_id` (used by /start)."""
+        with self._lock:
+            self._drop(chat_id)
+            session = Session(chat_id)
+            self._sessions[chat_id] = session
+            self._evict(time.time())
+            return session
+
+    def save(self, session):
+        session.last_seen = time.time()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _expired(self, session, now):
+        return self.ttl > 0 and now - session.last_seen > self.ttl
+
+    def _evict(self, now):
+        while len(self._sessions) > self.max_sessions:
+            chat_id, _ = self._sessions.popitem(last=False)
+            self._forget(chat_id)
+        # Full TTL sweep at most once a minute; the dict is in LRU order so we can stop early
+        if now - self._last_sweep < 60:
+            return
+        self._last_sweep = now
+        while self._sessions:
+            chat_id, oldest = next(iter(self._sessions.items()))
+            if not self._expired(oldest, now):
+                break
+            self._drop(chat_id)
+
+    def _drop(self, chat_id):
+        self._sessions.pop(chat_id, None)
+        self._delete(chat_id)
+
+    # Hooks for persistent backends. `_forget` only frees memory, `_delete` removes for good.
+    def _load(self, chat_id):
+        return None
+
+    def _forget(self, chat_id):
+        pass
+
+    def _delete(self, chat_id):
+        pass
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Keeps the same in-memory LRU in front of a SQLite table, so sessions survive restarts
+    and the ones pushed out of memory by `max_sessions` can be reloaded on the next message.
+    """
+
+    def __init__(self, path, ttl=None, max_sessions=None):
+        super().__init__(ttl, max_sessions)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (chat_id INTEGER PRIMARY KEY, data TEXT NOT NULL, last_seen REAL NOT NULL)"
+        )
+        if self.ttl > 0:
+            self.db.execute("DELETE FROM sessions WHERE last_seen < ?", (time.time() - self.ttl,))
+        self.db.commit()
+
+    def save(self, session):
+        super().save(session)
+        with self._lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO sessions (chat_id, data, last_seen) VALUES (?, ?, ?)",
+                (session.chat_id, json.dumps(session.to_dict()), session.last_seen),
+            )
+            self.db.commit()
+
+    def _load(self, chat_id):
+        row = self.db.execute("SELECT data, last_seen FROM sessions WHERE chat_id = ?", (chat_id,)).fetchone()
+        if row is None:
+            return None
+        session = Session.from_dict(chat_id, json.loads(row[0]))
+        session.last_seen = row[1]
+        if self._expired(session, time.time()):
+            self._delete(chat_id)
+            return None
+        return session
+
+    def _delete(self, chat_id):
+        self.db.execute("DELETE FROM sessions WHERE chat_id = ?", (chat_id,))
+        self.db.commit()
+
+
+def create_session_store():
+    if config.SESSION_DB_PATH:
+        return SQLiteSessionStore(config.SESSION_DB_PATH)
+    return SessionStore()
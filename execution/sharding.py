@@ -0,0 +1,568 @@
+import argparse
+import asyncio
+import hashlib
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import config
+from journal import SendJournal
+from mime_builder import MessageBuilder
+from sender import BulkSender, error_kind
+from template import CompiledTemplate
+
+logger = logging.getLogger(__name__)
+
+# Shard and campaign states
+PENDING = "pending"
+LOADING = "loading"
+RUNNING = "running"
+PAUSED = "paused"
+CANCELLED = "cancelled"
+DONE = "done"
+FAILED = "failed"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+# Recipients written to SQLite per transaction while partitioning
+INSERT_BATCH = 5000
+
+
+def shard_of(email, shards):
+    """Stable shard for a normalized address: the same in every process and after a restart."""
+    digest = hashlib.blake2b(email.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shards
+
+
+def account_slots(shards, accounts, processes=None):
+    """
+    How many shards of one sender account may send at the same time: enough for `processes`
+    workers spread over the accounts (every shard with processes=0, i.e. external workers only).
+    LeaseStore.claim enforces it, so each running shard can be given a full share of the quota.
+    """
+    processes = config.SHARD_PROCESSES if processes is None else processes
+    running = min(shards, processes) if processes > 0 else shards
+    return max(1, -(-running // len(accounts)))
+
+
+def shard_rates(shards, accounts, rate=None, processes=None):
+    """Gmail sends/s for each shard: each account's quota is split between its shards that run at once."""
+    rate = config.GMAIL_SENDS_PER_SECOND if rate is None else rate
+    slots = account_slots(shards, accounts, processes)
+    per_account = Counter(shard % len(accounts) for shard in range(shards))
+    return [rate / min(slots, per_account[shard % len(accounts)]) if rate > 0 else 0 for shard in range(shards)]
+
+
+def google_service(account, options):
+    """Default service factory: a GoogleService sending as the account in token file `account`."""
+    from services import GoogleService
+    return GoogleService(token_file=account)
+
+
+def load_factory(path):
+    """'module:function' -> function. Worker processes build their own services from it."""
+    module, _, name = path.partition(":")
+    return getattr(importlib.import_module(module), name)
+
+
+class ShardProgress:
+    """Counters summed over a campaign's shards."""
+
+    __slots__ = ("sent", "failed", "total", "unsent", "statuses", "errors", "claimable", "accounts")
+
+    def __init__(self, rows, claimable, accounts=1):
+        self.sent = sum(row[2] for row in rows)
+        self.failed = sum(row[3] for row in rows)
+        self.total = sum(row[4] for row in rows)
+        # Recipients of failed shards that were neither sent nor tried
+        self.unsent = sum(max(0, row[4] - row[2] - row[3]) for row in rows if row[1] == FAILED)
+        self.statuses = Counter(row[1] for row in rows)
+        self.errors = Counter()
+        for row in rows:
+            self.errors.update(json.loads(row[5] or "{}"))
+        self.claimable = claimable
+        self.accounts = accounts
+
+    @property
+    def shards(self):
+        return sum(self.statuses.values())
+
+    @property
+    def finished(self):
+        return self.shards > 0 and all(status in FINISHED for status in self.statuses)
+
+    def summary(self):
+        states = ", ".join(f"{count} {status}" for status, count in sorted(self.statuses.items()))
+        return f"{self.shards} shards ({states})"
+
+    def top_errors(self, top=3):
+        return ", ".join(f"{count:,} x {kind}" for kind, count in self.errors.most_common(top))
+
+
+class LeaseStore:
+    """
+    Shared state of sharded campaigns: the campaign spec, every recipient filed under its
+    shard, and one lease row per shard (owner, expiry, status and counters). Each process
+    opens its own connection; claims run in IMMEDIATE transactions so two workers never
+    get the same shard.
+    """
+
+    def __init__(self, path=None, timeout=30.0):
+        self.path = path or config.SHARD_DB_PATH
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(self.path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS shard_campaigns ("
+            " id TEXT PRIMARY KEY,"
+            " spec TEXT NOT NULL,"
+            " state TEXT NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS shard_leases ("
+            " campaign TEXT NOT NULL,"
+            " shard INTEGER NOT NULL,"
+            " status TEXT NOT NULL,"
+            " owner TEXT,"
+            " lease_until REAL NOT NULL DEFAULT 0,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " sent INTEGER NOT NULL DEFAULT 0,"
+            " failed INTEGER NOT NULL DEFAULT 0,"
+            " total INTEGER NOT NULL DEFAULT 0,"
+            " errors TEXT,"
+            " error TEXT,"
+            " PRIMARY KEY (campaign, shard))"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS shard_prospects ("
+            " campaign TEXT NOT NULL,"
+            " shard INTEGER NOT NULL,"
+            " email TEXT NOT NULL,"
+            " prospect TEXT NOT NULL,"
+            " PRIMARY KEY (campaign, shard, email)) WITHOUT ROWID"
+        )
+        self._lock = threading.Lock()
+
+    def _transaction(self, fn, *args):
+        with self._lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(*args)
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+            self.db.execute("COMMIT")
+            return result
+
+    def create(self, campaign, spec):
+        """Starts loading `campaign` (a rerun replaces the previous one; the journal skips who got it)."""
+        def create():
+            for table, column in (("shard_prospects", "campaign"), ("shard_leases", "campaign"), ("shard_campaigns", "id")):
+                self.db.execute(f"DELETE FROM {table} WHERE {column} = ?", (campaign,))
+            self.db.execute("INSERT INTO shard_campaigns (id, spec, state, created_at) VALUES (?, ?, ?, ?)",
+                            (campaign, json.dumps(spec), LOADING, time.time()))
+            self.db.executemany("INSERT INTO shard_leases (campaign, shard, status) VALUES (?, ?, ?)",
+                                [(campaign, shard, PENDING) for shard in range(spec["shards"])])
+        self._transaction(create)
+
+    def add_prospects(self, campaign, rows):
+        """`rows` are (shard, email, prospect JSON)."""
+        self._transaction(self.db.executemany,
+                          "INSERT OR IGNORE INTO shard_prospects (campaign, shard, email, prospect) VALUES (?, ?, ?, ?)",
+                          [(campaign, *row) for row in rows])
+
+    def open(self, campaign):
+        """Everything is filed: record each shard's size and let workers claim them."""
+        def open_():
+            self.db.execute(
+                "UPDATE shard_leases SET total = (SELECT COUNT(*) FROM shard_prospects p"
+                " WHERE p.campaign = shard_leases.campaign AND p.shard = shard_leases.shard) WHERE campaign = ?",
+                (campaign,))
+            self.db.execute("UPDATE shard_campaigns SET state = ? WHERE id = ?", (RUNNING, campaign))
+        self._transaction(open_)
+
+    def prospects(self, campaign, shard):
+        with self._lock:
+            rows = self.db.execute("SELECT prospect FROM shard_prospects WHERE campaign = ? AND shard = ?",
+                                   (campaign, shard)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def _claimable(self, campaign=None, max_attempts=None):
+        max_attempts = config.SHARD_MAX_ATTEMPTS if max_attempts is None else max_attempts
+        query = (
+            " FROM shard_leases l JOIN shard_campaigns c ON c.id = l.campaign"
+            " WHERE c.state = ? AND (l.status = ? OR (l.status = ? AND l.lease_until < ? AND l.attempts < ?))"
+        )
+        params = [RUNNING, PENDING, RUNNING, time.time(), max_attempts]
+        if campaign is not None:
+            query += " AND l.campaign = ?"
+            params.append(campaign)
+        return query, params
+
+    def _fail_abandoned(self, campaign, max_attempts):
+        # Expired leases that already had every attempt (e.g. a shard that keeps killing its worker)
+        query = ("UPDATE shard_leases SET status = ?, owner = NULL, lease_until = 0,"
+                 " error = 'worker stopped renewing its lease ' || attempts || ' times'"
+                 " WHERE status = ? AND lease_until < ? AND attempts >= ?")
+        params = [FAILED, RUNNING, time.time(), max_attempts]
+        if campaign is not None:
+            query += " AND campaign = ?"
+            params.append(campaign)
+        self.db.execute(query, params)
+
+    def fail_abandoned(self, campaign=None, max_attempts=None):
+        """Fails shards whose lease expired on their last attempt, instead of leasing them out again."""
+        max_attempts = config.SHARD_MAX_ATTEMPTS if max_attempts is None else max_attempts
+        self._transaction(self._fail_abandoned, campaign, max_attempts)
+
+    def _busy_accounts(self, campaign, accounts):
+        rows = self.db.execute("SELECT shard FROM shard_leases WHERE campaign = ? AND status = ? AND lease_until >= ?",
+                               (campaign, RUNNING, time.time())).fetchall()
+        return Counter(shard % accounts for shard, in rows)
+
+    def claim(self, owner, ttl=None, campaign=None, max_attempts=None):
+        """
+        Leases the next free (or abandoned) shard to `owner`, skipping shards whose sender
+        account already runs its `slots` shards. Returns (campaign, shard, spec) or None.
+        """
+        ttl = config.SHARD_LEASE_SECONDS if ttl is None else ttl
+        max_attempts = config.SHARD_MAX_ATTEMPTS if max_attempts is None else max_attempts
+
+        def claim():
+            self._fail_abandoned(campaign, max_attempts)
+            query, params = self._claimable(campaign, max_attempts)
+            rows = self.db.execute(f"SELECT l.campaign, l.shard, c.spec{query} ORDER BY c.created_at, l.shard", params)
+            specs, busy = {}, {}
+            for campaign_id, shard, spec in rows.fetchall():
+                if campaign_id not in specs:
+                    specs[campaign_id] = json.loads(spec)
+                    busy[campaign_id] = self._busy_accounts(campaign_id, len(specs[campaign_id]["accounts"]))
+                spec = specs[campaign_id]
+                if busy[campaign_id][shard % len(spec["accounts"])] >= spec.get("slots", spec["shards"]):
+                    continue
+                self.db.execute(
+                    "UPDATE shard_leases SET status = ?, owner = ?, lease_until = ?, attempts = attempts + 1"
+                    " WHERE campaign = ? AND shard = ?",
+                    (RUNNING, owner, time.time() + ttl, campaign_id, shard))
+                return campaign_id, shard, spec
+            return None
+        return self._transaction(claim)
+
+    def heartbeat(self, campaign, shard, owner, ttl, sent, failed, errors):
+        """Renews the lease and saves the counters. Returns the campaign state, or None if the lease was lost."""
+        def heartbeat():
+            cursor = self.db.execute(
+                "UPDATE shard_leases SET lease_until = ?, sent = ?, failed = ?, errors = ?"
+                " WHERE campaign = ? AND shard = ? AND owner = ? AND status = ?",
+                (time.time() + ttl, sent, failed, json.dumps(errors), campaign, shard, owner, RUNNING))
+            if not cursor.rowcount:
+                return None
+            return self.db.execute("SELECT state FROM shard_campaigns WHERE id = ?", (campaign,)).fetchone()[0]
+        return self._transaction(heartbeat)
+
+    def finish(self, campaign, shard, owner, status, sent, failed, errors, error=None):
+        self._transaction(
+            self.db.execute,
+            "UPDATE shard_leases SET status = ?, sent = ?, failed = ?, errors = ?, error = ?, lease_until = 0"
+            " WHERE campaign = ? AND shard = ? AND owner = ?",
+            (status, sent, failed, json.dumps(errors), error, campaign, shard, owner))
+
+    def release(self, campaign, shard, owner, error, max_attempts=None):
+        """A shard that raised goes back to the pool, or fails after `max_attempts` tries."""
+        max_attempts = config.SHARD_MAX_ATTEMPTS if max_attempts is None else max_attempts
+        self._transaction(
+            self.db.execute,
+            "UPDATE shard_leases SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, owner = NULL,"
+            " lease_until = 0, error = ? WHERE campaign = ? AND shard = ? AND owner = ?",
+            (max_attempts, FAILED, PENDING, error, campaign, shard, owner))
+
+    def set_state(self, campaign, state):
+        def set_state():
+            self.db.execute("UPDATE shard_campaigns SET state = ? WHERE id = ?", (state, campaign))
+            if state == CANCELLED:
+                # Unclaimed shards are never started; running ones stop at their next heartbeat
+                self.db.execute("UPDATE shard_leases SET status = ? WHERE campaign = ? AND status = ?",
+                                (CANCELLED, campaign, PENDING))
+        self._transaction(set_state)
+
+    def progress(self, campaign):
+        query, params = self._claimable(campaign)
+        with self._lock:
+            rows = self.db.execute(
+                "SELECT shard, status, sent, failed, total, errors FROM shard_leases WHERE campaign = ?", (campaign,)
+            ).fetchall()
+            claimable = self.db.execute(f"SELECT COUNT(*){query}", params).fetchone()[0]
+            spec = self.db.execute("SELECT spec FROM shard_campaigns WHERE id = ?", (campaign,)).fetchone()
+        accounts = len(set(json.loads(spec[0])["accounts"])) if spec else 1
+        return ShardProgress(rows, claimable, accounts)
+
+    def errors(self, campaign):
+        """Errors that made shards fail, e.g. a sender account whose token is gone."""
+        with self._lock:
+            rows = self.db.execute(
+                "SELECT shard, error FROM shard_leases WHERE campaign = ? AND status = ? AND error IS NOT NULL",
+                (campaign, FAILED)).fetchall()
+        return rows
+
+    def drop_prospects(self, campaign):
+        self._transaction(self.db.execute, "DELETE FROM shard_prospects WHERE campaign = ?", (campaign,))
+
+    def close(self):
+        self.db.close()
+
+
+class ShardWorker:
+    """Sends one leased shard: its recipients minus the journal's, at the shard's own rate."""
+
+    def __init__(self, store, owner, campaign, shard, spec, ttl=None):
+        self.store = store
+        self.owner = owner
+        self.campaign = campaign
+        self.shard = shard
+        self.spec = spec
+        self.ttl = config.SHARD_LEASE_SECONDS if ttl is None else ttl
+        self.sent = 0
+        self.failed = 0
+        self.errors = Counter()
+        self.state = RUNNING  # campaign state seen at the last heartbeat; None once the lease is lost
+
+    def _heartbeat(self):
+        self.state = self.store.heartbeat(self.campaign, self.shard, self.owner, self.ttl,
+                                          self.sent, self.failed, dict(self.errors))
+
+    async def _keep_lease(self):
+        # Renewed well before expiry; also how pause and cancel reach the worker
+        while self.state in (RUNNING, PAUSED):
+            await asyncio.sleep(min(2.0, self.ttl / 3))
+            await asyncio.to_thread(self._heartbeat)
+
+    async def run(self):
+        spec = self.spec
+        account = spec["accounts"][self.shard % len(spec["accounts"])]
+        service = load_factory(spec["service_factory"])(account, spec.get("service_options") or {})
+        builder = MessageBuilder(spec["subject"], CompiledTemplate(spec["html"], spec["names"]), text=spec["text"])
+        journal = SendJournal(spec["journal_path"]) if spec["journal_path"] else None
+        delivered = await asyncio.to_thread(journal.delivered, spec["journal_campaign"]) if journal else set()
+        prospects = await asyncio.to_thread(self.store.prospects, self.campaign, self.shard)
+        # A shard taken over from a dead worker counts what that worker already sent
+        todo = [p for p in prospects if p["email"] not in delivered]
+        self.sent = len(prospects) - len(todo)
+
+        async def jobs():
+            for prospect in todo:
+                while self.state == PAUSED:
+                    await asyncio.sleep(0.5)
+                if self.state != RUNNING:
+                    return
+                yield prospect["email"], prospect
+
+        async def on_success(email, message_id):
+            self.sent += 1
+            if journal:
+                journal.record(spec["journal_campaign"], email, True, message_id)
+
+        async def on_failure(email, error):
+            self.failed += 1
+            self.errors[error_kind(error)] += 1
+            if journal:
+                journal.record(spec["journal_campaign"], email, False, error)
+
+        sender = BulkSender(
+            lambda to, prospect: service.send_raw(to, builder.build_raw(to, prospect)),
+            rate=spec["rates"][self.shard],
+            batch_fn=lambda group: service.send_raw_batch([(to, builder.build_raw(to, p)) for to, p in group]),
+        )
+        keeper = asyncio.create_task(self._keep_lease())
+        try:
+            await sender.run(jobs(), on_failure=on_failure, on_success=on_success)
+        finally:
+            keeper.cancel()
+            if journal:
+                await asyncio.to_thread(journal.close)
+        if self.state is None:
+            logger.warning("Lost the lease on shard %s of %s; another worker has it", self.shard, self.campaign)
+            return
+        status = CANCELLED if self.state == CANCELLED else DONE
+        self.store.finish(self.campaign, self.shard, self.owner, status, self.sent, self.failed, dict(self.errors))
+
+
+def run_worker(path=None, campaign=None, owner=None, ttl=None):
+    """
+    Claims and sends shards until none is free. Runs in the bot's process pool and in
+    `python execution/sharding.py worker`. Returns the number of shards worked on.
+    """
+    owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+    store = LeaseStore(path)
+    worked = 0
+    try:
+        while True:
+            claim = store.claim(owner, ttl, campaign)
+            if claim is None:
+                return worked
+            campaign_id, shard, spec = claim
+            worked += 1
+            try:
+                asyncio.run(ShardWorker(store, owner, campaign_id, shard, spec, ttl).run())
+            except Exception as e:
+                logger.exception("Shard %s of campaign %s failed", shard, campaign_id)
+                store.release(campaign_id, shard, owner, f"{type(e).__name__}: {e}")
+    finally:
+        store.close()
+
+
+class ShardStats:
+    """What process_sending reads from a sharded run (same `sent` / `summary()` as SendStats)."""
+
+    def __init__(self, progress, elapsed, errors=()):
+        self.progress = progress
+        self.sent = progress.sent
+        self.failed = progress.failed
+        self.unsent = progress.unsent
+        self.errors = list(errors)  # (shard, error) of the failed shards
+        self.elapsed = elapsed
+
+    @property
+    def rate(self):
+        return self.sent / self.elapsed if self.elapsed > 0 else 0.0
+
+    def summary(self):
+        text = (f"{self.sent} sent, {self.failed} failed in {self.elapsed:.1f}s ({self.rate:.2f} sends/s, "
+                f"{self.progress.summary()}, {self.progress.accounts} sender accounts)")
+        if self.progress.errors:
+            text += f"\nTop errors: {self.progress.top_errors()}"
+        failed_shards = self.progress.statuses[FAILED]
+        if failed_shards:
+            reasons = list(dict.fromkeys(error for _, error in self.errors))
+            text += (f"\n{failed_shards} shard{'s' if failed_shards > 1 else ''} failed, {self.unsent:,} recipients not sent"
+                     + (f": {'; '.join(reasons[:3])}" if reasons else ""))
+        return text
+
+
+class ShardedSender:
+    """
+    BulkSender's counterpart for very large sheets, spread over worker processes.
+
+    The bot reads and validates the sheet once, as usual; `run` files every recipient under
+    `shard_of(email, shards)` in the LeaseStore, then keeps up to `processes` local worker
+    processes claiming shards until every shard is done, and reports the summed counters
+    every `poll_seconds`. Workers can also be started by hand on the same machine
+    (`python execution/sharding.py worker`); they only share the SQLite files. A worker
+    that dies stops renewing its lease, and once the lease expires another one takes the
+    shard over; the send journal skips the recipients that were already sent.
+    """
+
+    def __init__(self, shards=None, processes=None, accounts=None, store=None, service_factory=None,
+                 service_options=None, ttl=None, poll_seconds=1.0):
+        self.shards = max(1, shards or config.SEND_SHARDS)
+        self.processes = config.SHARD_PROCESSES if processes is None else processes
+        self.accounts = list(accounts or config.SHARD_TOKEN_FILES)
+        self.store = store or LeaseStore()
+        self.service_factory = service_factory or config.SHARD_SERVICE_FACTORY
+        self.service_options = service_options or {}
+        self.ttl = config.SHARD_LEASE_SECONDS if ttl is None else ttl
+        self.poll_seconds = poll_seconds
+
+    def spec(self, campaign, subject, html, names, text=None, journal_path=None):
+        return {
+            "shards": self.shards,
+            "accounts": self.accounts,
+            "rates": shard_rates(self.shards, self.accounts, processes=self.processes),
+            "slots": account_slots(self.shards, self.accounts, self.processes),
+            "service_factory": self.service_factory,
+            "service_options": self.service_options,
+            "subject": subject,
+            "html": html,
+            "names": list(names),
+            "text": text,
+            "journal_path": config.JOURNAL_PATH if journal_path is None else journal_path,
+            "journal_campaign": campaign,
+        }
+
+    async def _partition(self, campaign, jobs):
+        batch = []
+        async for email, prospect in jobs:
+            batch.append((shard_of(email, self.shards), email, json.dumps(prospect)))
+            if len(batch) >= INSERT_BATCH:
+                await asyncio.to_thread(self.store.add_prospects, campaign, batch)
+                batch = []
+        if batch:
+            await asyncio.to_thread(self.store.add_prospects, campaign, batch)
+
+    async def run(self, jobs, spec, control=None, on_progress=None):
+        """
+        `jobs` yields (email, prospect) like BulkSender jobs, `spec` comes from `spec()`.
+        `on_progress(ShardProgress)` is called after every poll. Returns ShardStats.
+        """
+        campaign = spec["journal_campaign"]
+        started = time.monotonic()
+        await asyncio.to_thread(self.store.create, campaign, spec)
+        await self._partition(campaign, jobs)
+        await asyncio.to_thread(self.store.open, campaign)
+        if control and control.cancelled:
+            await asyncio.to_thread(self.store.set_state, campaign, CANCELLED)
+
+        state = RUNNING
+        pool, futures = None, set()
+        try:
+            while True:
+                await asyncio.to_thread(self.store.fail_abandoned, campaign)
+                progress = await asyncio.to_thread(self.store.progress, campaign)
+                if on_progress:
+                    on_progress(progress)
+                if progress.finished:
+                    break
+                if control:
+                    wanted = CANCELLED if control.cancelled else PAUSED if control.paused else RUNNING
+                    if wanted != state and state != CANCELLED:
+                        state = wanted
+                        await asyncio.to_thread(self.store.set_state, campaign, state)
+                for future in [f for f in futures if f.done()]:
+                    futures.discard(future)
+                    if isinstance(future.exception(), BrokenProcessPool) and pool is not None:
+                        # A worker process died: its shard is taken over once its lease expires
+                        logger.warning("Shard worker process died; restarting the pool")
+                        pool.shutdown(wait=False)
+                        pool = None
+                if self.processes > 0 and progress.claimable and len(futures) < self.processes:
+                    if pool is None:
+                        # spawn: the bot's threads must not be forked into the workers
+                        pool = ProcessPoolExecutor(max_workers=self.processes, mp_context=multiprocessing.get_context("spawn"))
+                    for _ in range(min(self.processes - len(futures), progress.claimable)):
+                        futures.add(pool.submit(run_worker, self.store.path, campaign, None, self.ttl))
+                await asyncio.sleep(self.poll_seconds)
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+        errors = await asyncio.to_thread(self.store.errors, campaign)
+        for shard, error in errors:
+            logger.warning("Shard %s of campaign %s failed: %s", shard, campaign, error)
+        await asyncio.to_thread(self.store.drop_prospects, campaign)
+        return ShardStats(progress, time.monotonic() - started, errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sends shards of sharded campaigns until none is left.")
+    parser.add_argument("command", choices=["worker"])
+    parser.add_argument("--campaign", help="only work on this campaign")
+    parser.add_argument("--db", default=None, help="lease database (default: SHARD_DB_PATH)")
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    worked = run_worker(args.db, args.campaign)
+    logger.info("No free shards left after working on %d", worked)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,27 @@
+import asyncio
 import logging
+import re
+import time
+import uuid
+# Startup clock: covers the imports below, bot construction and application setup
+STARTUP_STARTED = time.perf_counter()
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import TelegramError
 from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler, MessageHandler, filters, CallbackQueryHandler, ConversationHandler
 import config
-from services import GoogleService, OpenAIService
+import metrics
+from services import AsyncGoogleService, AsyncOpenAIService, SheetReadError
+from sender import BulkSender
+from sessions import Session, create_session_store
+from template import CompiledTemplate
+from mime_builder import MessageBuilder
+from html_optimizer import TAG_RE, OptimizedDraft
+from ingest import ProspectIngestor, SkipReport, find_email_column
+from journal import SendJournal, campaign_id
+from personalize import PersonalizationPipeline
+from jobs import CampaignFailed, CampaignScheduler
+from notifier import Notifier
+from sharding import ShardedSender
 
 # Logging
 logging.basicConfig(
@@ -10,6 +29,27 @@ logging.basicConfig(
     level=logging.INFO
 )
 
+def make_preview_text(html, partial=False):
+    # Text-only preview; Telegram messages are capped at 4096 characters
+    if partial and html.rfind("<") > html.rfind(">"):
+        # Don't show half of a tag that is still streaming in
+        html = html[:html.rfind("<")]
+    preview_text = TAG_RE.sub('', html)
+    preview_text = re.sub(r'\n\s*\n', '\n\n', preview_text).strip()
+    if len(preview_text) > 3000:
+        preview_text = preview_text[:3000] + "\n[...]"
+    return preview_text
+
+
+def draft_button(action, session, index):
+    # Callback data for a draft preview button: "approve|<draft id>|<variant>"
+    return f"{action}|{session.draft_id}|{index}"
+
+
+def retry_command(control):
+    return f"/resume {control.campaign.id}" if control and control.campaign else "/resume"
+
+
 WAITING_FOR_SHEET_SELECTION = 1
 WAITING_FOR_COLUMN_SELECTION = 2
 WAITING_FOR_PROMPT = 3
@@ -18,34 +58,59 @@ WAITING_FOR_LOGO = 5
 WAITING_FOR_IMAGE = 6
 WAITING_FOR_FEEDBACK = 7
 
+@metrics.instrument("bot")
 class EmailBot:
-    def __init__(self):
-        self.google_service = GoogleService()
-        self.openai_service = OpenAIService()
-        self.context_doc = ""
-        self.prospects = []
-        self.current_prospect_index = 0
-        self.current_draft = ""
-        self.user_prompt = ""
-        self.email_subject = ""
-        self.image_url = None
-        self.logo_url = None
-        self.selected_sheet = None
-        self.selected_columns = []
-        self.available_headers = []
+    def __init__(self, google_service=None, openai_service=None):
+        self.google_service = google_service or AsyncGoogleService()
+        self.openai_service = openai_service or AsyncOpenAIService()
+        self.sessions = create_session_store()
+        self.journal = SendJournal() if config.JOURNAL_PATH else None
+        # Approved campaigns are queued and sent in the background; their messages go through the notifier
+        self.notifier = Notifier()
+        # Without the journal a restarted campaign would email everyone again, so it is failed instead
+        self.campaigns = CampaignScheduler(self.run_campaign, resume_interrupted=self.journal is not None)
+        self.startup_seconds = None
+        self._register_metrics()
+
+    def _register_metrics(self):
+        # Read at export time from the objects that already keep these numbers
+        google_cache = self.google_service.service.cache
+        drafts = self.openai_service.cache
+
+        def caches(value):
+            values = {"google": value(google_cache)}
+            if drafts is not None:
+                values["drafts"] = value(drafts)
+            return values
+
+        metrics.register("cache_hits_total", lambda: caches(lambda c: c.hits), "counter", "Google metadata and draft cache hits")
+        metrics.register("cache_misses_total", lambda: caches(lambda c: c.misses), "counter", "Google metadata and draft cache misses")
+        metrics.register("cache_entries", lambda: caches(len), "gauge", "Entries held in each cache")
+        metrics.register("active_sessions", lambda: len(self.sessions), "gauge", "Chat sessions in memory")
+        auth = self.google_service.service.auth
+        metrics.register("google_token_seconds_left", lambda: auth.seconds_left() or 0, "gauge", "Seconds until the Google access token expires")
+
+        def transports():
+            stats = auth.stats()
+            return {"created": stats["transports"], "in_use": stats["in_use"]}
+
+        metrics.register("google_transports", transports, "gauge", "Pooled authorized Google transports")
+        metrics.register("campaigns", self.campaigns.store.counts, "gauge", "Campaigns by status")
+        metrics.register("startup_seconds", lambda: self.startup_seconds or 0, "gauge", "Time from first import to polling")
 
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        session = self.sessions.reset(update.effective_chat.id)
         await update.message.reply_text("Hello! I'm ready to help you send emails.\n\nFirst, I'll read the context from your Google Doc...")
         
         # Load context only
-        self.context_doc = self.google_service.read_doc(config.GOOGLE_DOC_ID)
-        if not self.context_doc:
+        session.context_doc = await self.google_service.read_doc(config.GOOGLE_DOC_ID)
+        if not session.context_doc:
             await update.message.reply_text("Warning: Could not read Google Doc. Proceeding without context.")
         else:
             await update.message.reply_text("Context loaded.")
 
         # Get sheet names
-        sheet_names = self.google_service.get_sheet_names(config.GOOGLE_SHEET_ID)
+        sheet_names = await self.google_service.get_sheet_names(config.GOOGLE_SHEET_ID)
         
         if not sheet_names:
             await update.message.reply_text("Error: Could not list sheets. Please check your configuration.")
@@ -57,129 +122,251 @@ class EmailBot:
             keyboard.append([InlineKeyboardButton(name, callback_data=f"sheet|{name}")])
         
         reply_markup = InlineKeyboardMarkup(keyboard)
+        self.sessions.save(session)
         await update.message.reply_text("Please select the sheet containing your prospects:", reply_markup=reply_markup)
         return WAITING_FOR_SHEET_SELECTION
 
+    async def session_expired(self, update: Update):
+        # The chat's session timed out or was evicted: going on would send or draft from empty state
+        text = "This conversation has expired. Please send /start to begin again."
+        if update.callback_query:
+            await update.callback_query.edit_message_text(text=text)
+        else:
+            await update.message.reply_text(text)
+        return ConversationHandler.END
+
     async def handle_prompt(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        self.user_prompt = update.message.text
+        session = self.sessions.get(update.effective_chat.id)
+        if session is None:
+            return await self.session_expired(update)
+        session.user_prompt = update.message.text
+        self.sessions.save(session)
         await update.message.reply_text("What should be the **Subject** of the email?")
         return WAITING_FOR_SUBJECT
 
     async def handle_subject(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        self.email_subject = update.message.text
+        session = self.sessions.get(update.effective_chat.id)
+        if session is None:
+            return await self.session_expired(update)
+        session.email_subject = update.message.text
+        self.sessions.save(session)
         await update.message.reply_text("Do you want to add a logo? (Reply with the Logo URL or type 'no')")
         return WAITING_FOR_LOGO
 
     async def handle_logo(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        session = self.sessions.get(update.effective_chat.id)
+        if session is None:
+            return await self.session_expired(update)
         text = update.message.text
         if text.lower() == 'no':
-            self.logo_url = None
+            session.logo_url = None
         else:
-            self.logo_url = text
+            session.logo_url = text
+        self.sessions.save(session)
             
         await update.message.reply_text("Do you want to insert a header image? (Reply with the Image URL or type 'no')")
         return WAITING_FOR_IMAGE
 
     async def handle_image(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        session = self.sessions.get(update.effective_chat.id)
+        if session is None:
+            return await self.session_expired(update)
         text = update.message.text
         if text.lower() == 'no':
-            self.image_url = None
+            session.image_url = None
         else:
-            self.image_url = text
+            session.image_url = text
         
-        await self.generate_and_preview(update, context)
+        await self.generate_and_preview(update, context, session)
         return WAITING_FOR_FEEDBACK
 
     async def handle_feedback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        session = self.sessions.get(update.effective_chat.id)
+        if session is None:
+            return await self.session_expired(update)
         feedback = update.message.text
         await update.message.reply_text("Regenerating based on feedback...")
         
-        # Regenerate using prompt + feedback
-        # We append feedback to the original prompt effectively
-        self.user_prompt += f"\n\nFeedback: {feedback}"
-        await self.generate_and_preview(update, context)
+        # The model revises its previous draft with only the latest feedback,
+        # instead of re-reading the original prompt with every round appended to it
+        await self.generate_and_preview(update, context, session, revision=feedback)
         return WAITING_FOR_FEEDBACK
 
-    async def generate_and_preview(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        import re
-        clean = re.compile('<.*?>')
-        
-        await update.message.reply_text("Drafting email...")
+    def draft_arguments(self, session, revision=None):
         dummy_prospect = {"name": "[Prospect Name]", "email": "[Prospect Email]"}
-        
-        self.current_draft = self.openai_service.generate_email(
-            self.context_doc, 
-            dummy_prospect, 
-            self.user_prompt,
-            image_url=self.image_url,
-            logo_url=self.logo_url,
-            available_columns=self.selected_columns
+        arguments = dict(
+            context=session.context_doc,
+            prospect_info=dummy_prospect,
+            feedback=session.user_prompt,
+            image_url=session.image_url,
+            logo_url=session.logo_url,
+            available_columns=session.selected_columns,
         )
+        if revision and session.current_draft and not session.current_draft.startswith("Error generating email"):
+            arguments.update(
+                previous_draft=session.current_draft,
+                revision=revision,
+                # Older feedback is already reflected in the previous draft; only a few are restated
+                earlier_revisions=session.feedback_history[-config.REFINE_HISTORY:] if config.REFINE_HISTORY else [],
+            )
+        elif revision:
+            # No usable draft to revise (e.g. the last round timed out): draft from scratch with
+            # every round's feedback appended to the request, so none of it is lost
+            arguments["feedback"] = session.user_prompt + "".join(
+                f"\n\nFeedback: {text}" for text in session.feedback_history + [revision])
+        return arguments
+
+    async def generate_and_preview(self, update: Update, context: ContextTypes.DEFAULT_TYPE, session, revision=None):
+        n = max(1, config.DRAFT_VARIANTS)
+        await update.message.reply_text("Drafting email..." if n == 1 else f"Drafting {n} variants in parallel...")
+        arguments = self.draft_arguments(session, revision)
+        if revision:
+            session.feedback_history.append(revision)
+        else:
+            session.feedback_history = []
         
-        # Create text preview
-        preview_text = re.sub(clean, '', self.current_draft)
-        preview_text = re.sub(r'\n\s*\n', '\n\n', preview_text).strip()
+        # Variants are shown as soon as each one finishes; the first to arrive is the default draft
+        session.draft_id = uuid.uuid4().hex[:8]
+        session.variants = [""] * n
+        session.current_draft = ""
+        if n == 1 and config.STREAM_PREVIEW:
+            await self.stream_and_preview(update, session, arguments)
+            return
+        async for index, html, usage in self.openai_service.generate_variants(n=n, **arguments):
+            session.variants[index] = html
+            if not session.current_draft:
+                session.current_draft = html
+            self.sessions.save(session)
+            await self.send_draft(update, session, index, n, usage)
+
+    async def stream_and_preview(self, update: Update, session, arguments):
+        # One message is edited in place with the text preview while tokens arrive
+        status = await update.message.reply_text("Waiting for the first words of the draft...")
+        last_edit = 0.0
+        last_text = ""
+        usage = None
+        async for html, done, usage in self.openai_service.stream_email(**arguments):
+            if done:
+                session.variants[0] = session.current_draft = html
+                break
+            now = time.monotonic()
+            if now - last_edit < config.STREAM_EDIT_INTERVAL:
+                continue
+            text = make_preview_text(html, partial=True)
+            if text and text != last_text:
+                last_edit, last_text = now, text
+                try:
+                    await status.edit_text(f"--- DRAFTING (live preview) ---\n\n{text}")
+                except TelegramError as e:
+                    # Flood control or "message is not modified": skip this frame
+                    logging.debug("Preview edit skipped: %s", e)
         
-        # Save HTML to file and send
-        with open("draft_preview.html", "w", encoding="utf-8") as f:
-            f.write(self.current_draft)
+        try:
+            await status.edit_text("Draft complete.")
+        except TelegramError:
+            pass
+        self.sessions.save(session)
+        await self.send_draft(update, session, 0, 1, usage)
+
+    async def send_draft(self, update: Update, session, index, n, usage=None):
+        html = session.variants[index]
+        label = "" if n == 1 else f" #{index + 1}"
+        preview_text = make_preview_text(html)
         
-        await update.message.reply_document(document=open("draft_preview.html", "rb"), filename="draft.html", caption="Here is the HTML draft.")
+        # Send the HTML straight from memory; a shared file on disk would race between chats
+        filename = "draft.html" if n == 1 else f"draft_{index + 1}.html"
+        caption = f"Here is the HTML draft{label}."
+        if usage and usage.get("from_cache"):
+            caption += f"\nRound {len(session.feedback_history) + 1}: served from cache in {usage['seconds'] * 1000:.0f}ms (no API call)"
+        elif usage:
+            # Per-round token accounting, so the effect of prompt caching is visible
+            caption += (
+                f"\nRound {len(session.feedback_history) + 1}: {usage['prompt']} prompt tokens "
+                f"({usage['cached']} cached), {usage['completion']} completion, {usage['seconds']:.1f}s"
+            )
+        await update.message.reply_document(document=html.encode("utf-8"), filename=filename, caption=caption)
         
         keyboard = [
-            [InlineKeyboardButton("Approve & Send to All", callback_data='approve')],
-            [InlineKeyboardButton("Refine", callback_data='refine')]
+            [InlineKeyboardButton(f"Approve{label} & Send to All", callback_data=draft_button('approve', session, index))],
+            [InlineKeyboardButton(f"Refine{label}", callback_data=draft_button('refine', session, index))]
         ]
+        if config.PERSONALIZATION:
+            # One model call per prospect, starting from this draft
+            keyboard.insert(1, [InlineKeyboardButton(f"Approve{label} & Personalize each (AI)", callback_data=draft_button('approve_ai', session, index))])
         reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(f"--- DRAFT PREVIEW (Text only) ---\nSubject: {self.email_subject}\n\n{preview_text}\n\n------------\n\nIf this looks good, click 'Approve & Send to All'.\nOtherwise, type your feedback to refine it.", reply_markup=reply_markup)
-
-
+        await update.message.reply_text(f"--- DRAFT PREVIEW{label} (Text only) ---\nSubject: {session.email_subject}\n\n{preview_text}\n\n------------\n\nIf this looks good, click 'Approve{label} & Send to All'.\nOtherwise, type your feedback to refine it.", reply_markup=reply_markup)
 
     async def button_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
+        session = self.sessions.get(update.effective_chat.id)
+        
+        # Buttons carry the drafting round and variant they belong to: "approve|<draft id>|2"
+        action, _, rest = query.data.partition("|")
+        draft_id, _, index = rest.rpartition("|")
+        if session is not None and draft_id != session.draft_id:
+            # A button under a draft from an earlier round: its variant numbers mean something else now
+            await query.answer("This draft is from an earlier round. Use the buttons under the latest draft.", show_alert=True)
+            return None
         await query.answer()
+        if session is None:
+            return await self.session_expired(update)
+        if index.isdigit() and int(index) < len(session.variants) and session.variants[int(index)]:
+            session.current_draft = session.variants[int(index)]
+            self.sessions.save(session)
         
-        if query.data == 'approve':
-            await query.edit_message_text(text="Approved! Sending emails...")
-            await self.process_sending(update, context)
+        if action == 'approve' or (action == 'approve_ai' and config.PERSONALIZATION):
+            # Queued and sent in the background; the conversation ends right away
+            self.start_background(context.bot)
+            campaign = self.campaigns.submit(update.effective_chat.id, session.to_dict(), personalize=action == 'approve_ai')
+            text = f"Approved! Campaign #{campaign.id} is " + (
+                "starting." if campaign.status == "running" else f"queued (position {self.campaigns.queue_position(campaign)}).")
+            await query.edit_message_text(text=text + "\nUse /status to follow it, /pause, /resume or /cancel to control it.")
             return ConversationHandler.END
             
-        elif query.data == 'refine':
+        elif action == 'refine':
             await query.edit_message_text(text="Okay, please type your feedback.")
             return WAITING_FOR_FEEDBACK
 
     async def handle_sheet_selection(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
         await query.answer()
+        session = self.sessions.get(update.effective_chat.id)
+        if session is None:
+            return await self.session_expired(update)
         
         data = query.data
         if data.startswith("sheet|"):
-            self.selected_sheet = data.split("|")[1]
+            session.selected_sheet = data.split("|")[1]
             
             # Fetch headers
-            self.available_headers = self.google_service.get_sheet_headers(config.GOOGLE_SHEET_ID, self.selected_sheet)
+            try:
+                session.available_headers = await self.google_service.get_sheet_headers(config.GOOGLE_SHEET_ID, session.selected_sheet)
+            except SheetReadError as e:
+                await query.edit_message_text(text=f"Error: {e}. Please try again with /start.")
+                return ConversationHandler.END
             
-            if not self.available_headers:
-                await query.edit_message_text(text=f"Selected '{self.selected_sheet}', but found no headers (first row is empty).")
+            if not session.available_headers:
+                await query.edit_message_text(text=f"Selected '{session.selected_sheet}', but found no headers (first row is empty).")
                 return ConversationHandler.END
                 
-            self.selected_columns = [] # Reset selection
-            await self.show_column_selection(query, context)
+            session.selected_columns = [] # Reset selection
+            self.sessions.save(session)
+            await self.show_column_selection(query, context, session)
             return WAITING_FOR_COLUMN_SELECTION
 
-    async def show_column_selection(self, query, context):
+    async def show_column_selection(self, query, context, session):
         keyboard = []
         # Add buttons for each header
-        for header in self.available_headers:
+        for header in session.available_headers:
             # Mark selected columns
-            label = f"✅ {header}" if header in self.selected_columns else header
+            label = f"✅ {header}" if header in session.selected_columns else header
             keyboard.append([InlineKeyboardButton(label, callback_data=f"col|{header}")])
         
         # Add Done button
         keyboard.append([InlineKeyboardButton("Done Selecting", callback_data="done_cols")])
         
         reply_markup = InlineKeyboardMarkup(keyboard)
-        msg_text = f"Sheet: {self.selected_sheet}\n\nPlease select the columns you want to use for personalization (e.g., Name, Company, Email).\nClick a column to toggle it."
+        msg_text = f"Sheet: {session.selected_sheet}\n\nPlease select the columns you want to use for personalization (e.g., Name, Company, Email).\nClick a column to toggle it."
         
         # If we are updating an existing message
         try:
@@ -191,113 +378,309 @@ class EmailBot:
     async def handle_column_selection(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
         await query.answer()
+        session = self.sessions.get(update.effective_chat.id)
+        if session is None:
+            return await self.session_expired(update)
         data = query.data
         
         if data == "done_cols":
-            if not self.selected_columns:
+            if not session.selected_columns:
                 await query.answer("Please select at least one column!", show_alert=True)
                 return WAITING_FOR_COLUMN_SELECTION
             
-            cols_str = ", ".join(self.selected_columns)
+            cols_str = ", ".join(session.selected_columns)
             await query.edit_message_text(text=f"Selected columns: {cols_str}\n\nNow, please tell me what kind of email you want to send to your prospects.")
             return WAITING_FOR_PROMPT
             
         if data.startswith("col|"):
             col_name = data.split("|")[1]
-            if col_name in self.selected_columns:
-                self.selected_columns.remove(col_name)
+            if col_name in session.selected_columns:
+                session.selected_columns.remove(col_name)
             else:
-                self.selected_columns.append(col_name)
+                session.selected_columns.append(col_name)
+            self.sessions.save(session)
             
-            await self.show_column_selection(query, context)
+            await self.show_column_selection(query, context, session)
             return WAITING_FOR_COLUMN_SELECTION
 
-    async def process_sending(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        sheet_name = self.selected_sheet
-        # Read Sheet (A:Z) - assuming max 26 columns for now, or just read all
-        range_name = f"{sheet_name}!A:Z"
-        all_rows = self.google_service.read_sheet(config.GOOGLE_SHEET_ID, range_name)
-        
-        chat_id = update.effective_chat.id
-        
-        if not all_rows:
-            await context.bot.send_message(chat_id=chat_id, text=f"Error: Could not read data from '{sheet_name}'.")
-            return
-        
-        headers = all_rows[0]
+    def start_background(self, bot):
+        self.notifier.start(bot)
+        for campaign in self.campaigns.start(bot):
+            self.notifier.post(campaign.chat_id, f"Campaign #{campaign.id} was interrupted by a restart after sending "
+                                                 f"{campaign.sent or 0} emails and may have partially sent. It was not "
+                                                 f"restarted: without a send journal it would email the same people again.")
+
+    async def run_campaign(self, campaign, control, bot):
+        """CampaignScheduler runner: sends one queued campaign and returns its summary."""
+        session = Session.from_dict(campaign.chat_id, campaign.session)
+        label = f"Campaign #{campaign.id}"
+        try:
+            return await self.process_sending(campaign.chat_id, session, campaign.personalize, control, label=label)
+        except CampaignFailed:
+            raise  # the chat already has the summary
+        except Exception as e:
+            # E.g. a revoked Google token: the scheduler marks it failed, the operator must hear about it too
+            self.notifier.flush(campaign.chat_id, label)
+            self.notifier.post(campaign.chat_id, f"{label} failed: {type(e).__name__}: {e}\n"
+                                                 f"Sent {control.progress.sent} emails before it stopped.")
+            raise
+
+    async def report_progress(self, chat_id, label, control):
+        # One message per campaign, edited in place by the notifier
+        while True:
+            await asyncio.sleep(config.NOTIFY_PROGRESS_SECONDS)
+            state = " (paused)" if control.paused else ""
+            self.notifier.progress(chat_id, label, f"{label}{state}: {control.progress.summary(eta=not control.paused)}")
+
+    async def process_sending(self, chat_id, session, personalize=False, control=None, label="Campaign"):
+        # Telegram messages are queued on the notifier: nothing here waits on Telegram while sending
+        sheet_name = session.selected_sheet
+        progress = control.progress if control else None
+
+        # Header row decides how many columns each page reads (no more A:Z cap)
+        try:
+            headers = await self.google_service.get_sheet_headers(config.GOOGLE_SHEET_ID, sheet_name, use_cache=False)
+        except SheetReadError as e:
+            raise CampaignFailed(await self.report_read_failure(chat_id, label, control, e))
+        if not headers:
+            self.notifier.post(chat_id, f"{label}: Error: Could not read data from '{sheet_name}'.")
+            return f"Could not read data from '{sheet_name}'"
+
         # Map header name to index
         header_map = {h.strip(): i for i, h in enumerate(headers)}
-        
-        # Find email column index
-        email_col_index = -1
-        for col in self.selected_columns:
-            if "email" in col.lower():
-                email_col_index = header_map.get(col)
-                break
-        
-        # Fallback: look for 'email' in any header if not explicitly selected (though it should be)
-        if email_col_index == -1:
-             for h, i in header_map.items():
-                 if "email" in h.lower():
-                     email_col_index = i
-                     break
-        
+        email_col_index = find_email_column(header_map, session.selected_columns)
         if email_col_index == -1:
-            await context.bot.send_message(chat_id=chat_id, text="Error: Could not identify an 'Email' column. Please make sure one of the columns is named 'Email'.")
-            return
+            self.notifier.post(chat_id, f"{label}: Error: Could not identify an 'Email' column. Please make sure one of the columns is named 'Email'.")
+            return "No 'Email' column"
 
-        self.prospects = []
-        skipped_count = 0
-        
-        # Start from row 1 (skip headers)
-        for row in all_rows[1:]:
-            if not row: continue
-            
-            # Get email
-            if len(row) > email_col_index:
-                email = row[email_col_index].strip()
-                if "@" not in email:
-                    skipped_count += 1
-                    continue
-                
-                # Build prospect dict for replacements
-                prospect_data = {"email": email}
-                for col_name in self.selected_columns:
-                    idx = header_map.get(col_name)
-                    if idx is not None and len(row) > idx:
-                        prospect_data[col_name] = row[idx].strip()
-                    else:
-                        prospect_data[col_name] = "" # Empty if missing
-                
-                self.prospects.append(prospect_data)
+        # Snapshot the approved draft so a new /start in this chat can't change it mid-run.
+        # It is minified and its text part built, placeholders compiled and the MIME structure
+        # encoded once for the whole campaign.
+        optimized = OptimizedDraft(session.current_draft) if config.OPTIMIZE_HTML else None
+        html = optimized.html if optimized else session.current_draft
+        template = CompiledTemplate(html, ["email"] + session.selected_columns)
+        builder = MessageBuilder(session.email_subject, template, text=optimized.text if optimized else None)
+        selected_columns = list(session.selected_columns)
+        report = SkipReport()
+        ingestor = ProspectIngestor(header_map, email_col_index, selected_columns, report)
+
+        # Recipients who already got this exact campaign (e.g. before a worker restart) are skipped
+        campaign = campaign_id(config.GOOGLE_SHEET_ID, sheet_name, session.email_subject, session.current_draft,
+                               *(["personalized"] if personalize else []))
+        already_sent = await asyncio.to_thread(self.journal.delivered, campaign) if self.journal else set()
+        resumed = 0
+        rows = 0
+        if progress or config.SEND_SHARDS > 1:
+            # Data rows in the sheet: an upper bound for the remaining count and ETA
+            try:
+                rows = max(0, await self.google_service.get_sheet_row_count(config.GOOGLE_SHEET_ID, sheet_name) - 1)
+            except SheetReadError as e:
+                raise CampaignFailed(await self.report_read_failure(chat_id, label, control, e))
+            if progress:
+                progress.total = rows
+        # Big non-personalized campaigns are spread over worker processes and sender accounts
+        sharded = config.SEND_SHARDS > 1 and not personalize and rows >= config.SHARD_MIN_ROWS
+
+        read_error = None
+
+        async def jobs():
+            nonlocal resumed, read_error
+            # Pages stream in while earlier ones are being sent, so memory stays flat on big sheets
+            pages = self.google_service.iter_sheet_pages(config.GOOGLE_SHEET_ID, sheet_name, len(headers))
+            try:
+                async for rows in pages:
+                    # Addresses come back normalized (trimmed, case-folded), validated and deduplicated
+                    for prospect in ingestor.ingest(rows):
+                        if prospect['email'] in already_sent:
+                            resumed += 1
+                            continue
+                        # Waits here while the campaign is paused; stops taking recipients once cancelled
+                        if control and not await control.checkpoint():
+                            return
+                        yield prospect['email'], prospect
+                    if progress:
+                        progress.skipped = report.skipped + resumed
+            except SheetReadError as e:
+                # A page failed even after retries: stop taking recipients, the campaign is reported as failed
+                read_error = e
+
+        if already_sent:
+            self.notifier.post(chat_id, f"{label}: Resuming, {len(already_sent)} recipients already received this email and will be skipped.")
+        self.notifier.post(chat_id, f"{label}: Reading prospects from '{sheet_name}' and sending emails..."
+                           + (f"\n{optimized.summary()}" if optimized and not personalize else ""))
+
+        async def on_success(email, message_id):
+            metrics.inc("emails_sent_total")
+            if progress:
+                progress.record(True)
+            if self.journal:
+                self.journal.record(campaign, email, True, message_id)
+
+        async def on_failure(email, error_msg):
+            metrics.inc("emails_failed_total")
+            if progress:
+                progress.record(False)
+            if self.journal:
+                self.journal.record(campaign, email, False, error_msg)
+            # Coalesced with the other failures of the next few seconds into one message
+            self.notifier.failure(chat_id, email, error_msg, label)
+
+        # Messages are encoded on the worker threads, right before they go out
+        gmail = self.google_service.service
+        pipeline = None
+        reporter = None
+        if control and config.NOTIFY_PROGRESS_SECONDS > 0:
+            reporter = asyncio.create_task(self.report_progress(chat_id, label, control))
+        try:
+            if personalize:
+                # Drafts are generated concurrently and each one is sent as soon as it is ready,
+                # so Gmail sends overlap with the model calls for later prospects
+                pipeline = PersonalizationPipeline(self.openai_service, self.draft_arguments(session), session.current_draft)
+                names = ["email"] + selected_columns
+
+                async def prospects():
+                    async for _, prospect in jobs():
+                        yield prospect
+
+                async def personalized_jobs():
+                    async for prospect, html in pipeline.run(prospects()):
+                        yield prospect['email'], prospect, html
+
+                def build_personalized(to, prospect, html):
+                    # Leftover [Column] placeholders in the personalized draft are still filled from the sheet
+                    if config.OPTIMIZE_HTML:
+                        draft = OptimizedDraft(html)
+                        return MessageBuilder(session.email_subject, draft.html, names, text=draft.text).build_raw(to, prospect)
+                    return MessageBuilder(session.email_subject, html, names).build_raw(to, prospect)
+
+                sender = BulkSender(
+                    lambda to, prospect, html: gmail.send_raw(to, build_personalized(to, prospect, html)),
+                    batch_fn=lambda group: gmail.send_raw_batch([(job[0], build_personalized(*job)) for job in group]),
+                )
+                stats = await sender.run(personalized_jobs(), on_failure=on_failure, on_success=on_success)
+            elif sharded:
+                sharder = ShardedSender()
+                spec = sharder.spec(campaign, session.email_subject, html, template.names,
+                                    text=optimized.text if optimized else None)
+                self.notifier.post(chat_id, f"{label}: {rows:,} rows, sending in {sharder.shards} shards "
+                                            f"from {len(set(sharder.accounts))} sender accounts.")
+                counted = [0, 0]
+
+                def on_progress(shards):
+                    # Workers journal their own deliveries; the counters are summed from their leases
+                    metrics.inc("emails_sent_total", max(0, shards.sent - counted[0]))
+                    metrics.inc("emails_failed_total", max(0, shards.failed - counted[1]))
+                    counted[:] = shards.sent, shards.failed
+                    if progress:
+                        progress.update(shards.sent, shards.failed)
+
+                try:
+                    stats = await sharder.run(jobs(), spec, control, on_progress)
+                finally:
+                    sharder.store.close()
             else:
-                skipped_count += 1
-        
-        if not self.prospects:
-            await context.bot.send_message(chat_id=chat_id, text="Error: No valid prospects found.")
+                sender = BulkSender(
+                    lambda to, prospect: gmail.send_raw(to, builder.build_raw(to, prospect)),
+                    batch_fn=lambda group: gmail.send_raw_batch([(to, builder.build_raw(to, prospect)) for to, prospect in group]),
+                )
+                stats = await sender.run(jobs(), on_failure=on_failure, on_success=on_success)
+        finally:
+            if reporter:
+                reporter.cancel()
+        if self.journal:
+            await asyncio.to_thread(self.journal.flush)
+
+        if progress:
+            progress.skipped = report.skipped + resumed
+        if read_error:
+            summary = (f"{label} stopped after sending {stats.sent} emails: {read_error}. "
+                       f"Rows from {read_error.first_row} on were not emailed.")
+            if self.journal:
+                summary += f" Send {retry_command(control)} to retry; recipients already emailed are skipped."
+        elif not report.accepted:
+            self.notifier.post(chat_id, f"{label}: Error: No valid prospects found.")
+            return "No valid prospects found"
+        elif sharded and stats.unsent:
+            # Shards that failed (e.g. a sender account's token was revoked) left recipients behind
+            summary = f"{label} stopped after sending {stats.sent} emails: {stats.unsent:,} recipients were not emailed."
+            if self.journal:
+                summary += f" Send {retry_command(control)} to retry; recipients already emailed are skipped."
+        elif control and control.cancelled:
+            summary = f"{label} cancelled after sending {stats.sent} emails."
+        else:
+            summary = f"{label} done! Sent {stats.sent} emails."
+        summary += f"\n{stats.summary()}\n{report.summary()}" + (f", {resumed} already sent earlier" if resumed else "")
+        if pipeline:
+            summary += f"\nPersonalized {pipeline.generated} drafts, estimated spend ${pipeline.guard.spent:.2f}"
+            if pipeline.failed:
+                summary += f"\n{len(pipeline.failed)} drafts failed to generate (e.g. {pipeline.failed[0][0]}: {pipeline.failed[0][1]})"
+            if pipeline.spend_exceeded:
+                summary += f"\nStopped generating at the ${pipeline.guard.max_usd:.2f} spend limit; {pipeline.not_generated} prospects were not emailed"
+        if progress:
+            # Leave the progress message (if one was posted) on the final counts
+            self.notifier.progress(chat_id, label, f"{label}: {progress.summary(eta=False)}", edit_only=True)
+        # The last failure digest goes out before the summary
+        self.notifier.flush(chat_id, label)
+        self.notifier.post(chat_id, summary)
+        # Only what this campaign queued so far: another campaign in the chat may still be failing
+        await self.notifier.drain(chat_id, label)
+        self.notifier.end_progress(chat_id, label)
+        if read_error or (sharded and stats.unsent):
+            raise CampaignFailed(summary)
+        return summary
+
+    async def report_read_failure(self, chat_id, label, control, error):
+        """Tells the chat a campaign failed before sending because the sheet could not be read. Returns the summary."""
+        summary = f"{label} failed before sending any email: {error}."
+        if self.journal:
+            summary += f" Send {retry_command(control)} to retry."
+        self.notifier.post(chat_id, summary)
+        await self.notifier.drain(chat_id, label)
+        return summary
+
+    def campaign_arg(self, context):
+        """Optional campaign id from /pause, /resume or /cancel (e.g. "/cancel 12" or "/cancel #12")."""
+        if context.args:
+            try:
+                return int(context.args[0].lstrip('#'))
+            except ValueError:
+                return None
+        return None
+
+    async def campaign_status(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        await update.message.reply_text(self.campaigns.status_text(update.effective_chat.id)[:4000])
+
+    async def pause_campaign(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        campaign = self.campaigns.pause(update.effective_chat.id, self.campaign_arg(context))
+        if campaign is None:
+            await update.message.reply_text("No running or queued campaign to pause.")
             return
-        
-        await context.bot.send_message(chat_id=chat_id, text=f"Found {len(self.prospects)} prospects. Sending emails...")
-        
-        count = 0
-        for prospect in self.prospects:
-            # Personalize the email
-            final_email = self.current_draft
-            for col_name, value in prospect.items():
-                # Replace [Column Name] with value
-                # Case insensitive replacement would be better but let's stick to exact match for now based on selection
-                final_email = final_email.replace(f"[{col_name}]", value)
-            
-            # Also try standard [Prospect Name] if 'Name' or 'Nom' was selected
-            # This is a fallback/helper if the prompt used generic placeholders
-            
-            success, error_msg = self.google_service.send_email(prospect['email'], self.email_subject, final_email)
-            if success:
-                count += 1
-            else:
-                await context.bot.send_message(chat_id=chat_id, text=f"Failed to send to {prospect['email']}: {error_msg}")
-        
-        await context.bot.send_message(chat_id=chat_id, text=f"Done! Sent {count} emails.")
+        await update.message.reply_text(f"Campaign #{campaign.id} paused (emails already in flight still go out). Use /resume to continue.")
+
+    async def resume_campaign(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        # A failed campaign can run again only if the journal will skip who already got it
+        campaign = self.campaigns.resume(update.effective_chat.id, self.campaign_arg(context),
+                                         retry_failed=self.journal is not None)
+        if campaign is None:
+            await update.message.reply_text("No paused campaign to resume." if self.journal is None
+                                            else "No paused or failed campaign to resume.")
+            return
+        if campaign.status == "queued":
+            await update.message.reply_text(f"Campaign #{campaign.id} is queued again (position {self.campaigns.queue_position(campaign)}).")
+        else:
+            await update.message.reply_text(f"Campaign #{campaign.id} resumed.")
+
+    async def cancel_campaign(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        campaign = self.campaigns.cancel(update.effective_chat.id, self.campaign_arg(context))
+        if campaign is None:
+            await update.message.reply_text("No active campaign to cancel.")
+            return
+        await update.message.reply_text(f"Campaign #{campaign.id} cancelled. Recipients already emailed are kept in the journal.")
+
+    async def refresh(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        # Drop cached Doc context and sheet metadata so the next /start reads them fresh
+        self.google_service.invalidate_cache()
+        await update.message.reply_text("Cache cleared. The next /start will reload the Google Doc and sheet list.")
 
     async def debug_bot(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         status_msg = "--- DEBUG STATUS ---\n"
@@ -321,17 +704,52 @@ class EmailBot:
         else:
              status_msg += "❌ token.json MISSING.\n"
              
-        # Check Google Service Creds
-        if self.google_service.creds and self.google_service.creds.valid:
+        # Check Google Service Creds (without loading them: that may start the interactive login)
+        google = self.google_service.service
+        if not google.creds_loaded:
+            status_msg += "⏳ Google Credentials not loaded yet (loaded on first Google call).\n"
+        elif google.creds and google.creds.valid:
             status_msg += "✅ Google Credentials valid.\n"
         else:
             status_msg += "❌ Google Credentials invalid or not loaded.\n"
-            
-        await update.message.reply_text(status_msg)
+
+        if self.startup_seconds is not None:
+            status_msg += f"Startup: {self.startup_seconds * 1000:.0f}ms\n"
+        status_msg += f"Google clients built: {', '.join(google.built_clients()) or 'none yet'}\n"
+        auth = google.auth.stats()
+        if auth["token_seconds_left"] is not None:
+            status_msg += f"Google token: expires in {auth['token_seconds_left'] / 60:.0f} min, {auth['refreshes']} background refreshes ({auth['refresh_failures']} failed)\n"
+        if auth["error"]:
+            status_msg += f"❌ Google token can't be refreshed ({auth['error']}). Replace token.json / GOOGLE_TOKEN_JSON.\n"
+        status_msg += f"Google transports: {auth['transports']}/{auth['pool_size']} created, {auth['in_use']} in use, {auth['pool_waits']} waits\n"
+        status_msg += f"OpenAI client: {'ready' if self.openai_service._client is not None else 'not created yet'}\n"
+
+        status_msg += f"Active sessions: {len(self.sessions)}\n"
+        campaigns = self.campaigns.store.counts()
+        status_msg += f"Campaigns: {', '.join(f'{n} {status}' for status, n in sorted(campaigns.items())) or 'none yet'}"
+        status_msg += f" ({len(self.campaigns.tasks)}/{self.campaigns.workers} workers busy)\n"
+        status_msg += f"Telegram notifications pending: {self.notifier.pending()}\n"
+        cache = self.google_service.service.cache
+        status_msg += f"Google cache: {len(cache)} entries, {cache.hits} hits, {cache.misses} misses\n"
+        drafts = self.openai_service.cache
+        if drafts is not None:
+            status_msg += f"Draft cache: {len(drafts)} entries, {drafts.hits} hits, {drafts.misses} misses\n"
+        else:
+            status_msg += "Draft cache: disabled\n"
+
+        status_msg += "\n--- METRICS ---\n" + metrics.summary()
+        # Telegram messages are capped at 4096 characters
+        await update.message.reply_text(status_msg[:4000])
 
 if __name__ == '__main__':
     bot = EmailBot()
-    application = ApplicationBuilder().token(config.TELEGRAM_BOT_TOKEN).build()
+    metrics.start_exporters()
+
+    async def start_campaigns(application):
+        # Campaigns left queued or running by the previous process start again
+        bot.start_background(application.bot)
+
+    application = ApplicationBuilder().token(config.TELEGRAM_BOT_TOKEN).post_init(start_campaigns).build()
     
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler('start', bot.start)],
@@ -347,9 +765,18 @@ if __name__ == '__main__':
                 CallbackQueryHandler(bot.button_handler)
             ]
         },
-        fallbacks=[CommandHandler('start', bot.start)]
+        fallbacks=[CommandHandler('start', bot.start)],
+        # Run handlers as tasks so a slow OpenAI/Google call in one chat doesn't hold up the others
+        block=False
     )
     
-    application.add_handler(CommandHandler('debug', bot.debug_bot))
+    application.add_handler(CommandHandler('debug', bot.debug_bot, block=False))
+    application.add_handler(CommandHandler('refresh', bot.refresh, block=False))
+    application.add_handler(CommandHandler('status', bot.campaign_status, block=False))
+    application.add_handler(CommandHandler('pause', bot.pause_campaign, block=False))
+    application.add_handler(CommandHandler('resume', bot.resume_campaign, block=False))
+    application.add_handler(CommandHandler('cancel', bot.cancel_campaign, block=False))
     application.add_handler(conv_handler)
+    bot.startup_seconds = time.perf_counter() - STARTUP_STARTED
+    logging.info("Startup took %.0fms (Google and OpenAI clients are created on first use)", bot.startup_seconds * 1000)
     application.run_polling()
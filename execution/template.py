@@ -0,0 +1,49 @@
+import re
+
+
+class CompiledTemplate:
+    """
+    An approved draft pre-split into literal segments and [Column] placeholder slots.
+    Placeholders match case-insensitively, so [name], [Name] and [NAME] all fill from "Name".
+    Rendering a prospect is a single join instead of one full-string replace per column.
+    """
+
+    def __init__(self, text, names):
+        self.text = text
+        self.names = list(names)
+        # Lower-cased placeholder -> key in the prospect dict (first spelling wins)
+        lookup = {}
+        for name in names:
+            lookup.setdefault(name.lower(), name)
+
+        self.parts = []
+        self.slots = []  # (index into parts, prospect key, original placeholder text)
+        if not lookup:
+            self.parts.append(text)
+            return
+
+        # Longest names first so "[Company Name]" wins over "[Company" style prefixes
+        alternatives = sorted((re.escape(name) for name in lookup), key=len, reverse=True)
+        pattern = re.compile(r"\[(" + "|".join(alternatives) + r")\]", re.IGNORECASE)
+        position = 0
+        for match in pattern.finditer(text):
+            if match.start() > position:
+                self.parts.append(text[position:match.start()])
+            self.slots.append((len(self.parts), lookup[match.group(1).lower()], match.group(0)))
+            self.parts.append(match.group(0))
+            position = match.end()
+        if position < len(text):
+            self.parts.append(text[position:])
+
+    @property
+    def placeholders(self):
+        return {key for _, key, _ in self.slots}
+
+    def render(self, values):
+        """Fills every slot from `values`; placeholders with no value are left as written."""
+        if not self.slots:
+            return self.text
+        parts = self.parts.copy()
+        for index, key, original in self.slots:
+            parts[index] = values.get(key, original)
+        return "".join(parts)